@@ -1,20 +1,30 @@
 import sys
 import json
 from datetime import datetime, timezone
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future
 
 from PySide6.QtWidgets import ( QApplication, QMainWindow, QPushButton,QLineEdit,
     QWidget, QDialog, QDialogButtonBox, QVBoxLayout, QHBoxLayout, QTableView,
     QMessageBox, QTabWidget, QLabel, QFileDialog, QAbstractItemView, QStyle,
-    QAbstractItemDelegate, QStyledItemDelegate, QListWidget, QGridLayout, QFrame)
-from PySide6.QtGui import QAction, QPainter, QColor, Qt
+    QAbstractItemDelegate, QStyledItemDelegate, QListWidget, QGridLayout, QFrame, QProgressDialog)
+from PySide6.QtGui import QAction, QActionGroup, QPainter, QColor, Qt
 from PySide6.QtCore import QRect, Signal, Slot, QPoint
 
 from models.transaction import Transaction, TxTableModel
 from models.acquisition import Acquisition, AcqTableModel
 from models.disposition import Disposition, DisTableModel
-from models.stash import Stash, StatesTableModel, StashState
+from models.stash import Stash, StatesTableModel, StashState, LazyStates
 from models.form8949 import Form8949TableModel
+from models.form8949_export import stash_8949_entries, write_form8949_csv, write_form8949_txf
+from models.adjustments import AdjustmentEngine, WashSaleRule
+from models.lot_policy import LOT_POLICIES
+from models.dedup import import_report
+from models.stash_io import read_stash_file, compression_for_filename
+from models.stash_db import StashDatabase, is_stash_database
+from models.stash_journal import StashJournal
+from models.coinbase_pro import import_account_reports
+from models.csv_import import CsvMapping, read_csv_stash
 
 class BorderHighlightItemDelegate(QStyledItemDelegate):
     def __init__(self) -> None:
@@ -35,7 +45,7 @@ class BorderHighlightItemDelegate(QStyledItemDelegate):
 
 class TxPage(QWidget):
 
-    model_changed_sig = Signal(object) # param is new transactionList
+    model_changed_sig = Signal(object, float) # params are new transactionList, earliest changed timestamp
 
     # virtuals for subclass
 
@@ -133,9 +143,10 @@ class TxPage(QWidget):
         edit_row = self.model.row_under_edit
         if edit_row != -1:
             topIdx = self.table.indexAt(QPoint())
+            changed_ts = min(self.model.transactionsList[edit_row].timestamp, self.model.edit_buff.timestamp)
             self.model.accept_edit()
             # TODO: figure this one out
-            self.model_changed_sig.emit(self.model.transactionsList)  # main window catches this, rebuilds stash, and updates views
+            self.model_changed_sig.emit(self.model.transactionsList, changed_ts)  # main window catches this, rebuilds stash, and updates views
             self.disable_edit_gui(edit_row)
             self.table.scrollTo(topIdx, QAbstractItemView.PositionAtTop)
 
@@ -150,8 +161,8 @@ class TxPage(QWidget):
 
     def add_row(self) -> None:
         new_acq = self.new_transaction() # Acquisition(datetime.timestamp(datetime.now(timezone.utc)), self.model.asset, 0, 0, 0, "", "New Acquisition")
-        self.model.transactionsList.append(new_acq) # TODO: fix fugliness
-        self.model_changed_sig.emit(self.model.transactionsList) # main window catches this, rebuilds stash, and updates views
+        self.model.insert_transaction(new_acq)
+        self.model_changed_sig.emit(self.model.transactionsList, new_acq.timestamp) # main window catches this, rebuilds stash, and updates views
 
     def delete_row(self) -> None:
         sel_model = self.table.selectionModel()
@@ -168,8 +179,9 @@ class TxPage(QWidget):
             button = dlg.exec()
             if button == QMessageBox.Yes:
                 del_row = idx_list[0].row()
-                del self.model.transactionsList[del_row]
-                self.model_changed_sig.emit(self.model.transactionsList)
+                changed_ts = self.model.transactionsList[del_row].timestamp
+                self.model.delete_transaction(del_row)
+                self.model_changed_sig.emit(self.model.transactionsList, changed_ts)
 
     def toggle_transaction(self):
         sel_model = self.table.selectionModel()
@@ -179,7 +191,7 @@ class TxPage(QWidget):
             return
         del_row = idx_list[0].row()
         self.model.toggle_disabled(del_row)
-        self.model_changed_sig.emit(self.model.transactionsList)
+        self.model_changed_sig.emit(self.model.transactionsList, self.model.transactionsList[del_row].timestamp)
 
 
 class AcquisitionsPage(TxPage):
@@ -381,11 +393,20 @@ class Form8949Page(QWidget):
 
 
 class MainWindow(QMainWindow):
+
+    stash_saved_sig = Signal(object) # param is the Future of a background save, see save_stash()
+
     def __init__(self):
         super().__init__()
 
         #self.stash = self.load_stash('new_stash.json'
         self.stash = Stash('BTC','Default Stash')
+        # set if the stash is in a database or has a journal, which then gets each change as it's made
+        self.stash_storage: StashDatabase | StashJournal = None
+        # stash files are written on a worker thread, one save at a time, so big ones don't freeze the window
+        self.save_executor = ThreadPoolExecutor(max_workers=1)
+        self.save_job: Tuple[StashJournal, Future] = None # the save being written, if any
+        self.stash_saved_sig.connect(self.on_stash_saved)
 
         self.resize(1024, 768)
         self.setWindowTitle(f'{self.stash.asset}: {self.stash.title}')
@@ -403,21 +424,65 @@ class MainWindow(QMainWindow):
         import_stash_action = QAction("&Import Data", self)
         import_stash_action.triggered.connect(self.import_stash)
 
+        import_cbpro_action = QAction("Import &Coinbase Pro Reports", self)
+        import_cbpro_action.triggered.connect(self.import_coinbase_pro)
+
+        import_csv_action = QAction("Import C&SV with Column Mapping", self)
+        import_csv_action.triggered.connect(self.import_csv)
+
+        export_8949_action = QAction("&Export Form 8949", self)
+        export_8949_action.triggered.connect(self.export_form8949)
+
         file_menu = menu.addMenu("&File")
         file_menu.addAction(new_stash_action)
         file_menu.addAction(open_stash_action)
         file_menu.addAction(save_stash_action)
         file_menu.addAction(import_stash_action)
+        file_menu.addAction(import_cbpro_action)
+        file_menu.addAction(import_csv_action)
+        file_menu.addAction(export_8949_action)
+
+        self.fixed_point_action = QAction("E&xact (Fixed-Point) Lot Math", self)
+        self.fixed_point_action.setCheckable(True)
+        self.fixed_point_action.setChecked(self.stash.fixed_point)
+        self.fixed_point_action.toggled.connect(self.set_fixed_point)
+
+        self.lazy_states_action = QAction("&Low-Memory States (for Huge Stashes)", self)
+        self.lazy_states_action.setCheckable(True)
+        self.lazy_states_action.setChecked(self.stash.checkpoint_interval != 0)
+        self.lazy_states_action.toggled.connect(self.set_lazy_states)
+
+        self.wash_sale_action = QAction("&Wash Sale Adjustments", self)
+        self.wash_sale_action.setCheckable(True)
+        self.wash_sale_action.setChecked(WashSaleRule.name in self.stash.adjustment_rules)
+        self.wash_sale_action.toggled.connect(self.set_wash_sale)
+
+        options_menu = menu.addMenu("&Options")
+        options_menu.addAction(self.fixed_point_action)
+        options_menu.addAction(self.wash_sale_action)
+        options_menu.addAction(self.lazy_states_action)
+
+        lot_policy_menu = options_menu.addMenu("&Lot Selection")
+        self.lot_policy_group = QActionGroup(self)
+        for name in LOT_POLICIES:
+            policy_action = QAction(name, self)
+            policy_action.setCheckable(True)
+            policy_action.setChecked(name == self.stash.lot_policy.name)
+            self.lot_policy_group.addAction(policy_action)
+            lot_policy_menu.addAction(policy_action)
+        self.lot_policy_group.triggered.connect(self.set_lot_policy)
 
         tabs = QTabWidget()
         self.setCentralWidget(tabs)
 
         self.acqPage = AcquisitionsPage(self.stash.asset, self.stash.acquisitions)
-        self.acqPage.model_changed_sig[object].connect(self.on_acq_model_changed)
+        self.acqPage.model_changed_sig[object, float].connect(self.on_acq_model_changed)
+        self.acqPage.model.transaction_changed.connect(self.on_transaction_changed)
         tabs.addTab(self.acqPage, "Acquisitions")
 
         self.dispPage = DispositionsPage(self.stash.asset, self.stash.dispositions)
-        self.dispPage.model_changed_sig[object].connect(self.on_disp_model_changed)
+        self.dispPage.model_changed_sig[object, float].connect(self.on_disp_model_changed)
+        self.dispPage.model.transaction_changed.connect(self.on_transaction_changed)
         tabs.addTab(self.dispPage, "Dispositions")
 
         self.txPage = TransactionStatesPage(self.stash.states)
@@ -426,28 +491,85 @@ class MainWindow(QMainWindow):
         self.form8949Page = Form8949Page(self.stash.states)
         tabs.addTab(self.form8949Page, "Form 8949")
 
-    @Slot(object, object)
-    def on_acq_model_changed(self, new_acqs: List[Acquisition]) -> None:
-        self.on_model_changed(new_acqs, None)
+    @Slot(object, float)
+    def on_acq_model_changed(self, new_acqs: List[Acquisition], changed_timestamp: float) -> None:
+        self.on_model_changed(new_acqs, None, changed_timestamp)
+
+    @Slot(object, float)
+    def on_disp_model_changed(self, new_disps:List[Disposition], changed_timestamp: float) -> None:
+        self.on_model_changed(None, new_disps, changed_timestamp)
 
     @Slot(object, object)
-    def on_disp_model_changed(self, new_disps:List[Disposition]) -> None:
-        self.on_model_changed(None, new_disps)
+    def on_transaction_changed(self, old_tx: Transaction, new_tx: Transaction) -> None:
+        if self.stash_storage:
+            try:
+                self.stash_storage.on_transaction_changed(old_tx, new_tx)
+            except Exception as ex:
+                QMessageBox.critical(self, "Oops", f"Could not save the change: {ex}")
+
+    def _save_settings(self) -> None:
+        if self.stash_storage:
+            try:
+                self.stash_storage.save_settings(self.stash)
+            except Exception as ex:
+                QMessageBox.critical(self, "Oops", f"Could not save the settings: {ex}")
 
-    def on_model_changed(self, new_acqs: List[Acquisition], new_disps:List[Disposition]) -> None:
+    def _set_stash_storage(self, stash_storage: StashDatabase | StashJournal) -> None:
+        if self.stash_storage:
+            self.stash_storage.close()
+        self.stash_storage = stash_storage
+
+    def on_model_changed(self, new_acqs: List[Acquisition], new_disps:List[Disposition],
+                         changed_timestamp: float = None) -> None:
 
         if new_acqs != None:
             self.stash.acquisitions = new_acqs
         if new_disps!= None:
             self.stash.dispositions = new_disps
 
-        self.stash.update()  # sorts transactions and builds states
+        self.stash.update(changed_timestamp)  # sorts transactions and (re)builds states from changed_timestamp on
         self.acqPage.reset_data(self.stash.asset, self.stash.acquisitions)
         self.dispPage.reset_data(self.stash.asset, self.stash.dispositions)
         self.txPage.reset_data(self.stash.asset, self.stash.states)
+        self.form8949Page.model.adjustments = AdjustmentEngine.from_names(self.stash.adjustment_rules)
         self.form8949Page.reset_data(self.stash.states)
         self.centralWidget().update()
 
+    def set_fixed_point(self, checked: bool) -> None:
+        if self.stash.fixed_point != checked:
+            self.stash.fixed_point = checked
+            self._save_settings()
+            self.on_model_changed(None, None) # full rebuild
+
+    def set_wash_sale(self, checked: bool) -> None:
+        if (WashSaleRule.name in self.stash.adjustment_rules) != checked:
+            if checked:
+                self.stash.adjustment_rules.append(WashSaleRule.name)
+            else:
+                self.stash.adjustment_rules.remove(WashSaleRule.name)
+            self._save_settings()
+            self.on_model_changed(None, None)
+
+    def set_lazy_states(self, checked: bool) -> None:
+        interval = LazyStates.DEFAULT_INTERVAL if checked else 0
+        if self.stash.checkpoint_interval != interval:
+            self.stash.checkpoint_interval = interval
+            self.on_model_changed(None, None) # full rebuild
+
+    def set_lot_policy(self, action: QAction) -> None:
+        if self.stash.lot_policy.name != action.text():
+            self.stash.lot_policy = LOT_POLICIES[action.text()]()
+            self._save_settings()
+            self.on_model_changed(None, None) # full rebuild
+
+    def _sync_options_menu(self) -> None:
+        """Show the settings saved with a newly opened stash. Low-memory states is an app setting."""
+        self.fixed_point_action.setChecked(self.stash.fixed_point)
+        self.wash_sale_action.setChecked(WashSaleRule.name in self.stash.adjustment_rules)
+        self.stash.checkpoint_interval = LazyStates.DEFAULT_INTERVAL if self.lazy_states_action.isChecked() else 0
+        for action in self.lot_policy_group.actions():
+            action.setChecked(action.text() == self.stash.lot_policy.name)
+
     def new_stash(self):
 
         class NewDlg(QDialog):
@@ -475,7 +597,9 @@ class MainWindow(QMainWindow):
         dlg = NewDlg()
         if dlg.exec():
             self.stash = Stash( dlg.asset_edit.text(), dlg.title_edit.text() )
+            self._set_stash_storage(None)
             self.setWindowTitle(f'{self.stash.asset}: {self.stash.title}')
+            self._sync_options_menu()
             self.on_model_changed(None, None) # uses self.whatever if none
 
     def open_stash(self):
@@ -487,15 +611,40 @@ class MainWindow(QMainWindow):
         if stash:
             self.stash = stash
             self.setWindowTitle(f'{self.stash.asset}: {self.stash.title}')
+            self._sync_options_menu()
             self.on_model_changed(None, None) # TODO: this call already happens in self.load_stash()
 
+    def read_stash_file(self, filename: str, label: str, journal: StashJournal = None) -> Stash:
+        """Streams a stash in (see stash_io.read_stash), with a progress dialog.
+           With a journal, it's the journal's base file, and the journal is replayed onto it.
+           This should be called inside a try block
+        """
+        progress_dlg = QProgressDialog(label, None, 0, 1000, self)
+        progress_dlg.setMinimumDuration(500) # only shows up for big files
+
+        def on_progress(bytes_read: int, total_bytes: int) -> None:
+            if total_bytes:
+                progress_dlg.setValue(min(999, 1000 * bytes_read // total_bytes))
+            QApplication.processEvents()
+
+        try:
+            if journal:
+                return journal.load_stash(progress=on_progress)
+            return read_stash_file(filename, progress=on_progress)
+        finally:
+            progress_dlg.close()
+
     def load_stash(self, filename: str) -> Stash:
         stash = {}
 
         try:
-            with open(filename, 'r') as f:
-                jsonData = json.load(f) # a List of Dicts
-            stash = Stash.from_json_dict(jsonData)
+            if is_stash_database(filename):
+                stash_storage = StashDatabase(filename)
+                stash = stash_storage.load_stash()
+            else:
+                stash_storage = StashJournal(filename) # replays any changes made since the last save
+                stash = self.read_stash_file(filename, "Loading stash...", stash_storage)
+            self._set_stash_storage(stash_storage)
             stash.update()  # sorts transactions and builds states
         except Exception as ex:
              QMessageBox.critical(self, "Oops", str(ex))
@@ -508,35 +657,157 @@ class MainWindow(QMainWindow):
         )
         if filename:
             try:
-                with open(filename, 'r') as f:
-                    jsonData = json.load(f) # a stash
-                    new_data = Stash.from_json_dict(jsonData)
-                    if new_data.asset!= self.stash.asset:
-                        raise ValueError(f"Asset mismatch: found {new_data.asset}. Should be {self.stash.asset}")
+                new_data = self.read_stash_file(filename, "Importing stash...")
+                if new_data.asset!= self.stash.asset:
+                    raise ValueError(f"Asset mismatch: found {new_data.asset}. Should be {self.stash.asset}")
             except Exception as ex:
                 # TODO: handle this with a popup thingy
                 QMessageBox.critical(self, "Oops", str(ex))
                 return
+            self.import_transactions(new_data.acquisitions, new_data.dispositions)
 
-            self.stash.acquisitions += new_data.acquisitions
-            self.stash.dispositions += new_data.dispositions
-            self.stash.update()
-            self.on_model_changed(self.stash.acquisitions, self.stash.dispositions)
+    def import_coinbase_pro(self):
+        filenames, _ = QFileDialog.getOpenFileNames(
+            self,
+            "Select Coinbase Pro account reports (one per year)",
+            "",
+            "CSV files (*.csv)"
+        )
+        if filenames:
+            try:
+                by_asset = import_account_reports(filenames)
+            except Exception as ex:
+                QMessageBox.critical(self, "Oops", str(ex))
+                return
+            if self.stash.asset not in by_asset:
+                QMessageBox.information(self, "Import", f"No {self.stash.asset} orders found. "
+                                                        f"Found: {', '.join(sorted(by_asset)) or 'none'}")
+                return
+            self.import_transactions(*by_asset[self.stash.asset])
+
+    def import_csv(self):
+        filename, _ = QFileDialog.getOpenFileName(self, "Select a CSV export to import", "", "CSV files (*.csv)")
+        if not filename:
+            return
+        mapping_filename, _ = QFileDialog.getOpenFileName(self, "Select its column mapping", "", "Mapping files (*.json)")
+        if not mapping_filename:
+            return
+        progress_dlg = QProgressDialog("Importing CSV...", None, 0, 1000, self)
+        progress_dlg.setMinimumDuration(500)
+
+        def on_progress(bytes_read: int, total_bytes: int) -> None:
+            if total_bytes:
+                progress_dlg.setValue(min(999, 1000 * bytes_read // total_bytes))
+            QApplication.processEvents()
+
+        try:
+            with open(mapping_filename) as f:
+                mapping = CsvMapping.from_json_dict(json.load(f))
+            new_data = read_csv_stash(filename, mapping, self.stash.asset, progress=on_progress)
+        except Exception as ex:
+            QMessageBox.critical(self, "Oops", str(ex))
+            return
+        finally:
+            progress_dlg.close()
+        self.import_transactions(new_data.acquisitions, new_data.dispositions)
+
+    def import_transactions(self, new_acqs: List[Acquisition], new_disps: List[Disposition]) -> None:
+        # anything already in the stash (say, from an overlapping export) is left out
+        acq_report = import_report(self.stash.acquisitions, Stash.sorted_by_timestamp(new_acqs))
+        disp_report = import_report(self.stash.dispositions, Stash.sorted_by_timestamp(new_disps))
+        skipped_count = len(acq_report.skipped) + len(disp_report.skipped)
+        if skipped_count:
+            QMessageBox.information(self, "Import", f"Skipped {skipped_count} duplicate transactions\n"
+                                                    f"Acquisitions: {acq_report}\nDispositions: {disp_report}")
+
+        self.stash.acquisitions = Stash.merged_by_timestamp(self.stash.acquisitions, acq_report.added)
+        self.stash.dispositions = Stash.merged_by_timestamp(self.stash.dispositions, disp_report.added)
+        if self.stash_storage:
+            try:
+                self.stash_storage.add_many(acq_report.added + disp_report.added)
+            except Exception as ex:
+                QMessageBox.critical(self, "Oops", f"Could not save the imported transactions: {ex}")
+        imported_timestamps = [tx.timestamp for tx in acq_report.added + disp_report.added]
+        if imported_timestamps:
+            self.on_model_changed(self.stash.acquisitions, self.stash.dispositions, min(imported_timestamps))
+
+    def export_form8949(self):
+        """Writes the years shown on the Form 8949 tab (all of them if none are picked)"""
+        filename, file_filter = QFileDialog.getSaveFileName(
+            self,
+            "Export Form 8949 as:",
+            "",
+            "CSV files (*.csv);;TXF files (*.txf)"
+        )
+        if filename:
+            years = self.form8949Page.model.displayed_years
+            try:
+                with open(filename, "w", newline="") as f:
+                    if file_filter.startswith("TXF") or filename.endswith(".txf"):
+                        write_form8949_txf(stash_8949_entries(self.stash), f, years)
+                    else:
+                        write_form8949_csv(stash_8949_entries(self.stash), f, years)
+            except Exception as ex:
+                QMessageBox.critical(self, "Oops", str(ex))
+
+    SAVE_FILTERS = {"Stash files (*.stash)": (True, None),
+                    "JSON stash files (*.json)": (False, None),
+                    "Compressed JSON stash files (*.json.gz)": (False, "gzip"),
+                    "Compressed JSON stash files (*.json.xz)": (False, "lzma")} # (binary, compression)
 
     def save_stash(self):
-        filename, _ = QFileDialog.getSaveFileName(
+        if self.save_job:
+            QMessageBox.information(self, "Saving", "The stash is still being saved. Try again when that's done.")
+            return
+        filename, file_filter = QFileDialog.getSaveFileName(
             self,
-            "Save as:"
+            "Save as:",
+            "",
+            ";;".join([*MainWindow.SAVE_FILTERS, "SQLite stash databases (*.sqlite)"])
         )
         if filename:
-            res = []  # This would be your JSON data.
             try:
-                with open(filename, 'w') as f:
-                    jd = self.stash.to_json_dict()
-                    data = json.dump(jd, f, indent=2)
+                if file_filter.startswith("SQLite") or filename.endswith(".sqlite"):
+                    if not isinstance(self.stash_storage, StashDatabase) or self.stash_storage.filename != filename:
+                        self._set_stash_storage(StashDatabase(filename))
+                    self.stash_storage.save_stash(self.stash) # from here on, changes are saved as they are made
+                else:
+                    if not isinstance(self.stash_storage, StashJournal) or self.stash_storage.filename != filename:
+                        self._set_stash_storage(StashJournal(filename))
+                    binary, compression = MainWindow.SAVE_FILTERS.get(file_filter, (True, None))
+                    compression = compression_for_filename(filename) or compression
+                    if compression or filename.endswith(".json"):
+                        binary = False
+                    # the snapshot is taken here, the writing is done on the worker thread. Changes made
+                    # meanwhile are journaled, and carried over to the new journal by on_stash_saved()
+                    journal = self.stash_storage
+                    snapshot = journal.begin_compaction(self.stash)
+                    future = self.save_executor.submit(journal.write_base, snapshot, binary, compression)
+                    self.save_job = (journal, future)
+                    future.add_done_callback(self.stash_saved_sig.emit)
             except Exception as ex:
                 QMessageBox.critical(self, "Oops", str(ex))
 
+    def on_stash_saved(self, future: Future) -> None:
+        if not self.save_job or self.save_job[1] is not future:
+            return # already seen to, by closeEvent()
+        journal = self.save_job[0]
+        self.save_job = None
+        try:
+            future.result()
+            journal.end_compaction() # from here on, changes go in the journal
+        except Exception as ex:
+            journal.abort_compaction()
+            QMessageBox.critical(self, "Oops", f"Could not save the stash: {ex}")
+        if journal is not self.stash_storage: # another stash was opened while this one was being saved
+            journal.close()
+
+    def closeEvent(self, event) -> None:
+        if self.save_job:
+            self.save_job[1].exception() # waits for the save to finish
+            self.on_stash_saved(self.save_job[1])
+        self.save_executor.shutdown()
+        super().closeEvent(event)
 
 app = QApplication(sys.argv)
 # print(app.style().objectName())
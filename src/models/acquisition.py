@@ -6,8 +6,8 @@ from typing import List, Dict
 from PySide6.QtCore import Qt, QAbstractTableModel
 from PySide6.QtWidgets import  QMessageBox
 
-import dateparser
 
+from models.timestamps import parse_timestamp
 from models.transaction import Transaction, TxTableModel
 
 class Acquisition(Transaction):
@@ -23,6 +23,8 @@ class Acquisition(Transaction):
     comment: str -- as in 'Mike repaying me for lunch'
     """
 
+    __slots__ = ("_lot_number",)
+
     def __str__(self) -> str:
         return 'Acq'
 
@@ -33,6 +35,13 @@ class Acquisition(Transaction):
         assert asset != None
         self.lot_number = 0  # 0 means unassigned
 
+    @classmethod
+    def trusted(cls, timestamp: float, asset: str, asset_amount: float, asset_price: float,
+                fees: float, reference: str, comment: str, disabled: bool = False) -> "Acquisition":
+        acq = super().trusted(timestamp, asset, asset_amount, asset_price, fees, reference, comment, disabled)
+        acq._lot_number = 0
+        return acq
+
     @property
     def lot_number(self) -> int:
         return self._lot_number
@@ -47,11 +56,14 @@ class Acquisition(Transaction):
         return self.asset_price + self.fees / self.asset_amount
 
     def duplicate(self) -> "Acquisition":
-        return Acquisition(self.timestamp, self.asset, self.asset_amount, self.asset_price,
+        """A copy, for editing. It keeps the row_id, so saving it updates the original's row"""
+        acq = Acquisition.trusted(self.timestamp, self.asset, self.asset_amount, self.asset_price,
                    self.fees, self.reference, self.comment, self.disabled)
+        acq.row_id = self.row_id
+        return acq
 
     @classmethod
-    def from_json_dict(cls, jd: Dict) -> "Acquisition":
+    def from_json_dict(cls, jd: Dict, trusted: bool = False) -> "Acquisition":
         """A json-serialized Acquisition is a dict when loaded.
 
         Like this:
@@ -64,8 +76,10 @@ class Acquisition(Transaction):
                 "reference: "Tx ID 0xE234490D8"
                 "comment": "Some comment"
             }
+
+        trusted skips validation, for dicts already checked with validate_json_dicts()
         """
-        return cls(
+        return (cls.trusted if trusted else cls)(
                 jd["timestamp"],
                 jd["asset"],
                 jd["asset_amount"],
@@ -127,12 +141,7 @@ class AcqTableModel(TxTableModel):
     def set_data(self, acq: Acquisition, col: int, str_val: str) -> bool:
         try:
             if col == AcqTableModel.ACQ_TIMESTAMP_IDX:
-                # Note that strptime() ignores TZ abbreviations, so we have to use the ugly "+0000"
-                # dt = datetime.strptime(str_val, Acquisition.DATETIME_FORMAT)
-                # if dt.tzinfo == None:
-                #     raise ValueError("Invalid date format. Unknown timezone")
-                dt = dateparser.parse(str_val, settings={'RETURN_AS_TIMEZONE_AWARE': True})
-                acq.timestamp = dt.timestamp()
+                acq.timestamp = parse_timestamp(str_val) # any format dateparser takes, quickly if it's a common one
             if col == AcqTableModel.ACQ_ASSET_AMOUNT_IDX:
                 acq.asset_amount = self.money_str_to_float(str_val)
             if col == AcqTableModel.ACQ_ASSET_PRICE_IDX:
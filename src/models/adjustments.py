@@ -0,0 +1,148 @@
+import sys
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Iterable, Iterator
+
+from models.acquisition import Acquisition
+
+class TimestampIndex:
+    """Acquisitions in timestamp order, for "what was bought between t0 and t1" queries"""
+
+    def __init__(self, acquisitions: Iterable[Acquisition]) -> None:
+        self.acquisitions: List[Acquisition] = sorted((acq for acq in acquisitions if not acq.disabled), key=lambda a: a.timestamp)
+        self.timestamps: List[float] = [acq.timestamp for acq in self.acquisitions]
+
+    def between(self, start_timestamp: float, end_timestamp: float) -> List[Acquisition]:
+        """Acquisitions with start_timestamp <= timestamp <= end_timestamp"""
+        return self.acquisitions[bisect_left(self.timestamps, start_timestamp):bisect_right(self.timestamps, end_timestamp)]
+
+
+class AdjustmentRule:
+    """Fills in Form8949Entry adjustment and code for the entries it applies to.
+
+       Entries come in date_sold order, and carry their lot_number and amount.
+    """
+
+    name: str = ""
+    code: str = ""
+
+    def apply(self, entries: List["Form8949Entry"], acquisitions: TimestampIndex) -> None:
+        for _ in self.apply_each(entries, acquisitions):
+            pass
+
+    def apply_each(self, entries: Iterable["Form8949Entry"], acquisitions: TimestampIndex) -> Iterator["Form8949Entry"]:
+        """Adjust and yield each entry in turn, so entries can be a stream"""
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def _add_code(self, entry: "Form8949Entry") -> None:
+        # several codes are listed together, in alphabetical order
+        entry.code = "".join(sorted(set(entry.code + self.code)))
+
+
+class WashSaleRule(AdjustmentRule):
+    """A loss is disallowed (code W) to the extent that replacement lots were
+       acquired within 30 days before or after the sale.
+
+       Replacement lots are used earliest first, and each unit of a lot only
+       replaces once. Units sold by the loss sale itself, or before it, are
+       no longer held and so replace nothing. The disallowed loss is added to the replacement lots'
+       basis, and so shows up in the cost basis of their own sales.
+    """
+
+    name = "wash_sale"
+    code = "W"
+    WINDOW_SECS = 30 * 24 * 60 * 60
+
+    def apply_each(self, entries: Iterable["Form8949Entry"], acquisitions: TimestampIndex) -> Iterator["Form8949Entry"]:
+        replacement_used: Dict[int, float] = {} # lot number -> amount already used as a replacement
+        sold: Dict[int, float] = {} # lot number -> amount sold so far
+        carried: Dict[int, List[List[float]]] = {} # lot number -> [[amount, added basis per unit], ...]
+
+        sale: List["Form8949Entry"] = [] # entries of one sale, which all come before the next sale's
+        for entry in entries:
+            if sale and entry.date_sold != sale[0].date_sold:
+                yield from self._apply_sale(sale, acquisitions, replacement_used, sold, carried)
+                sale = []
+            sale.append(entry)
+        if sale:
+            yield from self._apply_sale(sale, acquisitions, replacement_used, sold, carried)
+
+    def _apply_sale(self, sale: List["Form8949Entry"], acquisitions: TimestampIndex, replacement_used: Dict[int, float],
+                    sold: Dict[int, float], carried: Dict[int, List[List[float]]]) -> List["Form8949Entry"]:
+        """Adjust the entries of one sale. Units sold by it, or before it, can't replace anything."""
+        for entry in sale:
+            if entry.amount > 0:
+                sold[entry.lot_number] = sold.get(entry.lot_number, 0.0) + entry.amount
+                self._add_carried_basis(entry, carried.get(entry.lot_number)) # from earlier sales only
+        for entry in sale:
+            loss = -entry.gain_or_loss
+            if entry.amount <= 0 or loss <= 0:
+                continue
+
+            amount_left = entry.amount
+            for acq in acquisitions.between(entry.date_sold - WashSaleRule.WINDOW_SECS, entry.date_sold + WashSaleRule.WINDOW_SECS):
+                if acq.lot_number == entry.lot_number:
+                    continue # not a replacement for itself
+                # the first units of a lot are the ones sold, and the ones used as replacements
+                used_up = max(replacement_used.get(acq.lot_number, 0.0), sold.get(acq.lot_number, 0.0))
+                available = acq.asset_amount - used_up
+                if available <= 0:
+                    continue
+                used = min(available, amount_left)
+                replacement_used[acq.lot_number] = used_up + used
+                disallowed = loss * used / entry.amount
+                entry.adjustment += disallowed
+                carried.setdefault(acq.lot_number, []).append([used, disallowed / used])
+                amount_left -= used
+                if amount_left <= 0:
+                    break
+            if amount_left < entry.amount:
+                self._add_code(entry)
+        return sale
+
+    @staticmethod
+    def _add_carried_basis(entry: "Form8949Entry", carries: List[List[float]]) -> None:
+        """Basis added to this entry's lot by earlier wash sales, for the first units sold from it"""
+        amount_left = entry.amount
+        while carries and amount_left > 0:
+            carry = carries[0]
+            used = min(carry[0], amount_left)
+            entry.cost_basis += used * carry[1]
+            amount_left -= used
+            carry[0] -= used
+            if carry[0] <= 0:
+                carries.pop(0)
+
+
+ADJUSTMENT_RULES: Dict[str, type] = {rule.name: rule for rule in (WashSaleRule,)}
+
+class AdjustmentEngine:
+    """Runs adjustment rules over a stash's Form 8949 entries"""
+
+    def __init__(self, rules: List[AdjustmentRule] = []) -> None:
+        self.rules: List[AdjustmentRule] = list(rules)
+
+    @classmethod
+    def from_names(cls, names: Iterable[str]) -> "AdjustmentEngine":
+        """Engine with the rules named (see ADJUSTMENT_RULES). This should be called inside a try block"""
+        for name in names:
+            if name not in ADJUSTMENT_RULES:
+                raise ValueError(f"Unknown adjustment rule: {name}")
+        return cls([ADJUSTMENT_RULES[name]() for name in names])
+
+    def apply(self, entries: List["Form8949Entry"], acquisitions: Iterable[Acquisition]) -> List["Form8949Entry"]:
+        """Adjust entries (in place, in date_sold order) and return them"""
+        if self.rules:
+            index = TimestampIndex(acquisitions)
+            entries.sort(key=lambda e: e.date_sold)
+            for rule in self.rules:
+                rule.apply(entries, index)
+        return entries
+
+    def apply_each(self, entries: Iterable["Form8949Entry"], acquisitions: Iterable[Acquisition]) -> Iterator["Form8949Entry"]:
+        """apply() for a stream of entries, which must already be in date_sold order"""
+        if not self.rules:
+            return iter(entries)
+        index = TimestampIndex(acquisitions)
+        for rule in self.rules:
+            entries = rule.apply_each(entries, index)
+        return entries
@@ -0,0 +1,168 @@
+import sys
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import List, Dict, Iterable, Iterator, Tuple
+
+import numpy as np
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.timestamps import TimestampParser
+
+# Coinbase Pro (GDAX) account reports
+#
+# Generated at coinbase.com: Profile > Statements > "Coinbase Pro" tab > "Generate
+# custom report" with "account", "all portfolios" and "all accounts", one year at a time.
+#
+# An order (buy, sell or trade) is executed as one or more trades. Each trade is two
+# "match" rows, one per unit involved: a negative amount for what was given, positive
+# for what was received. A trade may also have a "fee" row, with a negative amount.
+# All the rows of an order have the same "order id". Deposits and withdrawals are
+# transfers, and are left out.
+
+TYPE_COL = "type"
+TIME_COL = "time"
+AMOUNT_COL = "amount"
+UNIT_COL = "amount/balance unit"
+ORDER_ID_COL = "order id"
+
+REFERENCE_PREFIX = "CB Pro Order Id: "
+CASH_UNITS = ("USD", "EUR", "GBP") # what prices are in. Anything else is an asset
+
+
+class CbProOrder:
+    """Everything in the report about one order, summed over its trades"""
+
+    __slots__ = ("order_id", "timestamp", "amounts", "fees")
+
+    def __init__(self, order_id: str, timestamp: float = 0.0) -> None:
+        self.order_id: str = order_id
+        self.timestamp: float = timestamp # of the last trade
+        self.amounts: Dict[str, float] = {} # matched amount by unit, negative for the unit given
+        self.fees: float = 0.0 # positive
+
+    def merge(self, other: "CbProOrder") -> None:
+        """Add in the trades of the same order from another chunk or file"""
+        self.timestamp = max(self.timestamp, other.timestamp)
+        for unit, amount in other.amounts.items():
+            self.amounts[unit] = self.amounts.get(unit, 0.0) + amount
+        self.fees += other.fees
+
+    def units(self) -> Tuple[str, str]:
+        """(unit given, unit received). This should be called inside a try block"""
+        if len(self.amounts) != 2:
+            raise ValueError(f"Order {self.order_id} has matches in {len(self.amounts)} units. Expected 2")
+        (unit_a, amount_a), (unit_b, amount_b) = self.amounts.items()
+        if (amount_a < 0) == (amount_b < 0):
+            raise ValueError(f"Order {self.order_id} doesn't give one unit for another")
+        return (unit_a, unit_b) if amount_a < 0 else (unit_b, unit_a)
+
+    def transactions(self, cash_units: Iterable[str] = CASH_UNITS) -> List[Acquisition | Disposition]:
+        """A Disposition of the unit given and an Acquisition of the one received, leaving out cash.
+
+           The price is in the other unit. This should be called inside a try block
+        """
+        unit_given, unit_received = self.units()
+        amount_given, amount_received = -self.amounts[unit_given], self.amounts[unit_received]
+        reference = REFERENCE_PREFIX + self.order_id
+        txs: List[Acquisition | Disposition] = []
+        if unit_given not in cash_units:
+            txs.append(Disposition(self.timestamp, unit_given, amount_given, amount_received / amount_given,
+                                   self.fees, reference, ""))
+        if unit_received not in cash_units:
+            txs.append(Acquisition(self.timestamp, unit_received, amount_received, amount_given / amount_received,
+                                   self.fees, reference, ""))
+        return txs
+
+
+def read_report_chunks(filename: str, chunk_rows: int = 100000) -> Iterator[Dict[str, np.ndarray]]:
+    """The match and fee rows of an account report, chunk_rows rows at a time, as column arrays
+
+       Times are parsed (see TimestampParser) and amounts are float64.
+       This should be called inside a try block
+    """
+    parser = TimestampParser()
+    with open(filename, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        try:
+            cols = [header.index(name) for name in (TYPE_COL, TIME_COL, AMOUNT_COL, UNIT_COL, ORDER_ID_COL)]
+        except ValueError as ex:
+            raise ValueError(f"{filename} is not a Coinbase Pro account report: {ex}")
+        while True:
+            rows = list(islice(reader, chunk_rows))
+            if not rows:
+                return
+            rows = [row for row in rows if row[cols[0]] in ("match", "fee")]
+            if rows:
+                types, times, amounts, units, order_ids = (np.array([row[col] for row in rows]) for col in cols)
+                yield {"is_fee": types == "fee", "time": parser.parse_many(times.tolist()),
+                       "amount": amounts.astype(np.float64), "unit": units, "order_id": order_ids}
+
+
+def aggregate_chunk(chunk: Dict[str, np.ndarray]) -> Dict[str, CbProOrder]:
+    """Sum a chunk's rows per order (and per unit, for matches) with grouped array operations"""
+    order_ids, order_idx = np.unique(chunk["order_id"], return_inverse=True)
+    units, unit_idx = np.unique(chunk["unit"], return_inverse=True)
+    order_count = len(order_ids)
+
+    last_times = np.full(order_count, -np.inf)
+    np.maximum.at(last_times, order_idx, chunk["time"])
+    is_fee = chunk["is_fee"]
+    fees = -np.bincount(order_idx[is_fee], chunk["amount"][is_fee], order_count)
+    is_match = ~is_fee
+    pair_idx = order_idx[is_match] * len(units) + unit_idx[is_match]
+    pairs, pair_inverse = np.unique(pair_idx, return_inverse=True)
+    pair_amounts = np.bincount(pair_inverse, chunk["amount"][is_match], len(pairs))
+
+    order_ids, units = order_ids.tolist(), units.tolist()
+    orders = {order_id: CbProOrder(order_id, timestamp) for order_id, timestamp in zip(order_ids, last_times.tolist())}
+    for order_id, fee in zip(order_ids, fees.tolist()):
+        orders[order_id].fees = fee
+    for pair, amount in zip(pairs.tolist(), pair_amounts.tolist()):
+        orders[order_ids[pair // len(units)]].amounts[units[pair % len(units)]] = amount
+    return orders
+
+def merge_orders(into: Dict[str, CbProOrder], orders: Dict[str, CbProOrder]) -> None:
+    for order_id, order in orders.items():
+        if order_id in into:
+            into[order_id].merge(order)
+        else:
+            into[order_id] = order
+
+def read_report_orders(filename: str, chunk_rows: int = 100000) -> Dict[str, CbProOrder]:
+    """All the orders in an account report, by order id. This should be called inside a try block"""
+    orders: Dict[str, CbProOrder] = {}
+    for chunk in read_report_chunks(filename, chunk_rows):
+        merge_orders(orders, aggregate_chunk(chunk))
+    return orders
+
+
+def import_account_reports(filenames: List[str], chunk_rows: int = 100000, max_workers: int = None,
+                           cash_units: Iterable[str] = CASH_UNITS) -> Dict[str, Tuple[List[Acquisition], List[Disposition]]]:
+    """(acquisitions, dispositions) for every asset traded in any of the reports, by asset
+
+        Each file is read in its own worker process (if there's more than one).
+        An order that was still being filled at the end of one year's report is
+        put back together from both files. The lists are in timestamp order.
+
+        This should be called inside a try block
+    """
+    if len(filenames) < 2 or max_workers == 1:
+        per_file = [read_report_orders(filename, chunk_rows) for filename in filenames]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            per_file = list(pool.map(read_report_orders, filenames, [chunk_rows] * len(filenames)))
+    orders: Dict[str, CbProOrder] = {}
+    for file_orders in per_file:
+        merge_orders(orders, file_orders)
+
+    by_asset: Dict[str, Tuple[List[Acquisition], List[Disposition]]] = {}
+    for order in sorted(orders.values(), key=lambda o: o.timestamp):
+        for tx in order.transactions(cash_units):
+            acqs, disps = by_asset.setdefault(tx.asset, ([], []))
+            (acqs if isinstance(tx, Acquisition) else disps).append(tx)
+    return by_asset
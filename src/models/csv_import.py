@@ -0,0 +1,195 @@
+import sys
+import csv
+import os
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator, TextIO, Tuple
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.timestamps import TimestampParser
+from models.stash_io import ProgressCallback
+
+class CsvMapping:
+    """Which columns of an exchange or wallet export hold what, and in what units
+
+       Columns are named by their header. Only timestamp and amount are needed:
+
+       - price: unit price. If there isn't one, total (the value of the whole
+         transaction) divided by the amount is used, or 0
+       - side: buy or sell. Rows whose side is in neither buy_values nor
+         sell_values (deposits, say) are skipped. Without a side column, a
+         negative amount is a sale
+       - asset: the asset, for exports with more than one in them. Rows for
+         other assets are skipped
+       - *_scale: multiplies the column's values, for exports in other units
+         (satoshis, say, with an amount_scale of 1e-8)
+
+       Numbers may have a $ or thousands separators. Timestamps may be numbers
+       or any date format (see TimestampParser).
+    """
+
+    FIELDS = ("timestamp", "amount", "price", "total", "fees", "reference", "comment", "side", "asset")
+
+    def __init__(self, timestamp: str, amount: str, price: str = None, total: str = None, fees: str = None,
+                 reference: str = None, comment: str = None, side: str = None, asset: str = None,
+                 buy_values: Iterable[str] = ("buy",), sell_values: Iterable[str] = ("sell",),
+                 amount_scale: float = 1.0, price_scale: float = 1.0, fee_scale: float = 1.0,
+                 delimiter: str = ",") -> None:
+        self.timestamp: str = timestamp
+        self.amount: str = amount
+        self.price: str = price
+        self.total: str = total
+        self.fees: str = fees
+        self.reference: str = reference
+        self.comment: str = comment
+        self.side: str = side
+        self.asset: str = asset
+        self.buy_values: List[str] = [v.lower() for v in buy_values]
+        self.sell_values: List[str] = [v.lower() for v in sell_values]
+        self.amount_scale: float = amount_scale
+        self.price_scale: float = price_scale # total is in the same units as price
+        self.fee_scale: float = fee_scale
+        self.delimiter: str = delimiter
+
+    def columns(self) -> Dict[str, str]:
+        """Mapped columns, by field"""
+        return {field: getattr(self, field) for field in CsvMapping.FIELDS if getattr(self, field)}
+
+    @classmethod
+    def from_json_dict(cls, jd: Dict) -> "CsvMapping":
+        """Like this:
+
+            {
+                "timestamp": "Date",
+                "amount": "Quantity",
+                "price": "Spot Price", (optional, as are all below)
+                "fees": "Fees",
+                "reference": "ID",
+                "side": "Transaction Type",
+                "buy_values": ["Buy", "Receive"],
+                "sell_values": ["Sell", "Send"]
+            }
+
+        This should be called inside a try block
+        """
+        return cls(**jd)
+
+    def to_json_dict(self) -> Dict:
+        return {**self.columns(), "buy_values": self.buy_values, "sell_values": self.sell_values,
+                "amount_scale": self.amount_scale, "price_scale": self.price_scale,
+                "fee_scale": self.fee_scale, "delimiter": self.delimiter}
+
+
+def _number(text: str) -> float:
+    text = text.strip().replace("$", "").replace(",", "")
+    return float(text) if text else 0.0
+
+
+class CsvImporter:
+    """Reads a CSV through a CsvMapping into Acquisitions and Dispositions, a batch of rows at a time
+
+       Only one batch of rows is held at once, so the file can be any size.
+    """
+
+    def __init__(self, mapping: CsvMapping, asset: str) -> None:
+        self.mapping: CsvMapping = mapping
+        self.asset: str = asset
+        self.skipped_count: int = 0 # rows that are for another asset or neither a buy nor a sell
+        self.bytes_read: int = 0 # characters, really. Near enough for progress
+        self._timestamps = TimestampParser() # one for the whole file, so the format is only detected once
+
+    def _lines(self, f: TextIO) -> Iterator[str]:
+        for line in f:
+            self.bytes_read += len(line)
+            yield line
+
+    def batches(self, f: TextIO, batch_size: int = 10000) -> Iterator[Tuple[List[Acquisition], List[Disposition]]]:
+        """(acquisitions, dispositions) for each batch_size rows. f should be opened with newline="".
+
+           This should be called inside a try block
+        """
+        reader = csv.reader(self._lines(f), delimiter=self.mapping.delimiter)
+        header = [name.strip() for name in next(reader, [])]
+        try:
+            cols = {field: header.index(name) for field, name in self.mapping.columns().items()}
+        except ValueError as ex:
+            raise ValueError(f"Column not found: {ex}")
+        while True:
+            rows = list(islice(reader, batch_size))
+            if not rows:
+                return
+            yield self._batch(rows, cols)
+
+    def _is_sale(self, side: str) -> bool:
+        """True for a sell, False for a buy, None for anything else"""
+        side = side.strip().lower()
+        if side in self.mapping.sell_values:
+            return True
+        if side in self.mapping.buy_values:
+            return False
+        return None
+
+    def _batch(self, rows: List[List[str]], cols: Dict[str, int]) -> Tuple[List[Acquisition], List[Disposition]]:
+        mapping = self.mapping
+        rows = [row for row in rows if any(row)] # blank lines
+        if "asset" in cols:
+            asset_col = cols["asset"]
+            kept = [row for row in rows if row[asset_col].strip() == self.asset]
+            self.skipped_count += len(rows) - len(kept)
+            rows = kept
+
+        amounts = [_number(row[cols["amount"]]) * mapping.amount_scale for row in rows]
+        if "side" in cols:
+            side_col = cols["side"]
+            is_sale = [self._is_sale(row[side_col]) for row in rows]
+        else:
+            is_sale = [amount < 0 for amount in amounts]
+
+        keep = [idx for idx, sale in enumerate(is_sale) if sale is not None]
+        self.skipped_count += len(rows) - len(keep)
+        timestamps = self._timestamps.parse_many([rows[idx][cols["timestamp"]] for idx in keep]).tolist()
+
+        acq_jds: List[Dict] = []
+        disp_jds: List[Dict] = []
+        for idx, timestamp in zip(keep, timestamps):
+            row = rows[idx]
+            amount = abs(amounts[idx])
+            if "price" in cols:
+                price = _number(row[cols["price"]]) * mapping.price_scale
+            elif "total" in cols and amount:
+                price = abs(_number(row[cols["total"]])) * mapping.price_scale / amount
+            else:
+                price = 0.0
+            jd = {"timestamp": timestamp, "asset": self.asset, "asset_amount": amount, "asset_price": price,
+                  "fees": abs(_number(row[cols["fees"]])) * mapping.fee_scale if "fees" in cols else 0.0,
+                  "reference": row[cols["reference"]].strip() if "reference" in cols else "",
+                  "comment": row[cols["comment"]].strip() if "comment" in cols else ""}
+            (disp_jds if is_sale[idx] else acq_jds).append(jd)
+
+        Acquisition.validate_json_dicts(acq_jds)
+        Disposition.validate_json_dicts(disp_jds)
+        return ([Acquisition.from_json_dict(jd, trusted=True) for jd in acq_jds],
+                [Disposition.from_json_dict(jd, trusted=True) for jd in disp_jds])
+
+
+def read_csv_stash(filename: str, mapping: CsvMapping, asset: str, title: str = "",
+                   batch_size: int = 10000, progress: ProgressCallback = None) -> Stash:
+    """A stash of asset's transactions in a CSV export. progress is called after every batch.
+
+        This should be called inside a try block
+    """
+    importer = CsvImporter(mapping, asset)
+    stash = Stash(asset, title or os.path.basename(filename))
+    acqs: List[Acquisition] = []
+    disps: List[Disposition] = []
+    total_bytes = os.path.getsize(filename)
+    with open(filename, newline="", encoding="utf-8-sig") as f:
+        for batch_acqs, batch_disps in importer.batches(f, batch_size):
+            acqs.extend(batch_acqs)
+            disps.extend(batch_disps)
+            if progress:
+                progress(importer.bytes_read, total_bytes)
+    stash.acquisitions = Stash.sorted_by_timestamp(acqs)
+    stash.dispositions = Stash.sorted_by_timestamp(disps)
+    return stash
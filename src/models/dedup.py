@@ -0,0 +1,117 @@
+import sys
+import math
+from bisect import bisect_left
+from typing import List, Dict, Iterable, Sequence, Set, Tuple
+
+from models.transaction import Transaction
+
+class BloomFilter:
+    """Compact "have I seen this hash before?" set.
+
+       No false negatives. False positives happen at about error_rate once
+       capacity items have been added, so a hit has to be confirmed some other way.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        capacity = max(capacity, 1)
+        self.size: int = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2)) # bits
+        self.hash_count: int = max(1, round(self.size / capacity * math.log(2)))
+        self.bits: bytearray = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item_hash: int) -> Iterable[int]:
+        # double hashing: k positions from the two halves of one 64 bit hash
+        item_hash &= 0xFFFFFFFFFFFFFFFF
+        h1, h2 = item_hash & 0xFFFFFFFF, (item_hash >> 32) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item_hash: int) -> None:
+        for pos in self._positions(item_hash):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item_hash: int) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item_hash))
+
+
+class ImportReport:
+    """What an import added, and what it skipped as already there"""
+
+    def __init__(self) -> None:
+        self.added: List[Transaction] = []
+        self.skipped: List[Transaction] = [] # duplicates, of existing transactions or of earlier imported ones
+
+    def __str__(self) -> str:
+        return f"{len(self.added)} added, {len(self.skipped)} duplicates skipped"
+
+
+def unique_transactions(existing: Iterable[Transaction], incoming: Iterable[Transaction]) -> ImportReport:
+    """Sort incoming into new transactions and duplicates (see Transaction.identity)
+
+        One pass over each, using a hash index of the identities.
+    """
+    seen: Set[Tuple] = {tx.identity for tx in existing}
+    report = ImportReport()
+    for tx in incoming:
+        identity = tx.identity
+        if identity in seen:
+            report.skipped.append(tx)
+        else:
+            seen.add(identity)
+            report.added.append(tx)
+    return report
+
+
+def stream_unique_transactions(existing: Sequence[Transaction], incoming: Iterable[Transaction],
+                               incoming_estimate: int = 0, error_rate: float = 0.001,
+                               incoming_sorted: bool = False) -> ImportReport:
+    """unique_transactions() for very large imports
+
+        existing transactions' identities aren't held, just a BloomFilter of
+        them and of the ones added so far. A filter hit is confirmed with a
+        binary search of existing, which must be sorted by timestamp (like a
+        Stash's lists after update()), or against the added transactions with
+        the same timestamp. incoming can be a generator.
+
+        Added transactions are kept for the report, and indexed by timestamp
+        for those confirmations. If incoming is sorted by timestamp too, the
+        index only ever holds the ones at the current timestamp.
+    """
+    bloom = BloomFilter(len(existing) + max(incoming_estimate, len(existing)), error_rate)
+    for tx in existing:
+        bloom.add(tx.tx_hash)
+    added_at: Dict[float, List[Transaction]] = {} # added transactions by timestamp, checked on filter hits
+    report = ImportReport()
+    for tx in incoming:
+        if incoming_sorted and tx.timestamp not in added_at:
+            added_at.clear() # no later transaction can have an earlier timestamp
+        tx_hash = tx.tx_hash
+        if tx_hash in bloom and _is_duplicate(existing, added_at, tx):
+            report.skipped.append(tx)
+            continue
+        bloom.add(tx_hash)
+        added_at.setdefault(tx.timestamp, []).append(tx)
+        report.added.append(tx)
+    return report
+
+# imports bigger than this are de-duplicated by stream_unique_transactions()
+STREAMING_IMPORT_SIZE = 100000
+
+def import_report(existing: Sequence[Transaction], incoming: Sequence[Transaction]) -> ImportReport:
+    """What an import of incoming into existing adds and skips. Both must be sorted by timestamp.
+
+        Small imports use unique_transactions(). Big ones use stream_unique_transactions(),
+        so existing's identities are never all held at once.
+    """
+    if len(incoming) <= STREAMING_IMPORT_SIZE:
+        return unique_transactions(existing, incoming)
+    return stream_unique_transactions(existing, incoming, len(incoming), incoming_sorted=True)
+
+def _is_duplicate(existing: Sequence[Transaction], added_at: Dict[float, List[Transaction]], tx: Transaction) -> bool:
+    identity = tx.identity
+    if any(other.identity == identity for other in added_at.get(tx.timestamp, ())):
+        return True
+    idx = bisect_left(existing, tx.timestamp, key=lambda t: t.timestamp)
+    while idx < len(existing) and existing[idx].timestamp == tx.timestamp:
+        if existing[idx].identity == identity:
+            return True
+        idx += 1
+    return False
@@ -4,10 +4,10 @@ from datetime import datetime, timezone
 from typing import List, Dict
 from PySide6.QtCore import Qt, QAbstractTableModel
 
+from models.timestamps import parse_timestamp
 from models.transaction import Transaction, TxTableModel
 from PySide6.QtWidgets import  QMessageBox
 
-import dateparser
 
 class Disposition(Transaction):
     """The getting-rid-of some of a commodity. Could be a sale, a gift, or a payment
@@ -22,6 +22,8 @@ class Disposition(Transaction):
     comment: str -- as in 'Mike repaying me for lunch'
     """
 
+    __slots__ = ()
+
     def __str__(self) -> str:
         return 'Dis'
 
@@ -31,13 +33,16 @@ class Disposition(Transaction):
         assert asset != None
 
     def duplicate(self) -> "Disposition":
-        return Disposition(self.timestamp, self.asset, self.asset_amount,
+        """A copy, for editing. It keeps the row_id, so saving it updates the original's row"""
+        disp = Disposition.trusted(self.timestamp, self.asset, self.asset_amount,
                    self.asset_price, self.fees, self.reference,
                    self.comment, self.disabled)
+        disp.row_id = self.row_id
+        return disp
 
 
     @classmethod
-    def from_json_dict(cls, jd: Dict) -> "Disposition":
+    def from_json_dict(cls, jd: Dict, trusted: bool = False) -> "Disposition":
         """A json-serialized Disposition is a dict when loaded.
 
         Like this:
@@ -51,8 +56,10 @@ class Disposition(Transaction):
                 "comment": "",
                 "disabled": False
             }
+
+        trusted skips validation, for dicts already checked with validate_json_dicts()
         """
-        return cls(
+        return (cls.trusted if trusted else cls)(
             jd["timestamp"],
             jd["asset"],
             jd["asset_amount"],
@@ -114,9 +121,7 @@ class DisTableModel(TxTableModel):
     def set_data(self, dis: Disposition, col: int, str_val: str) -> bool:
         try:
             if col == DisTableModel.DIS_TIMESTAMP_IDX:
-                # Note that strptime() ignores TZ abbreviations, so we have to use the ugly "+0000"
-                dt = dateparser.parse(str_val, settings={'RETURN_AS_TIMEZONE_AWARE': True})
-                dis.timestamp = dt.timestamp()
+                dis.timestamp = parse_timestamp(str_val) # any format dateparser takes, quickly if it's a common one
             if col == DisTableModel.DIS_AMOUNT_IDX:
                 dis.asset_amount = self.money_str_to_float(str_val)
             if col == DisTableModel.DIS_PRICE_IDX:
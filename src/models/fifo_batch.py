@@ -0,0 +1,154 @@
+import sys
+from typing import List, Dict, Sequence
+
+import numpy as np
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import LotState
+from models.tx_store import TxStore
+from models.fixed_point import AssetUnits
+
+class FifoMatches:
+    """Lot-to-disposition FIFO matches for a whole stash, one array entry per match.
+
+       Matches are ordered by disposition, then by lot, exactly like the
+       lots_affected of the disposition states produced by Stash.generate_states().
+    """
+
+    def __init__(self, asset: str, count: int = 0) -> None:
+        self.asset: str = asset
+        self.disposition_idx: np.ndarray = np.zeros(count, np.int64) # index into the enabled, sorted dispositions
+        self.lot_number: np.ndarray = np.zeros(count, np.int64)
+        self.amount: np.ndarray = np.zeros(count, np.float64)
+        self.date_acquired: np.ndarray = np.zeros(count, np.float64)
+        self.date_sold: np.ndarray = np.zeros(count, np.float64)
+        self.proceeds: np.ndarray = np.zeros(count, np.float64)
+        self.cost_basis: np.ndarray = np.zeros(count, np.float64)
+        self.is_long_term: np.ndarray = np.zeros(count, np.bool_)
+        # amount of each (enabled) disposition that could not be matched to any lot
+        self.overdrawn: np.ndarray = np.zeros(0, np.float64)
+
+    def __len__(self) -> int:
+        return len(self.lot_number)
+
+    @property
+    def cap_gains(self) -> np.ndarray:
+        return self.proceeds - self.cost_basis
+
+
+def _enabled_columns(txs: Sequence[Acquisition] | Sequence[Disposition] | TxStore) -> Dict[str, np.ndarray]:
+    """timestamp/asset_amount/asset_price/fees arrays for the enabled transactions, in timestamp order"""
+    names = ("timestamp", "asset_amount", "asset_price", "fees")
+    if isinstance(txs, TxStore):
+        mask = txs.enabled_mask()
+        columns = {name: txs.column(name)[mask] for name in names}
+    else:
+        enabled = [tx for tx in txs if not tx.disabled]
+        columns = {name: np.fromiter((getattr(tx, name) for tx in enabled), np.float64, len(enabled)) for name in names}
+    order = np.argsort(columns["timestamp"], kind="stable")
+    return {name: col[order] for name, col in columns.items()}
+
+
+def _to_fixed_point(columns: Dict[str, np.ndarray], units: AssetUnits) -> Dict[str, np.ndarray]:
+    """Same conversions as AssetUnits.to_units/to_price_units/to_cents, on whole columns"""
+    return {
+        "timestamp": columns["timestamp"],
+        "asset_amount": np.rint(columns["asset_amount"] * units.scale).astype(np.int64),
+        "asset_price": np.rint(columns["asset_price"] * units.price_scale).astype(np.int64),
+        "fees": np.rint(columns["fees"] * units.money_scale).astype(np.int64)
+    }
+
+
+def _value_cents(price_units: np.ndarray, amount_units: np.ndarray, units: AssetUnits) -> np.ndarray:
+    """AssetUnits.value_cents() for non-negative int64 arrays.
+
+        price x amount doesn't fit in an int64, so both are split (into whole
+        cents and the rest of a cent, whole assets and the rest of one) and the
+        partial products that are multiples of a cent are added up separately.
+    """
+    cent, scale = units.price_per_cent, units.scale
+    price_cents, price_rest = np.divmod(price_units, cent)
+    whole, part = np.divmod(amount_units, scale)
+    carry_1, rest_1 = np.divmod(price_cents * part, scale)
+    carry_2, rest_2 = np.divmod(price_rest * whole, cent)
+    return (price_cents * whole + carry_1 + carry_2
+            + (rest_1 * cent + rest_2 * scale + price_rest * part + scale * cent // 2) // (scale * cent))
+
+
+def match_fifo(asset: str, acquisitions: Sequence[Acquisition] | TxStore,
+               dispositions: Sequence[Disposition] | TxStore,
+               units: AssetUnits = None) -> FifoMatches:
+    """Match dispositions to lots FIFO-style without building any StashStates.
+
+        Lots and dispositions are laid out as intervals along the cumulative
+        amount acquired, and each disposition's interval is intersected with the
+        lot intervals using searchsorted. Same rules as StashState.apply_activity():
+        a disposition can only use lots acquired at or before its timestamp, and
+        whatever it can't cover is dropped (and reported in FifoMatches.overdrawn).
+
+        Amounts are always laid out as int64 base units of the asset (see
+        AssetUnits), so the cumulative sums are exact: float round-off there
+        would show up as extra matches of a few 1e-16 units, each charged the
+        whole disposition fee. With units, money is in cents too, like a
+        fixed_point Stash (FixedLotState); without, it's floats like LotState.
+    """
+    acq = _enabled_columns(acquisitions)
+    dis = _enabled_columns(dispositions)
+    scale = (units or AssetUnits(asset)).scale
+    if units:
+        acq = _to_fixed_point(acq, units)
+        dis = _to_fixed_point(dis, units)
+        acq_amounts, dis_amounts = acq["asset_amount"], dis["asset_amount"]
+    else:
+        acq_amounts = np.rint(acq["asset_amount"] * scale).astype(np.int64)
+        dis_amounts = np.rint(dis["asset_amount"] * scale).astype(np.int64)
+    zero = np.zeros(1, np.int64)
+
+    lot_ends = np.cumsum(acq_amounts)
+    lot_starts = lot_ends - acq_amounts
+
+    # amount acquired at or before each disposition. Acquisitions sort ahead of
+    # dispositions with the same timestamp
+    acquired_count = np.searchsorted(acq["timestamp"], dis["timestamp"], side="right")
+    available = np.concatenate((zero, lot_ends))[acquired_count]
+
+    # cumulative amount actually disposed: the running sum, clamped at each step
+    # to what was available at the time (overdrawn amounts are lost, not carried)
+    wanted = np.cumsum(dis_amounts)
+    shortfall = np.minimum(np.minimum.accumulate(available - wanted), 0)
+    disposed_end = wanted + shortfall
+    disposed_start = np.concatenate((zero, disposed_end[:-1]))
+
+    matches = FifoMatches(asset)
+    matches.overdrawn = (dis_amounts - (disposed_end - disposed_start)) / scale
+
+    # lots overlapping each disposition's [disposed_start, disposed_end) interval
+    has_amount = disposed_end > disposed_start
+    first_lot = np.searchsorted(lot_ends, disposed_start, side="right")
+    last_lot = np.minimum(np.searchsorted(lot_ends, disposed_end, side="left"), acquired_count - 1)
+    lot_counts = np.where(has_amount, np.maximum(last_lot - first_lot + 1, 0), 0)
+
+    dis_idx = np.repeat(np.arange(len(lot_counts)), lot_counts)
+    offsets = np.arange(len(dis_idx)) - np.repeat(np.cumsum(lot_counts) - lot_counts, lot_counts)
+    lot_idx = first_lot[dis_idx] + offsets
+
+    amounts = (np.minimum(disposed_end[dis_idx], lot_ends[lot_idx])
+               - np.maximum(disposed_start[dis_idx], lot_starts[lot_idx]))
+    keep = amounts > 0 # zero-amount lots inside an interval
+    dis_idx, lot_idx, amounts = dis_idx[keep], lot_idx[keep], amounts[keep]
+
+    # same arithmetic as LotState (or FixedLotState) sale_proceeds/sale_basis/is_long_term
+    matches.disposition_idx = dis_idx
+    matches.lot_number = lot_idx + 1
+    matches.date_acquired = acq["timestamp"][lot_idx]
+    matches.date_sold = dis["timestamp"][dis_idx]
+    matches.amount = amounts / scale
+    if units:
+        matches.proceeds = (_value_cents(dis["asset_price"][dis_idx], amounts, units) - dis["fees"][dis_idx]) / units.money_scale
+        matches.cost_basis = _value_cents(acq["asset_price"][lot_idx], amounts, units) / units.money_scale
+    else:
+        matches.proceeds = dis["asset_price"][dis_idx] * matches.amount - dis["fees"][dis_idx]
+        matches.cost_basis = acq["asset_price"][lot_idx] * matches.amount
+    matches.is_long_term = (matches.date_sold - matches.date_acquired) > LotState.ONE_YEAR_SECS
+    return matches
@@ -0,0 +1,56 @@
+import sys
+from typing import Dict
+
+class AssetUnits:
+    """Fixed-point scales for one asset.
+
+       Asset amounts become integer base units (satoshis for BTC) and money
+       (fees, proceeds, basis) becomes integer cents. Unit prices are kept
+       finer, in PRICE_DECIMALS, and amount x price is rounded to a cent once,
+       by value_cents(). Amounts then add and subtract exactly, so a lot that
+       has been fully disposed of ends up with a balance of exactly zero.
+    """
+
+    # base unit decimals per asset. Kept so that realistic amounts fit in an int64
+    DECIMALS: Dict[str, int] = {
+        "BTC": 8,  # satoshi
+        "BCH": 8,
+        "LTC": 8,
+        "ETH": 9,  # gwei
+        "USDC": 6
+    }
+    DEFAULT_DECIMALS = 8
+    MONEY_DECIMALS = 2 # cents
+    PRICE_DECIMALS = 8 # unit prices, so they aren't rounded before they're multiplied by an amount
+
+    def __init__(self, asset: str, decimals: int = None) -> None:
+        self.asset: str = asset
+        self.decimals: int = decimals if decimals is not None else AssetUnits.DECIMALS.get(asset, AssetUnits.DEFAULT_DECIMALS)
+        self.scale: int = 10 ** self.decimals
+        self.money_scale: int = 10 ** AssetUnits.MONEY_DECIMALS
+        self.price_scale: int = 10 ** AssetUnits.PRICE_DECIMALS
+        self.price_per_cent: int = self.price_scale // self.money_scale
+
+    def to_units(self, amount: float) -> int:
+        return round(amount * self.scale)
+
+    def to_amount(self, units: int) -> float:
+        return units / self.scale
+
+    def to_cents(self, money: float) -> int:
+        return round(money * self.money_scale)
+
+    def to_money(self, cents: int) -> float:
+        return cents / self.money_scale
+
+    def to_price_units(self, price: float) -> int:
+        return round(price * self.price_scale)
+
+    def to_price(self, price_units: int) -> float:
+        return price_units / self.price_scale
+
+    def value_cents(self, price_units: int, units: int) -> int:
+        """Value of units at a per-whole-asset price (see to_price_units()), rounded (half away from zero) to a cent"""
+        sign = -1 if units < 0 else 1
+        divisor = self.scale * self.price_per_cent
+        return sign * ((price_units * abs(units) + divisor // 2) // divisor)
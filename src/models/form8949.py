@@ -1,16 +1,24 @@
 import sys
 from datetime import datetime, timezone
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
 
 from PySide6.QtCore import Qt, QAbstractTableModel
 from models.stash import StashState
+from models.acquisition import Acquisition
 from models.disposition import Disposition
+from models.fifo_batch import FifoMatches
+from models.adjustments import AdjustmentEngine
 
 IRS_FORM_DATE_FORMAT = "%m/%d/%Y" # "12/27/2016"
 
 class Form8949Entry:
     """Represents a single entry in IRS Form 8949"""
-    def __init__(self, description: str, date_acquired: float, date_sold: float, proceeds: float, cost_basis: float, adjustment: float, code: str, is_long_term: bool):
+
+    __slots__ = ("description", "date_acquired", "date_sold", "proceeds", "cost_basis",
+                 "adjustment", "code", "year_sold", "is_long_term", "amount", "lot_number")
+
+    def __init__(self, description: str, date_acquired: float, date_sold: float, proceeds: float, cost_basis: float, adjustment: float, code: str, is_long_term: bool,
+                 amount: float = 0.0, lot_number: int = 0):
         self.description:str = description
         self.date_acquired: float = date_acquired
         self.date_sold: float = date_sold  # timestamp
@@ -21,11 +29,72 @@ class Form8949Entry:
         # not on for 8949
         self.year_sold: int = datetime.fromtimestamp(date_sold, tz=timezone.utc).year
         self.is_long_term: bool = is_long_term  # Add this line
+        # for adjustment rules (see AdjustmentEngine)
+        self.amount: float = amount
+        self.lot_number: int = lot_number
 
     @property
     def gain_or_loss(self) -> float:
         return self.proceeds - self.cost_basis + self.adjustment
 
+    def __reduce__(self):
+        # entries come back from Portfolio's worker processes by the thousand. A plain
+        # argument tuple pickles several times faster than the default for __slots__
+        return (_entry_from_fields, tuple(getattr(self, name) for name in Form8949Entry.__slots__))
+
+def _entry_from_fields(*fields) -> Form8949Entry:
+    entry = Form8949Entry.__new__(Form8949Entry)
+    for name, value in zip(Form8949Entry.__slots__, fields):
+        setattr(entry, name, value)
+    return entry
+
+def entries_from_states(states: List[StashState]) -> List[Form8949Entry]:
+    """One entry per lot used by each disposition, in the order the stash's lot policy used them"""
+    return list(iter_entries_from_states(states))
+
+def iter_entries_from_states(states: Iterable[StashState]) -> Iterator[Form8949Entry]:
+    """entries_from_states(), one at a time"""
+    for state in states:
+        if isinstance(state.activity, Disposition):
+            for lot in state.lots_affected:
+                entry = Form8949Entry(
+                    description=f"{-lot.update_amount_delta:.8f} {state.activity.asset}",
+                    date_acquired=lot.initial_timestamp,
+                    date_sold=state.timestamp,
+                    proceeds=lot.sale_proceeds,
+                    cost_basis=lot.sale_basis,
+                    adjustment=0.0,  # Assuming no adjustments for simplicity
+                    code="",  # Assuming no code for simplicityy
+                    is_long_term=lot.is_long_term,  # Add this line to pass the is_long_term parameter
+                    amount=-lot.update_amount_delta,
+                    lot_number=lot.lot_number
+                )
+                yield entry
+
+def entries_from_matches(matches: FifoMatches) -> List[Form8949Entry]:
+    """Form 8949 entries straight from batch FIFO matches (see fifo_batch.match_fifo()),
+       the same ones Form8949TableModel generates from the states
+    """
+    return list(iter_entries_from_matches(matches))
+
+def iter_entries_from_matches(matches: FifoMatches) -> Iterator[Form8949Entry]:
+    """entries_from_matches(), one at a time"""
+    return (Form8949Entry(
+                description=f"{amount:.8f} {matches.asset}",
+                date_acquired=date_acquired,
+                date_sold=date_sold,
+                proceeds=proceeds,
+                cost_basis=cost_basis,
+                adjustment=0.0,
+                code="",
+                is_long_term=is_long_term,
+                amount=amount,
+                lot_number=lot_number)
+            for amount, date_acquired, date_sold, proceeds, cost_basis, is_long_term, lot_number in zip(
+                matches.amount.tolist(), matches.date_acquired.tolist(), matches.date_sold.tolist(),
+                matches.proceeds.tolist(), matches.cost_basis.tolist(), matches.is_long_term.tolist(),
+                matches.lot_number.tolist()))
+
 class Form8949TableModel(QAbstractTableModel):
     """Model for a table containing entries for IRS Form 8949"""
 
@@ -42,8 +111,9 @@ class Form8949TableModel(QAbstractTableModel):
     GAIN_OR_LOSS_COLUMN = 7
     TERM_COLUMN = 8  # New TERM_COLUMN
 
-    def __init__(self, states: List[StashState]) -> None:
+    def __init__(self, states: List[StashState], adjustments: AdjustmentEngine = None) -> None:
         super(Form8949TableModel, self).__init__()
+        self.adjustments: AdjustmentEngine = adjustments if adjustments else AdjustmentEngine()
         self.all_entries: List[Form8949Entry] = []
         self.all_years: List[int] = []
         self.displayed_years: List[int] = []
@@ -52,21 +122,9 @@ class Form8949TableModel(QAbstractTableModel):
 
 
     def _generate_entries(self, states: List[StashState]) -> List[Form8949Entry]:
-        entries = []
-        for state in states:
-            if isinstance(state.activity, Disposition):
-                for lot in state.lots_affected:
-                    entry = Form8949Entry(
-                        description=f"{-lot.update_amount_delta:.8f} {state.activity.asset}",
-                        date_acquired=lot.initial_timestamp,
-                        date_sold=state.timestamp,
-                        proceeds=lot.sale_proceeds,
-                        cost_basis=lot.sale_basis,
-                        adjustment=0.0,  # Assuming no adjustments for simplicity
-                        code="",  # Assuming no code for simplicityy
-                        is_long_term=lot.is_long_term  # Add this line to pass the is_long_term parameter
-                    )
-                    entries.append(entry)
+        entries = entries_from_states(states)
+        if self.adjustments.rules:
+            self.adjustments.apply(entries, (state.activity for state in states if isinstance(state.activity, Acquisition)))
         return entries
 
     def _find_all_years(self, entries: List[Form8949Entry]) -> None:
@@ -0,0 +1,133 @@
+import sys
+import csv
+import tempfile
+from datetime import datetime, timezone, date
+from typing import List, Dict, Iterable, Iterator, TextIO, Callable
+
+from models.acquisition import Acquisition
+from models.stash import Stash
+from models.adjustments import AdjustmentEngine
+from models.form8949 import Form8949Entry, IRS_FORM_DATE_FORMAT, iter_entries_from_states
+
+# Form 8949 files written a row at a time, straight from the entries as they are made.
+#
+# Rows are grouped into Part I (short term) and Part II (long term). Each part's rows
+# are spooled to a temporary file as the entries come, so memory use doesn't depend
+# on the number of entries.
+
+CSV_HEADER = ["Description", "Date Acquired", "Date Sold", "Proceeds", "Cost Basis", "Code", "Adjustment", "Gain or Loss"]
+
+# TXF (Tax Exchange Format, v042) reference numbers for Form 8949 boxes C and F:
+# short and long term, not reported on a 1099-B
+TXF_SHORT_TERM = 713
+TXF_LONG_TERM = 716
+
+
+class Form8949Totals:
+    """Running totals of the entries written, by term. Same sums as Form8949TableModel's displayed_*_sum()"""
+
+    def __init__(self) -> None:
+        self.count: Dict[bool, int] = {False: 0, True: 0} # by is_long_term
+        self.proceeds: Dict[bool, float] = {False: 0.0, True: 0.0}
+        self.cost_basis: Dict[bool, float] = {False: 0.0, True: 0.0}
+        self.adjustments: Dict[bool, float] = {False: 0.0, True: 0.0}
+        self.gain: Dict[bool, float] = {False: 0.0, True: 0.0}
+
+    def add(self, entry: Form8949Entry) -> None:
+        term = entry.is_long_term
+        self.count[term] += 1
+        self.proceeds[term] += entry.proceeds
+        self.cost_basis[term] += entry.cost_basis
+        self.adjustments[term] += entry.adjustment
+        self.gain[term] += entry.gain_or_loss
+
+
+def stash_8949_entries(stash: Stash) -> Iterator[Form8949Entry]:
+    """The entries of the Form 8949 tab, one at a time. The stash must be update()d.
+
+        This should be called inside a try block
+    """
+    engine = AdjustmentEngine.from_names(stash.adjustment_rules)
+    return engine.apply_each(iter_entries_from_states(stash.states),
+                             (state.activity for state in stash.states if isinstance(state.activity, Acquisition)))
+
+def _irs_date(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime(IRS_FORM_DATE_FORMAT)
+
+def _write_grouped(entries: Iterable[Form8949Entry], years: List[int], f: TextIO,
+                   write_entry: Callable[[Form8949Entry, TextIO], None],
+                   write_part_start: Callable[[bool, TextIO], None],
+                   write_part_end: Callable[[bool, Form8949Totals, TextIO], None]) -> Form8949Totals:
+    """Writes the entries sold in years (all, if None or empty) to f, short term ones first.
+
+        Each term's entries are spooled to a temporary file as they come, then
+        copied out between that part's start and end.
+    """
+    totals = Form8949Totals()
+    spools = {False: tempfile.TemporaryFile("w+", newline=""), True: tempfile.TemporaryFile("w+", newline="")}
+    try:
+        for entry in entries:
+            if years and entry.year_sold not in years:
+                continue
+            totals.add(entry)
+            write_entry(entry, spools[entry.is_long_term])
+        for is_long_term in (False, True):
+            write_part_start(is_long_term, f)
+            spool = spools[is_long_term]
+            spool.seek(0)
+            while chunk := spool.read(1 << 20):
+                f.write(chunk)
+            write_part_end(is_long_term, totals, f)
+    finally:
+        for spool in spools.values():
+            spool.close()
+    return totals
+
+
+def write_form8949_csv(entries: Iterable[Form8949Entry], f: TextIO, years: List[int] = None) -> Form8949Totals:
+    """CSV of entries sold in years (all, if None), each part with a header and a totals row.
+
+        f should be opened with newline="". Returns the totals.
+    """
+    def write_entry(entry: Form8949Entry, out: TextIO) -> None:
+        csv.writer(out).writerow([entry.description, _irs_date(entry.date_acquired), _irs_date(entry.date_sold),
+                                  f"{entry.proceeds:.2f}", f"{entry.cost_basis:.2f}", entry.code,
+                                  f"{entry.adjustment:.2f}", f"{entry.gain_or_loss:.2f}"])
+
+    def write_part_start(is_long_term: bool, out: TextIO) -> None:
+        writer = csv.writer(out)
+        writer.writerow(["Part II - Long-Term" if is_long_term else "Part I - Short-Term"])
+        writer.writerow(CSV_HEADER)
+
+    def write_part_end(is_long_term: bool, totals: Form8949Totals, out: TextIO) -> None:
+        writer = csv.writer(out)
+        writer.writerow(["Part II Totals" if is_long_term else "Part I Totals", "", "",
+                         f"{totals.proceeds[is_long_term]:.2f}", f"{totals.cost_basis[is_long_term]:.2f}", "",
+                         f"{totals.adjustments[is_long_term]:.2f}", f"{totals.gain[is_long_term]:.2f}"])
+        if not is_long_term:
+            writer.writerow([])
+
+    return _write_grouped(entries, years, f, write_entry, write_part_start, write_part_end)
+
+
+def write_form8949_txf(entries: Iterable[Form8949Entry], f: TextIO, years: List[int] = None,
+                       short_term_ref: int = TXF_SHORT_TERM, long_term_ref: int = TXF_LONG_TERM,
+                       export_date: date = None) -> Form8949Totals:
+    """TXF (v042) of entries sold in years (all, if None), for tax software to import. Returns the totals.
+
+        Each entry is a format 5 record: description, dates, cost basis, proceeds
+        and, if there is one, the wash sale (or other) adjustment.
+    """
+    f.write(f"V042\nAfifo-tool\nD{(export_date or date.today()).strftime(IRS_FORM_DATE_FORMAT)}\n^\n")
+
+    def write_entry(entry: Form8949Entry, out: TextIO) -> None:
+        out.write(f"TD\nN{long_term_ref if entry.is_long_term else short_term_ref}\nC1\nL1\n"
+                  f"P{entry.description}\nD{_irs_date(entry.date_acquired)}\nD{_irs_date(entry.date_sold)}\n"
+                  f"${entry.cost_basis:.2f}\n${entry.proceeds:.2f}\n")
+        if entry.adjustment:
+            out.write(f"${entry.adjustment:.2f}\n")
+        out.write("^\n")
+
+    # TXF has no part headers or totals: the records just go in groups
+    return _write_grouped(entries, years, f, write_entry, lambda is_long_term, out: None,
+                          lambda is_long_term, totals, out: None)
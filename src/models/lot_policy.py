@@ -0,0 +1,166 @@
+import sys
+import heapq
+from typing import List, Dict, Tuple
+
+class LotPolicy:
+    """Decides which open lot a disposition draws from next.
+
+       Each policy keeps its own index of the open lots. The index belongs to a
+       single LotLedger and reflects the lots as of state #index_seq of that
+       ledger's chain - if a state at some other point in the chain needs it,
+       it is rebuilt from that state's lots. Lot balances only ever go down, so
+       lots that have been emptied are dropped from the index lazily, when they
+       come up.
+
+       The "state" arguments are StashStates.
+    """
+
+    name: str = ""
+
+    def __init__(self) -> None:
+        self.index_seq: int = -1 # the index is good as of this state seq
+
+    def copy(self) -> "LotPolicy":
+        """Same policy and settings, with an empty index"""
+        return type(self)()
+
+    def sync(self, state) -> None:
+        """Make the index match the lots of the state preceding state (about to apply its activity)"""
+        if self.index_seq != state._seq - 1:
+            self.clear()
+            for idx in range(state._lot_count):
+                lot = state._lot(idx)
+                if lot.balance > 0:
+                    self.add_lot(idx, lot)
+        self.index_seq = state._seq
+
+    def reset(self, seq: int, open_lots: Dict) -> None:
+        """Start the index over as of state #seq, from its open lots (lot idx -> lot, in idx order)"""
+        self.clear()
+        for idx, lot in open_lots.items():
+            self.add_lot(idx, lot)
+        self.index_seq = seq
+
+    def clear(self) -> None:
+        pass
+
+    def add_lot(self, idx: int, lot) -> None:
+        pass
+
+    def next_lot_idx(self, state, disposition) -> int:
+        """Index of the lot disposition should use next, or -1 if none are open"""
+        raise NotImplementedError
+
+    @classmethod
+    def from_json_dict(cls, jd: Dict) -> "LotPolicy":
+        return cls()
+
+    def to_json_dict(self) -> Dict:
+        return {"name": self.name}
+
+
+class FifoPolicy(LotPolicy):
+    """First in, first out. Uses the StashState's own open-head cursor, so it needs no index."""
+
+    name = "FIFO"
+
+    def sync(self, state) -> None:
+        self.index_seq = state._seq
+
+    def next_lot_idx(self, state, disposition) -> int:
+        return state.current_lot_idx()
+
+
+class LifoPolicy(LotPolicy):
+    """Last in, first out: the open lots are a stack"""
+
+    name = "LIFO"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._stack: List[int] = []
+
+    def clear(self) -> None:
+        self._stack = []
+
+    def add_lot(self, idx: int, lot) -> None:
+        self._stack.append(idx)
+
+    def next_lot_idx(self, state, disposition) -> int:
+        while self._stack and state._lot(self._stack[-1]).balance <= 0:
+            self._stack.pop()
+        return self._stack[-1] if self._stack else -1
+
+
+class HifoPolicy(LotPolicy):
+    """Highest (unit) cost first: the open lots are a heap keyed on unit_cost_basis.
+
+       Equal-cost lots are used oldest first.
+    """
+
+    name = "HIFO"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._heap: List[Tuple[float, int]] = [] # (-unit_cost_basis, lot idx)
+
+    def clear(self) -> None:
+        self._heap = []
+
+    def add_lot(self, idx: int, lot) -> None:
+        heapq.heappush(self._heap, (-lot.unit_cost_basis, idx))
+
+    def next_lot_idx(self, state, disposition) -> int:
+        while self._heap and state._lot(self._heap[0][1]).balance <= 0:
+            heapq.heappop(self._heap)
+        return self._heap[0][1] if self._heap else -1
+
+
+class SpecificIdPolicy(LotPolicy):
+    """Specific identification: each disposition names the lots it uses, by lot number.
+
+       selections maps a disposition reference to a list of lot numbers, used in
+       that order. Whatever a disposition needs beyond its selected lots (or all
+       of it, if it has no selection) comes from the remaining lots FIFO-style.
+    """
+
+    name = "SpecificID"
+
+    def __init__(self, selections: Dict[str, List[int]] = None) -> None:
+        super().__init__()
+        self.selections: Dict[str, List[int]] = selections if selections else {}
+        self._open: Dict[int, int] = {} # lot number -> lot idx
+
+    def copy(self) -> "SpecificIdPolicy":
+        return SpecificIdPolicy(self.selections)
+
+    def clear(self) -> None:
+        self._open = {}
+
+    def add_lot(self, idx: int, lot) -> None:
+        self._open[lot.lot_number] = idx
+
+    def next_lot_idx(self, state, disposition) -> int:
+        for lot_number in self.selections.get(disposition.reference, ()):
+            idx = self._open.get(lot_number)
+            if idx is not None:
+                if state._lot(idx).balance > 0:
+                    return idx
+                del self._open[lot_number]
+        return state.current_lot_idx()
+
+    @classmethod
+    def from_json_dict(cls, jd: Dict) -> "SpecificIdPolicy":
+        return cls({ref: list(lot_numbers) for ref, lot_numbers in jd.get("selections", {}).items()})
+
+    def to_json_dict(self) -> Dict:
+        return {"name": self.name, "selections": self.selections}
+
+
+LOT_POLICIES: Dict[str, type] = {policy.name: policy for policy in (FifoPolicy, LifoPolicy, HifoPolicy, SpecificIdPolicy)}
+
+def lot_policy_from_json_dict(jd: Dict) -> LotPolicy:
+    """A json-serialized policy is a dict with at least a "name". This should be called inside a try block"""
+    if jd["name"] not in LOT_POLICIES:
+        raise ValueError(f"Unknown lot selection policy: {jd['name']}")
+    return LOT_POLICIES[jd["name"]].from_json_dict(jd)
@@ -0,0 +1,138 @@
+import sys
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict
+
+from models.stash import Stash, StashState
+from models.fifo_batch import match_fifo
+from models.lot_policy import FifoPolicy
+from models.adjustments import AdjustmentEngine
+from models.fixed_point import AssetUnits
+from models.form8949 import Form8949Entry, entries_from_matches, entries_from_states
+
+def _without_states(stash: Stash) -> Stash:
+    """What a worker process needs of stash: its transactions and settings. Its states
+       would only be pickled to the worker to be thrown away there.
+    """
+    job = Stash(stash.asset, stash.title, stash.acquisitions, stash.dispositions, stash.fixed_point,
+                stash.lot_policy, stash.adjustment_rules)
+    job.checkpoint_interval = stash.checkpoint_interval
+    return job
+
+def _update_stash(stash: Stash) -> Stash:
+    """Worker process: sort, number and build the states for one stash"""
+    stash.update()
+    return stash
+
+def _stash_8949_entries(stash: Stash) -> List[Form8949Entry]:
+    """Worker process: Form 8949 entries for one stash. Only the entries go back to the parent.
+
+        FIFO stashes use batch matching. Other lot policies need the states.
+    """
+    if not isinstance(stash.lot_policy, FifoPolicy):
+        stash.update()
+        entries = entries_from_states(stash.states)
+    else:
+        units = AssetUnits(stash.asset) if stash.fixed_point else None
+        stash.acquisitions = Stash.sorted_by_timestamp(stash.acquisitions)
+        stash.dispositions = Stash.sorted_by_timestamp(stash.dispositions)
+        # the adjustment rules find lots by number. match_fifo() numbers them the same way
+        stash.number_lots()
+        entries = entries_from_matches(match_fifo(stash.asset, stash.acquisitions, stash.dispositions, units))
+    return AdjustmentEngine.from_names(stash.adjustment_rules).apply(entries, stash.acquisitions)
+
+
+class Portfolio:
+    """A collection of single-asset Stashes, kept in one file.
+
+       The assets are independent of each other, so they can be computed in
+       parallel, one worker process per stash. Workers are sent transactions
+       and settings only, never states.
+    """
+    def __init__(self, title: str = "", stashes: List[Stash] = []) -> None:
+        self.title = title
+        self.stashes: Dict[str, Stash] = {} # by asset
+        for stash in stashes:
+            self.add_stash(stash)
+
+    @property
+    def assets(self) -> List[str]:
+        return list(self.stashes.keys())
+
+    def add_stash(self, stash: Stash) -> None:
+        if stash.asset in self.stashes:
+            raise ValueError(f"Portfolio already has a {stash.asset} stash")
+        self.stashes[stash.asset] = stash
+
+    def _run(self, func, stashes: List[Stash], max_workers: int = None) -> List:
+        """Apply func to each of stashes, in worker processes if there's more than one.
+
+           Workers get each stash without its states (see _without_states()),
+           and send back whatever func returns.
+        """
+        if len(stashes) < 2 or max_workers == 1:
+            return [func(stash) for stash in stashes]
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(func, [_without_states(stash) for stash in stashes]))
+
+    def update(self, max_workers: int = 1) -> None:
+        """Rebuild the states of every stash.
+
+           The states are needed here, and pickling them back from a worker
+           process costs more than building them for a FIFO stash, so by default
+           they're built in this process. With max_workers (None for one per
+           CPU) they're built in parallel, which pays for lot policies that make
+           states slow to build. For just the 8949 entries, form8949_entries()
+           doesn't need states at all.
+        """
+        for stash in self._run(_update_stash, list(self.stashes.values()), max_workers):
+            self.stashes[stash.asset] = stash
+
+    @property
+    def states(self) -> List[StashState]:
+        """The states of all the stashes, merged into one time-ordered list"""
+        return list(heapq.merge(*[stash.states for stash in self.stashes.values()], key=lambda st: st.timestamp))
+
+    def as_of(self, timestamp: float) -> Dict[str, StashState]:
+        """Each asset's state as of timestamp (see Stash.as_of()). Assets with no activity yet are left out."""
+        states = {asset: stash.as_of(timestamp) for asset, stash in self.stashes.items()}
+        return {asset: state for asset, state in states.items() if state is not None}
+
+    def form8949_entries(self, max_workers: int = None) -> List[Form8949Entry]:
+        """Form 8949 entries for every asset, in order of sale date.
+
+            FIFO stashes are matched with match_fifo(), so no states are needed
+            for them. That's quicker than pickling a stash to a worker process
+            and its entries back, so they're done here. The others build their
+            states in parallel, and only send back their entries.
+        """
+        stashes = list(self.stashes.values())
+        per_asset = [_stash_8949_entries(stash) for stash in stashes if isinstance(stash.lot_policy, FifoPolicy)]
+        per_asset += self._run(_stash_8949_entries, [stash for stash in stashes if not isinstance(stash.lot_policy, FifoPolicy)],
+                               max_workers)
+        return list(heapq.merge(*per_asset, key=lambda e: e.date_sold))
+
+    @classmethod
+    def from_json_dict(cls, jd: Dict) -> "Portfolio":
+        """A json-serialized Portfolio is a dict when loaded.
+
+        Looks like this:
+
+            {
+                "title": "Everything",
+                "stashes": [Stash1, Stash2...]
+            }
+
+        A single Stash dict is accepted too, as a one-asset portfolio.
+
+        This should be called inside a try block
+        """
+        if "stashes" not in jd:
+            return Portfolio(jd["title"], [Stash.from_json_dict(jd)])
+        return Portfolio(jd["title"], [Stash.from_json_dict(sjd) for sjd in jd["stashes"]])
+
+    def to_json_dict(self) -> Dict:
+        return {
+            "title": self.title,
+            "stashes": [stash.to_json_dict() for stash in self.stashes.values()]
+        }
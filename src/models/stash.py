@@ -1,12 +1,20 @@
 import sys
 import json
+import heapq
+from itertools import pairwise
 from datetime import datetime, timezone
 from typing import List, Dict, Any, Tuple
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from collections.abc import Sequence
 
 from PySide6.QtCore import Qt, QAbstractTableModel
 
 from models.acquisition import Acquisition
 from models.disposition import Disposition
+from models.tx_store import TxStore
+from models.fixed_point import AssetUnits
+from models.lot_policy import LotPolicy, FifoPolicy, lot_policy_from_json_dict
 
 class LotState:
     """State of stuff acquired at the same timne
@@ -14,6 +22,9 @@ class LotState:
 
     ONE_YEAR_SECS = 24 * 60 * 60 * 365.0
 
+    __slots__ = ("acquisition", "update_timestamp", "update_amount_delta", "update_asset_price",
+                 "update_fees", "balance")
+
     def __init__(self, base_acq: Acquisition):
         # constant across activities
         self.acquisition: Acquisition = base_acq
@@ -124,24 +135,325 @@ class LotState:
         }
 
 
+class FixedLotState(LotState):
+    """A LotState that does its lot math in integers: asset amounts in base units,
+       unit prices in price units and money in cents (see AssetUnits).
+
+       Same interface as LotState - the float attributes are converted on access.
+    """
+
+    __slots__ = ("units", "balance_units", "delta_units", "price_units", "fees_cents")
+
+    def __init__(self, base_acq: Acquisition, units: AssetUnits):
+        self.units: AssetUnits = units
+        super().__init__(base_acq)
+
+    @property
+    def balance(self) -> float:
+        return self.units.to_amount(self.balance_units)
+
+    @balance.setter
+    def balance(self, value: float) -> None:
+        self.balance_units = self.units.to_units(value)
+
+    @property
+    def update_amount_delta(self) -> float:
+        return self.units.to_amount(self.delta_units)
+
+    @update_amount_delta.setter
+    def update_amount_delta(self, value: float) -> None:
+        self.delta_units = self.units.to_units(value)
+
+    @property
+    def update_asset_price(self) -> float:
+        return self.units.to_price(self.price_units)
+
+    @update_asset_price.setter
+    def update_asset_price(self, value: float) -> None:
+        self.price_units = self.units.to_price_units(value)
+
+    @property
+    def update_fees(self) -> float:
+        return self.units.to_money(self.fees_cents)
+
+    @update_fees.setter
+    def update_fees(self, value: float) -> None:
+        self.fees_cents = self.units.to_cents(value)
+
+    @property
+    def sale_basis_cents(self) -> int:
+        return self.units.value_cents(self.units.to_price_units(self.initial_price), -self.delta_units)
+
+    @property
+    def sale_proceeds_cents(self) -> int:
+        return self.units.value_cents(self.price_units, -self.delta_units) - self.fees_cents
+
+    @property
+    def cap_gains_cents(self) -> int:
+        return self.sale_proceeds_cents - self.sale_basis_cents
+
+    @property
+    def sale_basis(self) -> float:
+        return self.units.to_money(self.sale_basis_cents)
+
+    @property
+    def sale_proceeds(self) -> float:
+        return self.units.to_money(self.sale_proceeds_cents)
+
+    @property
+    def cap_gains(self) -> float:
+        return self.units.to_money(self.cap_gains_cents)
+
+    @classmethod
+    def copy(cls, src: "FixedLotState") -> "FixedLotState":
+        dst = cls(src.acquisition, src.units)
+        dst.balance_units = src.balance_units
+        return dst
+
+    def dispose(self, timestamp: float, amount: float, price: float, fees: float ) -> float:
+        assert amount >= 0, f"FixedLotState.dispose() - Amount must be positive, got {amount}"
+        self.update_timestamp = timestamp
+        self.update_asset_price = price
+        self.update_fees = fees
+
+        amount_units: int = self.units.to_units(amount)
+        overdraw: int = amount_units - self.balance_units
+        if overdraw > 0:
+            self.delta_units = -self.balance_units
+            self.balance_units = 0
+            return self.units.to_amount(overdraw)
+        else:
+            self.delta_units = -amount_units
+            self.balance_units -= amount_units
+            return 0
+
+
+class LotLedger:
+    """Shared version history of every lot in a chain of StashStates
+
+       Lots are stored "fat node" style: each lot index has a list of
+       (state sequence number, LotState) versions, appended whenever an
+       activity touches that lot. A StashState only holds the lots its own
+       activity touched and finds everything else here, as of its own
+       sequence number. States in a chain all share one ledger.
+
+       A ledger can start part way along a chain (see StateCheckpoint.restore()),
+       with a history for just the lots open at that point. Lots with no
+       history of their own are the ones already closed by then: those are
+       looked up in closed_lots, which any number of ledgers can share.
+
+       If the ledger has AssetUnits its lots are FixedLotStates.
+
+       The ledger also owns the lot selection policy's index of open lots,
+       which follows whichever state of the chain most recently applied an
+       activity (see LotPolicy).
+    """
+    def __init__(self, units: AssetUnits = None, policy: LotPolicy = None,
+                 lot_count: int = 0, closed_lots: Sequence = None):
+        self.units: AssetUnits = units
+        self.policy: LotPolicy = policy if policy else FifoPolicy()
+        self.version_seqs: Dict[int, List[int]] = {} # by lot index
+        self.versions: Dict[int, List[LotState]] = {} # by lot index
+        self.lot_count: int = lot_count
+        self.base_lot_count: int = lot_count # lots from before the ledger's own history, closed ones in closed_lots
+        self.closed_lots: Sequence = closed_lots
+        self.tip_seq: int = 0 # seq of the newest state recorded
+        self._log: List[Tuple[int, int]] = [] # (seq, lot idx) for every version, in the order added
+
+    def new_lot(self, acquisition: Acquisition) -> LotState:
+        return FixedLotState(acquisition, self.units) if self.units else LotState(acquisition)
+
+    def lot_at(self, lot_idx: int, seq: int) -> LotState:
+        """The version of the lot that was current as of state #seq"""
+        seqs = self.version_seqs.get(lot_idx)
+        if seqs is None:
+            return self.closed_lots[lot_idx]
+        pos = bisect_right(seqs, seq) - 1
+        return self.versions[lot_idx][pos] if pos >= 0 else self.closed_lots[lot_idx]
+
+    def latest(self, lot_idx: int) -> LotState:
+        """The newest version of the lot"""
+        versions = self.versions.get(lot_idx)
+        return versions[-1] if versions else self.closed_lots[lot_idx]
+
+    def add_lot(self, seq: int, lot: LotState) -> int:
+        """Start a new lot history and return its index"""
+        idx = self.lot_count
+        self.lot_count += 1
+        self.version_seqs[idx] = [seq]
+        self.versions[idx] = [lot]
+        self.tip_seq = seq
+        self._log.append((seq, idx))
+        return idx
+
+    def add_version(self, lot_idx: int, seq: int, lot: LotState) -> None:
+        self.version_seqs.setdefault(lot_idx, []).append(seq)
+        self.versions.setdefault(lot_idx, []).append(lot)
+        self.tip_seq = seq
+        self._log.append((seq, lot_idx))
+
+    def truncate(self, seq: int) -> None:
+        """Drop all history recorded after state #seq, in place.
+
+            Costs only the number of versions dropped. Any state newer than
+            #seq that still refers to this ledger is invalid afterwards.
+        """
+        while self._log and self._log[-1][0] > seq:
+            _, lot_idx = self._log.pop()
+            self.version_seqs[lot_idx].pop()
+            self.versions[lot_idx].pop()
+            if not self.versions[lot_idx]:
+                del self.version_seqs[lot_idx]
+                del self.versions[lot_idx]
+                if lot_idx >= self.base_lot_count:
+                    # only the newest lot can lose its first version
+                    self.lot_count -= 1
+        self.tip_seq = seq
+
+    def fork(self, seq: int) -> "LotLedger":
+        """A new ledger holding only the history up to (and including) state #seq
+
+            Used when an activity is applied to a state that is not the newest
+            one in its chain, so the existing chain is not disturbed.
+        """
+        dst = LotLedger(self.units, self.policy.copy(), self.base_lot_count, self.closed_lots)
+        for idx, seqs in self.version_seqs.items():
+            count = bisect_right(seqs, seq)
+            if count:
+                dst.version_seqs[idx] = seqs[:count]
+                dst.versions[idx] = self.versions[idx][:count]
+                dst.lot_count = max(dst.lot_count, idx + 1)
+        dst._log = [entry for entry in self._log if entry[0] <= seq]
+        dst.tip_seq = seq
+        return dst
+
+
+class ClosedLots(Sequence):
+    """Empty lots for a list of lot acquisitions, made when first asked for and then shared
+       by every ledger restored from a StateCheckpoint (see LotLedger.closed_lots)
+    """
+
+    def __init__(self, lot_acquisitions: List[Acquisition], units: AssetUnits = None) -> None:
+        self._acquisitions: List[Acquisition] = lot_acquisitions
+        self._ledger: LotLedger = LotLedger(units) # just for new_lot()
+        self._lots: Dict[int, LotState] = {}
+
+    def __len__(self) -> int:
+        return len(self._acquisitions)
+
+    def __getitem__(self, idx: int) -> LotState:
+        lot = self._lots.get(idx)
+        if lot is None:
+            lot = self._lots[idx] = self._ledger.new_lot(self._acquisitions[idx])
+        return lot
+
+
 class StashState:
     """State of the stash after an activity is applied
 
        An acquisition will add a new lots entry, but lots will never go away -
        they just have their balance reduced until it's zero.
 
+       A state only keeps the lots touched by its own activity. All other lots
+       are shared with the preceding states through a LotLedger.
+
+       Which open lot a disposition uses next is up to the ledger's LotPolicy.
+       With FIFO (the default) lots are used up oldest-first, so every lot
+       before the "open head" index is known to be empty and finding the
+       current lot starts there rather than at the first lot ever acquired.
+
+       Running totals (balance, open cost basis, realized gains to date) and the
+       per-activity lot figures are computed once, when the activity is applied.
     """
-    def __init__(self):
+    def __init__(self, ledger: LotLedger = None, seq: int = 0, lot_count: int = 0, open_head: int = 0):
         self.activity: Acquisition | Disposition = None
-        self.lots : list[LotState] = []
+        self._ledger: LotLedger = ledger if ledger else LotLedger()
+        self._seq: int = seq # position in the ledger's state chain. 0 is "nothing has happened"
+        self._lot_count: int = lot_count
+        self._open_head: int = open_head # all lots before this index have a zero balance
+        self._touched: Dict[int, LotState] = {} # lot idx -> lot modified by this state's activity
+
+        # running totals, carried forward from the previous state
+        self.balance: float = 0
+        self.open_cost_basis: float = 0 # 8949-style basis (see LotState.sale_basis) of what is still held
+        self.realized_short_term_gains: float = 0
+        self.realized_long_term_gains: float = 0
+        # the same totals in base units/cents, when the ledger does fixed-point lot math
+        self._balance_units: int = 0
+        self._open_cost_basis_cents: int = 0
+        self._realized_short_term_cents: int = 0
+        self._realized_long_term_cents: int = 0
+
+        # this activity only
+        self.lots_affected: List[LotState] = []
+        # {"L": sum_of_long_term_cap_gains (only if there are any),
+        #  "S": sum_of_short_term_cap_gains (only if there are any)}
+        #  or None if there are no cap gains at all
+        self.cap_gains: Dict[str, float] = None
+        # list of cap gain trades tuples: (is_long_term, lot_id, cap_gains)
+        self.cap_gains_2: List[Tuple[bool, int, float]] = []
 
     @classmethod
     def copy(cls, src: "StashState") -> "StashState":
-        dst = StashState()
+        """ Makes the state that follows src: same lots, sharing src's ledger.
+
+            Lots are only copied when the new state's activity touches them.
+        """
+        ledger = src._ledger
+        if ledger.tip_seq != src._seq:
+            ledger = ledger.fork(src._seq) # src is not the newest state, so branch off
+        dst = cls(ledger, src._seq + 1, src._lot_count, src._open_head)
         dst.activity = src.activity
-        dst.lots = [LotState.copy(l) for l in src.lots]
+        dst.balance = src.balance
+        dst.open_cost_basis = src.open_cost_basis
+        dst.realized_short_term_gains = src.realized_short_term_gains
+        dst.realized_long_term_gains = src.realized_long_term_gains
+        dst._balance_units = src._balance_units
+        dst._open_cost_basis_cents = src._open_cost_basis_cents
+        dst._realized_short_term_cents = src._realized_short_term_cents
+        dst._realized_long_term_cents = src._realized_long_term_cents
         return dst
 
+    @property
+    def lots(self) -> List[LotState]:
+        """All lots as of this state.
+
+            Lots not touched by this state's activity are returned as copies with
+            only the balance carried forward (all update* attributes zero).
+        """
+        return [self._touched[idx] if idx in self._touched
+                    else self._copy_lot(self._ledger.lot_at(idx, self._seq))
+                for idx in range(self._lot_count)]
+
+    @property
+    def open_lots(self) -> List[LotState]:
+        """The lots with something left in them as of this state (see lots)"""
+        return [self._touched[idx] if idx in self._touched else self._copy_lot(self._lot(idx))
+                for idx in range(self._open_head, self._lot_count) if self._lot(idx).balance > 0]
+
+    def _lot(self, idx: int) -> LotState:
+        """Read-only access to lot #idx as of this state"""
+        lot = self._touched.get(idx)
+        return lot if lot is not None else self._ledger.lot_at(idx, self._seq)
+
+    @staticmethod
+    def _copy_lot(lot: LotState) -> LotState:
+        return type(lot).copy(lot)
+
+    def _touch(self, idx: int) -> LotState:
+        """Copy-on-write: returns this state's own, modifiable, version of lot #idx"""
+        lot = self._touched.get(idx)
+        if lot is None:
+            lot = self._copy_lot(self._ledger.lot_at(idx, self._seq))
+            self._ledger.add_version(idx, self._seq, lot)
+            self._touched[idx] = lot
+        return lot
+
+    def _add_lot(self, lot: LotState) -> None:
+        idx = self._ledger.add_lot(self._seq, lot)
+        self._touched[idx] = lot
+        self._lot_count = idx + 1
+
     @property
     def tx_type(self) -> Acquisition|Disposition:
         return type(self.activity)
@@ -178,46 +490,70 @@ class StashState:
 
     # computed state stuff
     @property
-    def balance(self) -> float:
-        return sum(l.balance for l in self.lots)
+    def realized_gains(self) -> float:
+        return self.realized_short_term_gains + self.realized_long_term_gains
 
-    @property
-    def lots_affected(self) -> List[LotState]:
-        return [l for l in self.lots if l.update_amount_delta != 0]
+    def _update_totals(self) -> None:
+        """Fill in the per-activity figures and running totals once the activity is applied"""
+        # in the order the lot policy used them
+        self.lots_affected = [lot for lot in self._touched.values() if lot.update_amount_delta != 0]
 
+        units = self._ledger.units
+        if units:
+            self._update_fixed_point_totals(units)
+            return
 
-    @property
-    def cap_gains(self) -> Dict[str, float]:
-        """ returns a Dict potentially containing:
-            {"L": sum_of_long_term_cap_gains (only if there are any),
-            "S": sum_of_short_term_cap_gains (only if there are any)}
-            or None if there are no cap gains at all
-        """
-        long_term_gains = [l.cap_gains for l in self.lots_affected if l.is_long_term]
-        short_term_gains = [l.cap_gains for l in self.lots_affected if not l.is_long_term]
+        is_disposition = isinstance(self.activity, Disposition)
         gains_dict: Dict[str, float] = {}
-        if long_term_gains:
-            gains_dict["L"] = sum(long_term_gains)
-        if short_term_gains:
-            gains_dict["S"] = sum(short_term_gains)
-        return gains_dict if gains_dict else None
-
-    @property
-    def cap_gains_2(self) -> List[Tuple[bool, int, float]]:
-        """ returns a list of cap gain trades tuples.
-
-            Each trade is a 3 element tuple: (is_long_term, lot_id, cap_gains)
-            or None if there are no cap gains at all
-        """
-        return [(l.is_long_term, l.lot_number, l.cap_gains) for l in self.lots_affected if l.cap_gains != 0]
+        for l in self.lots_affected:
+            self.balance += l.update_amount_delta
+            self.open_cost_basis += l.initial_price * l.update_amount_delta
+            lot_gains = l.cap_gains
+            gains_key = "L" if l.is_long_term else "S"
+            gains_dict[gains_key] = gains_dict.get(gains_key, 0) + lot_gains
+            if lot_gains != 0:
+                self.cap_gains_2.append((l.is_long_term, l.lot_number, lot_gains))
+            if is_disposition:
+                if l.is_long_term:
+                    self.realized_long_term_gains += lot_gains
+                else:
+                    self.realized_short_term_gains += lot_gains
+        self.cap_gains = gains_dict if gains_dict else None
+
+    def _update_fixed_point_totals(self, units: AssetUnits) -> None:
+        """_update_totals() for FixedLotStates: sums whole base units and cents"""
+        is_disposition = isinstance(self.activity, Disposition)
+        gains_cents: Dict[str, int] = {}
+        for l in self.lots_affected:
+            self._balance_units += l.delta_units
+            self._open_cost_basis_cents -= l.sale_basis_cents
+            lot_gains_cents = l.cap_gains_cents
+            gains_key = "L" if l.is_long_term else "S"
+            gains_cents[gains_key] = gains_cents.get(gains_key, 0) + lot_gains_cents
+            if lot_gains_cents != 0:
+                self.cap_gains_2.append((l.is_long_term, l.lot_number, units.to_money(lot_gains_cents)))
+            if is_disposition:
+                if l.is_long_term:
+                    self._realized_long_term_cents += lot_gains_cents
+                else:
+                    self._realized_short_term_cents += lot_gains_cents
+        self.balance = units.to_amount(self._balance_units)
+        self.open_cost_basis = units.to_money(self._open_cost_basis_cents)
+        self.realized_short_term_gains = units.to_money(self._realized_short_term_cents)
+        self.realized_long_term_gains = units.to_money(self._realized_long_term_cents)
+        self.cap_gains = {key: units.to_money(cents) for key, cents in gains_cents.items()} if gains_cents else None
 
     # TODO: property? method? Make up your (my) mind on these
 
     def current_lot(self) -> LotState:
-        return next((l for l in self.lots if l.balance > 0), None)
+        idx = self.current_lot_idx()
+        return self._lot(idx) if idx != -1 else None
 
     def current_lot_idx(self) -> int:
-        return next((idx for idx,l in enumerate(self.lots) if l.balance > 0), -1)
+        # Lot balances only ever go down, so the head never has to move back
+        while self._open_head < self._lot_count and self._lot(self._open_head).balance <= 0:
+            self._open_head += 1
+        return self._open_head if self._open_head < self._lot_count else -1
 
     def to_json_dict(self) -> Dict:
         return  {
@@ -231,68 +567,334 @@ class StashState:
         new_state = StashState.copy(self)
         new_state.activity = activity
 
+        policy = new_state._ledger.policy
+        policy.sync(new_state)
+
         if isinstance(activity, Acquisition):
-            new_lot = LotState(activity)
+            new_lot = new_state._ledger.new_lot(activity)
             new_lot.acquire()
-            new_state.lots.append(new_lot)
+            new_state._add_lot(new_lot)
+            policy.add_lot(new_state._lot_count - 1, new_lot)
 
         elif isinstance(activity, Disposition):
             amount_left = activity.asset_amount
-            while new_state.current_lot() and amount_left > 0:
-                amount_left = new_state.current_lot().dispose(activity.timestamp, amount_left, activity.asset_price, activity.fees)
+            lot_idx = policy.next_lot_idx(new_state, activity)
+            while lot_idx != -1 and amount_left > 0:
+                amount_left = new_state._touch(lot_idx).dispose(activity.timestamp, amount_left, activity.asset_price, activity.fees)
+                lot_idx = policy.next_lot_idx(new_state, activity)
             # should be an assert?
             if amount_left != 0:
                 print(f"Error! Activity #{activity_idx} Disposition {activity.timestamp} overdrawn {amount_left}")
+        new_state._update_totals()
+        if new_state.current_lot_idx() == -1 and not new_state._ledger.units:
+            # don't let float residue from the running totals show up as a balance
+            new_state.balance = 0
+            new_state.open_cost_basis = 0
         return new_state
 
 
+class StateCheckpoint:
+    """Enough to restart the state chain in front of an activity: the open lots
+       and running totals of the state before it.
+
+       Lots are shared with the ledger they came from - lot versions are never
+       modified once their state is complete. Closed lots are not kept at all,
+       and restore() doesn't recreate them either: the restored ledger finds
+       them in a shared ClosedLots. Restoring costs the number of open lots.
+    """
+
+    TOTALS = ("balance", "open_cost_basis", "realized_short_term_gains", "realized_long_term_gains",
+              "_balance_units", "_open_cost_basis_cents", "_realized_short_term_cents", "_realized_long_term_cents")
+
+    __slots__ = ("seq", "lot_count", "open_head", "open_lots", "totals")
+
+    def __init__(self, state: StashState) -> None:
+        self.seq: int = state._seq
+        self.lot_count: int = state._lot_count
+        self.open_head: int = state._open_head
+        ledger = state._ledger
+        at_tip = ledger.tip_seq <= state._seq # then a lot's newest version is the one as of this state
+        self.open_lots: Dict[int, LotState] = {}
+        # a lot without a history in the ledger was already closed when the ledger started
+        for idx in sorted(idx for idx in ledger.versions if state._open_head <= idx < state._lot_count):
+            lot = ledger.latest(idx) if at_tip else state._lot(idx)
+            if lot.balance > 0:
+                self.open_lots[idx] = lot
+        self.totals: Tuple = tuple(getattr(state, name) for name in StateCheckpoint.TOTALS)
+
+    def restore(self, closed_lots: "ClosedLots", units: AssetUnits, policy: LotPolicy) -> StashState:
+        """A state, with a ledger of its own, to apply the next activity to"""
+        ledger = LotLedger(units, policy.copy(), self.lot_count, closed_lots)
+        for idx, lot in self.open_lots.items():
+            ledger.add_version(idx, self.seq, lot)
+        ledger.policy.reset(self.seq, self.open_lots) # rather than have it look through every lot
+        state = StashState(ledger, self.seq, self.lot_count, self.open_head)
+        for name, value in zip(StateCheckpoint.TOTALS, self.totals):
+            setattr(state, name, value)
+        return state
+
+
+class LazyStates(Sequence):
+    """Read-only stand-in for the list of StashStates, for very large stashes.
+
+       Only a StateCheckpoint every `interval` activities is kept. Any other
+       state is rebuilt when asked for, by replaying the activities since the
+       nearest checkpoint, and the most recently used states are kept in an LRU
+       cache. Asking for states in order (scrolling, iterating) replays a single
+       activity per state.
+    """
+
+    DEFAULT_INTERVAL = 256
+    DEFAULT_CACHE_SIZE = 1024
+
+    def __init__(self, units: AssetUnits = None, policy: LotPolicy = None,
+                 interval: int = DEFAULT_INTERVAL, cache_size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.units: AssetUnits = units
+        self.policy: LotPolicy = policy if policy else FifoPolicy()
+        self.interval: int = interval
+        self.cache_size: int = cache_size
+        self.activities: List[Acquisition | Disposition] = [] # enabled and sorted, one per state
+        self._closed_lots: ClosedLots = ClosedLots([], units) # by lot idx, for restored ledgers
+        self._checkpoints: List[StateCheckpoint] = [] # [k] restarts in front of activity #(k * interval)
+        self._cache: OrderedDict[int, StashState] = OrderedDict()
+
+    def _restore(self, checkpoint_idx: int) -> StashState:
+        return self._checkpoints[checkpoint_idx].restore(self._closed_lots, self.units, self.policy)
+
+    def generate(self, activities: List[Acquisition | Disposition], first_idx: int = 0) -> None:
+        """(Re)build for activities, which are the same as the current ones before #first_idx
+
+            Checkpoints in front of first_idx are kept. Replaying only keeps the
+            ledger it builds on for as long as it stays small - past that it
+            carries on from a freshly restored checkpoint instead.
+        """
+        self.activities = activities
+        self._closed_lots = ClosedLots([act for act in activities if isinstance(act, Acquisition)], self.units)
+        self._cache.clear()
+        if not self._checkpoints:
+            self._checkpoints.append(StateCheckpoint(StashState(LotLedger(self.units, self.policy.copy()))))
+        k = min(first_idx // self.interval, len(self._checkpoints) - 1)
+        del self._checkpoints[k + 1:]
+
+        state = self._restore(k)
+        for idx in range(k * self.interval, len(activities)):
+            if idx % self.interval == 0 and idx // self.interval == len(self._checkpoints):
+                checkpoint = StateCheckpoint(state)
+                self._checkpoints.append(checkpoint)
+                if len(state._ledger._log) > 2 * len(checkpoint.open_lots) + self.interval:
+                    state = self._restore(len(self._checkpoints) - 1)
+            state = state.apply_activity(idx, activities[idx])
+
+    def _remember(self, idx: int, state: StashState) -> None:
+        self._cache[idx] = state
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.activities)
+
+    def __getitem__(self, idx: int | slice) -> StashState | List[StashState]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("LazyStates index out of range")
+        state = self._cache.get(idx)
+        if state is not None:
+            self._cache.move_to_end(idx)
+            return state
+        start_idx = idx
+        state = self._cache.get(idx - 1)
+        if state is None or idx % self.interval == 0:
+            start_idx = idx - idx % self.interval
+            state = self._restore(idx // self.interval)
+        for i in range(start_idx, idx + 1):
+            state = state.apply_activity(i, self.activities[i])
+            self._remember(i, state)
+        return state
+
+
 class Stash:
     """The container object for an asset/commodity
 
     """
     def __init__(self, asset: str = "", title: str = "",
                  acqs: List[Acquisition] = [],
-                 disps: List[Disposition] = []) -> None:
+                 disps: List[Disposition] = [],
+                 fixed_point: bool = False,
+                 lot_policy: LotPolicy = None,
+                 adjustment_rules: List[str] = []) -> None:
         self.asset = asset
         self.title = title
         self.acquisitions: List[Acquisition] = acqs
         self.dispositions: List[Disposition] = disps
-        self.states: List[StashState] = []
+        self.fixed_point: bool = fixed_point # exact integer lot math, see AssetUnits
+        self.lot_policy: LotPolicy = lot_policy if lot_policy else FifoPolicy() # changing it needs a full update()
+        self.adjustment_rules: List[str] = list(adjustment_rules) # names of Form 8949 adjustment rules, see AdjustmentEngine
+        self.checkpoint_interval: int = 0 # if not 0, states is a LazyStates with a checkpoint every this many states
+        self.states: List[StashState] | LazyStates = []
 
-    def update(self) -> None:
+    def update(self, changed_timestamp: float = None) -> None:
         """Rebuild after load or edit of transactions
 
-            Re-sorts transaction types lists and rebuilds states
+            Re-sorts transaction types lists (if something left them out of order) and rebuilds states.
+
+            changed_timestamp is the earliest timestamp of any added, removed or
+            edited transaction (for an edit that moved a transaction, the earlier
+            of the old and new timestamps). Nothing before it is recomputed.
+            None rebuilds everything.
+        """
+        self.acquisitions = Stash.sorted_by_timestamp(self.acquisitions)
+        self.dispositions = Stash.sorted_by_timestamp(self.dispositions)
+        self.number_lots(changed_timestamp)
+        self.generate_states(changed_timestamp)
+
+    @staticmethod
+    def sorted_by_timestamp(txs: List[Acquisition] | List[Disposition] | TxStore) -> List[Acquisition] | List[Disposition] | TxStore:
+        """txs itself if it's already in order (the usual case: see insert_by_timestamp()).
+
+            Otherwise a columnar store gets sorted in place, a list gets copied.
+        """
+        if isinstance(txs, TxStore):
+            timestamps = txs.column("timestamp")
+            if len(timestamps) > 1 and (timestamps[1:] < timestamps[:-1]).any():
+                txs.sort_by_timestamp()
+            return txs
+        if all(a.timestamp <= b.timestamp for a, b in pairwise(txs)):
+            return txs
+        return sorted(txs, key=lambda t: t.timestamp)
+
+    @staticmethod
+    def merged_by_timestamp(txs: List[Acquisition] | List[Disposition] | TxStore,
+                            new_txs: List[Acquisition] | List[Disposition]) -> List[Acquisition] | List[Disposition] | TxStore:
+        """Sorted txs with new_txs added, in one linear merge (after sorting new_txs only)"""
+        new_txs = sorted(new_txs, key=lambda t: t.timestamp)
+        if isinstance(txs, TxStore):
+            txs.extend(new_txs)
+            txs.sort_by_timestamp()
+            return txs
+        return list(heapq.merge(txs, new_txs, key=lambda t: t.timestamp))
+
+    @staticmethod
+    def merged_activities(acqs: List[Acquisition] | TxStore, disps: List[Disposition] | TxStore) -> List[Any]:
+        """Enabled acquisitions and dispositions interleaved by timestamp (acquisitions first on ties).
+
+            Both must be sorted already.
         """
-        self.acquisitions = sorted( self.acquisitions,  key=lambda a: a.timestamp)
-        self.dispositions = sorted( self.dispositions,  key=lambda d: d.timestamp)
-        self.number_lots()
-        self.generate_states()
+        return list(heapq.merge((act for act in acqs if not act.disabled),
+                                (act for act in disps if not act.disabled), key=lambda a: a.timestamp))
 
-    def number_lots(self):
-        """Assign lot numbers to acquisitions"""
+    def number_lots(self, changed_timestamp: float = None):
+        """Assign lot numbers to acquisitions
+
+            Acquisitions before changed_timestamp keep the numbers they have.
+        """
         runnning_idx: int = 1
-        for acq in self.acquisitions:
+        start_idx: int = 0
+        if changed_timestamp is not None:
+            start_idx = bisect_left(self.acquisitions, changed_timestamp, key=lambda a: a.timestamp)
+            prev_numbered = next((self.acquisitions[idx] for idx in reversed(range(start_idx)) if not self.acquisitions[idx].disabled), None)
+            if prev_numbered:
+                runnning_idx = prev_numbered.lot_number + 1
+        for acq in self.acquisitions[start_idx:]:
             if not acq.disabled:
                 acq.lot_number = runnning_idx
                 runnning_idx += 1
             else:
                 acq.lot_number = 0
 
-    def generate_states(self):
-        activities: List[Any] =  [act for act in (self.acquisitions + self.dispositions) if not act.disabled]
-        sortedActivities: List[Any] =  sorted(activities,  key=lambda a: a.timestamp)
+    def generate_states(self, changed_timestamp: float = None):
+        """(Re)build the states list
 
-        state: StashState = StashState()
-        # this state, before anything at all has happened, does not go into the states list
-        self.states = []
-        for idx, act in enumerate(sortedActivities):
-            state = state.apply_activity(idx, act)
+            If changed_timestamp is given, the existing states before it are kept
+            and replay resumes from the last of them. Since states share their
+            lots through the ledger, any existing state can serve as the
+            checkpoint to resume from.
+
+            With a checkpoint_interval the states are a LazyStates instead.
+
+            The transaction lists must be sorted (see update()). Only the
+            activities from changed_timestamp on are merged together.
+        """
+        if self.checkpoint_interval:
+            self._generate_lazy_states(Stash.merged_activities(self.acquisitions, self.dispositions), changed_timestamp)
+            return
+
+        first_idx: int = 0
+        if changed_timestamp is not None and isinstance(self.states, list):
+            first_idx = bisect_left(self.states, changed_timestamp, key=lambda st: st.timestamp)
+
+        if first_idx > 0:
+            state: StashState = self.states[first_idx - 1]
+            state._ledger.truncate(state._seq) # drop lot versions from the states being replaced
+            del self.states[first_idx:]
+            # the states kept are exactly the activities before changed_timestamp
+            newActivities: List[Any] = Stash.merged_activities(
+                self.acquisitions[bisect_left(self.acquisitions, changed_timestamp, key=lambda a: a.timestamp):],
+                self.dispositions[bisect_left(self.dispositions, changed_timestamp, key=lambda d: d.timestamp):])
+        else:
+            state: StashState = StashState(LotLedger(AssetUnits(self.asset) if self.fixed_point else None, self.lot_policy.copy()))
+            # this state, before anything at all has happened, does not go into the states list
+            self.states = []
+            newActivities: List[Any] = Stash.merged_activities(self.acquisitions, self.dispositions)
+        for idx, activity in enumerate(newActivities, first_idx):
+            state = state.apply_activity(idx, activity)
             self.states.append(state)
-        pass
+
+    def _generate_lazy_states(self, sortedActivities: List[Any], changed_timestamp: float = None):
+        first_idx: int = 0
+        if (changed_timestamp is not None and isinstance(self.states, LazyStates)
+                and self.states.interval == self.checkpoint_interval):
+            first_idx = bisect_left(self.states.activities, changed_timestamp, key=lambda a: a.timestamp)
+        else:
+            self.states = LazyStates(AssetUnits(self.asset) if self.fixed_point else None,
+                                     self.lot_policy.copy(), self.checkpoint_interval)
+        self.states.generate(sortedActivities, first_idx)
+
+    # point-in-time queries. All are binary searches of the (time-sorted) states
+
+    def _states_index(self) -> List[StashState] | List[Acquisition | Disposition]:
+        """Something with one timestamped entry per state, that doesn't need to build states"""
+        return self.states.activities if isinstance(self.states, LazyStates) else self.states
+
+    def _state_idx_before(self, timestamp: float) -> int:
+        """Index of the last state strictly before timestamp, -1 if there isn't one"""
+        return bisect_left(self._states_index(), timestamp, key=lambda st: st.timestamp) - 1
+
+    def as_of(self, timestamp: float) -> StashState:
+        """The state of the stash once every activity up to and including timestamp is applied
+
+            Its balance, open_cost_basis, realized gains to date and open_lots are
+            the holdings at that moment. None if nothing had happened yet.
+        """
+        idx = bisect_right(self._states_index(), timestamp, key=lambda st: st.timestamp) - 1
+        return self.states[idx] if idx >= 0 else None
+
+    def states_between(self, start_timestamp: float, end_timestamp: float) -> List[StashState]:
+        """States for activities with start_timestamp <= timestamp < end_timestamp"""
+        return self.states[self._state_idx_before(start_timestamp) + 1:self._state_idx_before(end_timestamp) + 1]
+
+    def realized_gains_between(self, start_timestamp: float, end_timestamp: float) -> Tuple[float, float]:
+        """(short term, long term) gains realized with start_timestamp <= timestamp < end_timestamp
+
+            Differences of the running totals at both ends, so no states in between are looked at.
+        """
+        start_idx = self._state_idx_before(start_timestamp)
+        end_idx = self._state_idx_before(end_timestamp)
+        if end_idx <= start_idx:
+            return (0, 0)
+        end = self.states[end_idx]
+        start = self.states[start_idx] if start_idx >= 0 else StashState()
+        units = end._ledger.units
+        if units:
+            return (units.to_money(end._realized_short_term_cents - start._realized_short_term_cents),
+                    units.to_money(end._realized_long_term_cents - start._realized_long_term_cents))
+        return (end.realized_short_term_gains - start.realized_short_term_gains,
+                end.realized_long_term_gains - start.realized_long_term_gains)
 
     @classmethod
-    def from_json_dict(cls, jd: Dict) -> "Stash":
+    def from_json_dict(cls, jd: Dict, columnar: bool = False) -> "Stash":
         """A json-serialized Acquisition is a dict when loaded.
 
         Looks like this:
@@ -300,16 +902,32 @@ class Stash:
             {
                 "asset": "BTC",
                 "title: "My Bitcoin Stash",
+                "fixed_point": false, (optional)
+                "lot_policy": {"name": "FIFO"}, (optional. See LotPolicy.to_json_dict())
+                "adjustment_rules": ["wash_sale"], (optional. See ADJUSTMENT_RULES)
                 "acquisitions": [Acq1, Acq2...],
                 "dispositions": [Disp1, Disp2...]
             }
 
+        If columnar is True the transactions are held in TxStores rather than lists.
+
         This should be called inside a try block
         """
-        stash = Stash(jd["asset"], jd["title"])
+        stash = Stash(jd["asset"], jd["title"], fixed_point=jd.get("fixed_point", False),
+                      lot_policy=lot_policy_from_json_dict(jd["lot_policy"]) if "lot_policy" in jd else None,
+                      adjustment_rules=jd.get("adjustment_rules", []))
+        if columnar:
+            stash.acquisitions = TxStore.from_json_dicts(Acquisition, jd["asset"], jd["acquisitions"])
+            stash.dispositions = TxStore.from_json_dicts(Disposition, jd["asset"], jd["dispositions"], stash.acquisitions.strings)
+            stash.acquisitions.sort_by_timestamp()
+            stash.dispositions.sort_by_timestamp()
+            return stash
+        # validate everything up front, so each transaction can skip its own checks
+        Acquisition.validate_json_dicts(jd["acquisitions"])
+        Disposition.validate_json_dicts(jd["dispositions"])
         # Sort and filter out any wrong-commodity stuff
-        stash.acquisitions = sorted( [Acquisition.from_json_dict(acq) for acq in jd["acquisitions"] ],  key=lambda a: a.timestamp)
-        stash.dispositions = sorted( [Disposition.from_json_dict(dis) for dis in jd["dispositions"]], key=lambda d: d.timestamp)
+        stash.acquisitions = sorted( [Acquisition.from_json_dict(acq, trusted=True) for acq in jd["acquisitions"] ],  key=lambda a: a.timestamp)
+        stash.dispositions = sorted( [Disposition.from_json_dict(dis, trusted=True) for dis in jd["dispositions"]], key=lambda d: d.timestamp)
         return stash
 
     def to_json_dict(self) -> Dict:
@@ -318,6 +936,9 @@ class Stash:
         return {
             "asset": self.asset,
             "title": self.title,
+            "fixed_point": self.fixed_point,
+            "lot_policy": self.lot_policy.to_json_dict(),
+            "adjustment_rules": self.adjustment_rules,
             "acquisitions": [acq.to_json_dict() for acq in self.acquisitions],
             "dispositions": [dis.to_json_dict() for dis in self.dispositions]
         }
@@ -0,0 +1,229 @@
+import sys
+import json
+import sqlite3
+from typing import List, Dict, Any, Iterable, Tuple
+
+from models.transaction import Transaction
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.tx_store import TxStore, StringTable
+from models.lot_policy import lot_policy_from_json_dict
+
+SQLITE_MAGIC = b"SQLite format 3\x00"
+
+def is_stash_database(filename: str) -> bool:
+    with open(filename, "rb") as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+class StashDatabase:
+    """A stash kept in an SQLite database, saved a transaction at a time.
+
+       Each transaction has its own row, found by its id: load_stash() and add()
+       set a transaction's row_id, and edits and deletes go by it. Identical
+       transactions (say, imported twice) are separate rows, as they are in a
+       Stash. Timestamp, reference and disabled are indexed, for the range and
+       reference queries.
+
+       The database is in WAL mode, so any number of processes can read it
+       (open it with read_only=True) while one writes.
+    """
+
+    ACQUISITION = 0 # transactions.kind
+    DISPOSITION = 1
+
+    VERSION = 1 # PRAGMA user_version
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL -- json
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            kind INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            asset_amount REAL NOT NULL,
+            asset_price REAL NOT NULL,
+            fees REAL NOT NULL,
+            reference TEXT NOT NULL,
+            comment TEXT NOT NULL,
+            disabled INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transactions_timestamp ON transactions (kind, timestamp);
+        CREATE INDEX IF NOT EXISTS transactions_reference ON transactions (reference);
+        CREATE INDEX IF NOT EXISTS transactions_disabled ON transactions (kind, disabled, timestamp);
+    """
+
+    COLUMNS = "timestamp, asset_amount, asset_price, fees, reference, comment, disabled"
+
+    INSERT = f"INSERT INTO transactions (id, kind, {COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+    UPDATE = """
+        UPDATE transactions
+        SET timestamp = ?, asset_amount = ?, asset_price = ?, fees = ?, reference = ?, comment = ?, disabled = ?
+        WHERE id = ?
+    """
+
+    def __init__(self, filename: str, read_only: bool = False) -> None:
+        """Opens (or, unless read_only, creates) a stash database. This should be called inside a try block"""
+        self.filename: str = filename
+        self.read_only: bool = read_only
+        if read_only:
+            self.connection: sqlite3.Connection = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+        else:
+            self.connection = sqlite3.connect(filename)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self._check_version()
+            self.connection.executescript(StashDatabase.SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {StashDatabase.VERSION}")
+
+    def _check_version(self) -> None:
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > StashDatabase.VERSION:
+            raise ValueError(f"{self.filename} needs a newer version of this program (format {version})")
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "StashDatabase":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def _kind(tx: Transaction) -> int:
+        return StashDatabase.ACQUISITION if isinstance(tx, Acquisition) else StashDatabase.DISPOSITION
+
+    @staticmethod
+    def _values(tx: Transaction) -> Tuple:
+        return (tx.timestamp, tx.asset_amount, tx.asset_price, tx.fees, tx.reference, tx.comment, int(tx.disabled))
+
+    def _insert(self, txs: Iterable[Transaction]) -> None:
+        """Add a row for each of txs, and set their row_ids. Call inside a transaction"""
+        next_id = self.connection.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM transactions").fetchone()[0]
+        rows = []
+        for row_id, tx in enumerate(txs, next_id):
+            tx.row_id = row_id
+            rows.append((row_id, StashDatabase._kind(tx), *StashDatabase._values(tx)))
+        self.connection.executemany(StashDatabase.INSERT, rows)
+
+    @staticmethod
+    def _row_id(tx: Transaction) -> int:
+        if tx.row_id is None:
+            raise ValueError(f"{tx.to_json_dict()} isn't in the database")
+        return tx.row_id
+
+    # whole stash
+
+    def save_stash(self, stash: Stash) -> None:
+        """Replace everything in the database with stash. Sets the transactions' row_ids"""
+        with self.connection:
+            self.connection.execute("DELETE FROM settings")
+            self.connection.execute("DELETE FROM transactions")
+            self._save_settings(stash)
+            self._insert(stash.acquisitions)
+            self._insert(stash.dispositions)
+
+    def save_settings(self, stash: Stash) -> None:
+        """Save the stash's title and options (not its transactions)"""
+        with self.connection:
+            self._save_settings(stash)
+
+    def _save_settings(self, stash: Stash) -> None:
+        settings = {"asset": stash.asset, "title": stash.title, "fixed_point": stash.fixed_point,
+                    "lot_policy": stash.lot_policy.to_json_dict(), "adjustment_rules": stash.adjustment_rules}
+        self.connection.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                    ((key, json.dumps(value)) for key, value in settings.items()))
+
+    def load_stash(self, columnar: bool = False) -> Stash:
+        """The stash, with its transactions in timestamp order. This should be called inside a try block"""
+        settings = {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM settings")}
+        if "asset" not in settings:
+            raise ValueError(f"{self.filename} has no stash in it")
+        stash = Stash(settings["asset"], settings["title"], fixed_point=settings.get("fixed_point", False),
+                      lot_policy=lot_policy_from_json_dict(settings["lot_policy"]) if "lot_policy" in settings else None,
+                      adjustment_rules=settings.get("adjustment_rules", []))
+        query = f"SELECT id, {StashDatabase.COLUMNS} FROM transactions WHERE kind = ? ORDER BY timestamp, id"
+        acqs = self._transactions(Acquisition, stash.asset, self.connection.execute(query, (StashDatabase.ACQUISITION,)))
+        disps = self._transactions(Disposition, stash.asset, self.connection.execute(query, (StashDatabase.DISPOSITION,)))
+        if columnar:
+            strings = StringTable()
+            stash.acquisitions = TxStore(Acquisition, stash.asset, strings)
+            stash.acquisitions.extend(acqs)
+            stash.dispositions = TxStore(Disposition, stash.asset, strings)
+            stash.dispositions.extend(disps)
+        else:
+            stash.acquisitions = acqs
+            stash.dispositions = disps
+        return stash
+
+    @staticmethod
+    def _transactions(tx_type: type, asset: str, rows: Iterable[Tuple]) -> List[Transaction]:
+        txs = []
+        for row_id, timestamp, asset_amount, asset_price, fees, reference, comment, disabled in rows:
+            tx = tx_type.trusted(timestamp, asset, asset_amount, asset_price, fees, reference, comment, bool(disabled))
+            tx.row_id = row_id
+            txs.append(tx)
+        return txs
+
+    # single transactions
+
+    def add(self, tx: Transaction) -> None:
+        """Add a row for tx, and set its row_id"""
+        with self.connection:
+            self._insert([tx])
+
+    def add_many(self, txs: Iterable[Transaction]) -> None:
+        """Save added transactions (as from an import), in one database transaction"""
+        with self.connection:
+            self._insert(txs)
+
+    def delete(self, tx: Transaction) -> None:
+        """Delete tx's row. This should be called inside a try block"""
+        with self.connection:
+            self.connection.execute("DELETE FROM transactions WHERE id = ?", (StashDatabase._row_id(tx),))
+
+    def replace(self, old_tx: Transaction, new_tx: Transaction) -> None:
+        """An edit: old_tx's row becomes new_tx. This should be called inside a try block"""
+        row_id = StashDatabase._row_id(old_tx)
+        with self.connection:
+            self.connection.execute(StashDatabase.UPDATE, (*StashDatabase._values(new_tx), row_id))
+        new_tx.row_id = row_id
+
+    def on_transaction_changed(self, old_tx: Transaction, new_tx: Transaction) -> None:
+        """Save one change, as reported by TxTableModel.transaction_changed"""
+        if old_tx is None:
+            self.add(new_tx)
+        elif new_tx is None:
+            self.delete(old_tx)
+        else:
+            self.replace(old_tx, new_tx)
+
+    # queries
+
+    def between(self, tx_type: type, start_timestamp: float, end_timestamp: float,
+                include_disabled: bool = True) -> List[Transaction]:
+        """Acquisitions or Dispositions with start_timestamp <= timestamp < end_timestamp, in timestamp order"""
+        asset = self._asset()
+        kind = StashDatabase.ACQUISITION if issubclass(tx_type, Acquisition) else StashDatabase.DISPOSITION
+        query = f"SELECT id, {StashDatabase.COLUMNS} FROM transactions WHERE kind = ?"
+        if not include_disabled:
+            query += " AND disabled = 0"
+        query += " AND timestamp >= ? AND timestamp < ? ORDER BY timestamp, id"
+        return self._transactions(tx_type, asset, self.connection.execute(query, (kind, start_timestamp, end_timestamp)))
+
+    def with_reference(self, reference: str) -> List[Transaction]:
+        """All the transactions (acquisitions first) with this reference"""
+        asset = self._asset()
+        query = f"SELECT id, {StashDatabase.COLUMNS} FROM transactions WHERE reference = ? AND kind = ? ORDER BY timestamp, id"
+        return (self._transactions(Acquisition, asset, self.connection.execute(query, (reference, StashDatabase.ACQUISITION)))
+                + self._transactions(Disposition, asset, self.connection.execute(query, (reference, StashDatabase.DISPOSITION))))
+
+    def _asset(self) -> str:
+        row = self.connection.execute("SELECT value FROM settings WHERE key = 'asset'").fetchone()
+        if row is None:
+            raise ValueError(f"{self.filename} has no stash in it")
+        return json.loads(row[0])
@@ -0,0 +1,407 @@
+import sys
+import os
+import io
+import json
+import mmap
+import codecs
+import gzip
+import lzma
+import stat
+import struct
+import tempfile
+from typing import List, Dict, Any, BinaryIO, TextIO, Tuple, Callable
+
+import numpy as np
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.tx_store import TxStore, StringTable, MappedStringTable
+from models.lot_policy import lot_policy_from_json_dict
+from models.stash_db import StashDatabase, is_stash_database
+
+# progress(bytes_read, total_bytes). total_bytes is 0 if unknown
+ProgressCallback = Callable[[int, int], None]
+
+class JsonStream:
+    """Pulls json values out of a file one at a time, reading it in chunks.
+
+       Only the current chunk (plus whatever value is being decoded) is held
+       as text. Each value is decoded by the stdlib decoder (raw_decode), so
+       it's still the C parser doing the work.
+    """
+
+    WHITESPACE = " \t\n\r"
+
+    def __init__(self, f: BinaryIO, chunk_size: int = 1 << 20) -> None:
+        self._file: BinaryIO = f
+        self._chunk_size: int = chunk_size
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buf: str = ""
+        self._pos: int = 0
+        self._eof: bool = False
+        self.bytes_read: int = 0
+
+    def _fill(self) -> None:
+        chunk = self._file.read(self._chunk_size)
+        self.bytes_read += len(chunk)
+        self._eof = not chunk
+        self._buf = self._buf[self._pos:] + self._text_decoder.decode(chunk, final=self._eof)
+        self._pos = 0
+
+    def peek(self) -> str:
+        """Next non-whitespace character, without consuming it. "" at the end of the file."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in JsonStream.WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf) or self._eof:
+                return self._buf[self._pos] if self._pos < len(self._buf) else ""
+            self._fill()
+
+    def expect(self, chars: str) -> str:
+        """Consume the next character, which must be one of chars"""
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise ValueError(f"Bad json: expected one of '{chars}', found '{ch}' near byte {self.bytes_read}")
+        self._pos += 1
+        return ch
+
+    def value(self) -> Any:
+        """Decode the next complete json value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buf, self._pos)
+                if end < len(self._buf) or self._eof: # a number running to the end of the chunk may continue in the next one
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def read_stash(f: BinaryIO, columnar: bool = False, batch_size: int = 10000,
+               progress: ProgressCallback = None, total_bytes: int = 0, chunk_size: int = 1 << 20) -> Stash:
+    """Stash.from_json_dict(json.load(f)), without ever holding the whole json tree.
+
+        The acquisitions and dispositions arrays are read an element at a time
+        and turned into transactions (or TxStore rows, if columnar) in batches of
+        batch_size, so peak memory stays close to that of the finished Stash.
+        progress is called after every batch.
+
+        This should be called inside a try block
+    """
+    stream = JsonStream(f, chunk_size)
+    header: Dict[str, Any] = {}
+    txs: Dict[str, List[Any] | TxStore] = {}
+    strings = StringTable() # shared by both stores, like Stash.from_json_dict(columnar=True)
+
+    def add_batch(key: str, batch: List[Dict]) -> None:
+        tx_type = Acquisition if key == "acquisitions" else Disposition
+        if columnar:
+            if "asset" not in header:
+                raise ValueError("Columnar loading needs the asset before the transactions")
+            if key not in txs:
+                txs[key] = TxStore(tx_type, header["asset"], strings)
+            txs[key].extend_json_dicts(batch)
+        else:
+            tx_type.validate_json_dicts(batch)
+            txs.setdefault(key, []).extend(tx_type.from_json_dict(jd, trusted=True) for jd in batch)
+        if progress:
+            progress(stream.bytes_read, total_bytes)
+
+    stream.expect("{")
+    while stream.peek() != "}": # else an empty object
+        key = stream.value()
+        stream.expect(":")
+        if key in ("acquisitions", "dispositions"):
+            stream.expect("[")
+            batch: List[Dict] = []
+            while stream.peek() != "]": # else an empty array
+                batch.append(stream.value())
+                if len(batch) >= batch_size:
+                    add_batch(key, batch)
+                    batch = []
+                if stream.expect(",]") == "]":
+                    break
+            else:
+                stream.expect("]")
+            add_batch(key, batch)
+        else:
+            header[key] = stream.value()
+        if stream.expect(",}") == "}":
+            break
+    else:
+        stream.expect("}")
+
+    stash = Stash(header["asset"], header["title"], fixed_point=header.get("fixed_point", False),
+                  lot_policy=lot_policy_from_json_dict(header["lot_policy"]) if "lot_policy" in header else None,
+                  adjustment_rules=header.get("adjustment_rules", []))
+    if columnar:
+        stash.acquisitions = txs.get("acquisitions", TxStore(Acquisition, stash.asset, strings))
+        stash.dispositions = txs.get("dispositions", TxStore(Disposition, stash.asset, strings))
+    else:
+        stash.acquisitions = txs.get("acquisitions", [])
+        stash.dispositions = txs.get("dispositions", [])
+    stash.acquisitions = Stash.sorted_by_timestamp(stash.acquisitions)
+    stash.dispositions = Stash.sorted_by_timestamp(stash.dispositions)
+    return stash
+
+
+def read_stash_file(filename: str, columnar: bool = False, progress: ProgressCallback = None) -> Stash:
+    """A json (see read_stash()), compressed json (see COMPRESSIONS), binary
+        (see read_stash_binary()) or SQLite (see StashDatabase) stash file.
+
+        This should be called inside a try block
+    """
+    if is_binary_stash(filename):
+        return read_stash_binary(filename, columnar)
+    if is_stash_database(filename):
+        with StashDatabase(filename, read_only=True) as db:
+            return db.load_stash(columnar)
+    with open(filename, "rb") as raw:
+        total_bytes = os.fstat(raw.fileno()).st_size
+        compression = _compression_of(raw.read(_MAGIC_LENGTH))
+        raw.seek(0)
+        if not compression:
+            return read_stash(raw, columnar, progress=progress, total_bytes=total_bytes)
+        # progress goes by the compressed bytes read, as the uncompressed size isn't known
+        with COMPRESSIONS[compression][1](raw, "rb") as f:
+            return read_stash(f, columnar, total_bytes=total_bytes,
+                              progress=(lambda done, total: progress(raw.tell(), total)) if progress else None)
+
+
+# Compressed json stash files: the stdlib compressors, by name, with the magic bytes their files start with
+COMPRESSIONS: Dict[str, Tuple[bytes, Callable[[BinaryIO, str], BinaryIO]]] = {
+    "gzip": (b"\x1f\x8b", lambda f, mode: gzip.GzipFile(fileobj=f, mode=mode, compresslevel=6)),
+    "lzma": (b"\xfd7zXZ\x00", lambda f, mode: lzma.LZMAFile(f, mode))
+}
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".xz": "lzma"}
+_MAGIC_LENGTH = max(len(magic) for magic, _ in COMPRESSIONS.values())
+
+def _compression_of(head: bytes) -> str:
+    for name, (magic, _) in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+def stash_compression(filename: str) -> str:
+    """The name of the compression (see COMPRESSIONS) of a stash file, or None"""
+    with open(filename, "rb") as f:
+        return _compression_of(f.read(_MAGIC_LENGTH))
+
+def compression_for_filename(filename: str) -> str:
+    """The compression a stash file should be saved with, going by its suffix (None for none)"""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1].lower())
+
+def write_stash_json(stash: Stash, f: TextIO) -> None:
+    """Stash.to_json_dict(), compact, a transaction at a time rather than as one tree"""
+    jd = {"asset": stash.asset, "title": stash.title, "fixed_point": stash.fixed_point,
+          "lot_policy": stash.lot_policy.to_json_dict(), "adjustment_rules": stash.adjustment_rules}
+    f.write(json.dumps(jd, separators=(",", ":"))[:-1])
+    for key in ("acquisitions", "dispositions"):
+        f.write(f',"{key}":[')
+        for idx, tx in enumerate(getattr(stash, key)):
+            if idx:
+                f.write(",")
+            f.write(json.dumps(tx.to_json_dict(), separators=(",", ":")))
+        f.write("]")
+    f.write("}")
+
+def _read_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# read once: os.umask() can only be read by setting it, which isn't safe while another thread saves
+UMASK = _read_umask()
+
+def temp_file_beside(filename: str) -> Tuple[int, str]:
+    """A temporary file (fd, name) in filename's folder, for os.replace() to put in place of filename.
+
+        mkstemp() makes it readable by its owner only, so it gets filename's
+        mode, or for a new file the mode the umask gives new files.
+    """
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix=".tmp")
+    try:
+        try:
+            mode = stat.S_IMODE(os.stat(filename).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+        os.chmod(tmp_filename, mode)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_filename)
+        raise
+    return fd, tmp_filename
+
+def write_stash_json_file(stash: Stash, filename: str, compression: str = None) -> None:
+    """Stash.to_json_dict() to a temporary file that then replaces filename,
+        so a failed save leaves the old file as it was.
+
+        Uncompressed files are indented, to be read by people. Compressed ones
+        (compression is a name in COMPRESSIONS) are written compact, with
+        write_stash_json().
+        This should be called inside a try block
+    """
+    fd, tmp_filename = temp_file_beside(filename)
+    try:
+        if not compression:
+            with os.fdopen(fd, "w") as f:
+                json.dump(stash.to_json_dict(), f, indent=2)
+        else:
+            with os.fdopen(fd, "wb") as raw, COMPRESSIONS[compression][1](raw, "wb") as compressed, \
+                    io.TextIOWrapper(compressed, encoding="utf-8") as f:
+                write_stash_json(stash, f)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
+
+def snapshot_stash(stash: Stash) -> Stash:
+    """A copy of stash's settings and transactions (not its states), that can be saved
+        on another thread while the stash goes on being edited.
+
+        TxStore copies share the original's string table, which is only ever appended to.
+    """
+    def copy_txs(txs: List[Any] | TxStore) -> List[Any] | TxStore:
+        if isinstance(txs, TxStore):
+            return txs.select(np.arange(len(txs)))
+        return [tx.duplicate() for tx in txs]
+
+    return Stash(stash.asset, stash.title, copy_txs(stash.acquisitions), copy_txs(stash.dispositions),
+                 stash.fixed_point, lot_policy_from_json_dict(stash.lot_policy.to_json_dict()), stash.adjustment_rules)
+
+
+# Binary stash files
+#
+# The columns of a TxStore, as they are in memory, so a file can be memory mapped
+# and used without any parsing:
+#
+#   prefix:  magic, format version, header offset, header length (see _PREFIX)
+#   columns: the COLUMN_TYPES arrays of the acquisitions, then of the dispositions,
+#            little-endian, each starting on an 8 byte boundary
+#   strings: the utf-8 bytes of the string table back to back, and an int64 array
+#            of count + 1 offsets into them
+#   header:  json: the stash's settings (as in Stash.to_json_dict()) plus where
+#            each array is and how many rows/strings there are
+
+BINARY_MAGIC = b"STASHBIN"
+BINARY_VERSION = 1
+_PREFIX = struct.Struct("<8sIQQ")
+
+def is_binary_stash(filename: str) -> bool:
+    with open(filename, "rb") as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+def _write_array(f: BinaryIO, arr: np.ndarray) -> int:
+    """Writes arr at the next 8 byte boundary and returns its offset"""
+    f.write(bytes(-f.tell() % 8))
+    offset = f.tell()
+    f.write(memoryview(np.ascontiguousarray(arr)).cast("B"))
+    return offset
+
+def _file_dtype(dtype: type) -> np.dtype:
+    return np.dtype(dtype).newbyteorder("<")
+
+def write_stash_binary(stash: Stash, f: BinaryIO) -> None:
+    """Writes a stash (list or columnar) in the binary format. f must be seekable."""
+    if isinstance(stash.acquisitions, TxStore) and isinstance(stash.dispositions, TxStore) \
+            and stash.acquisitions.strings is stash.dispositions.strings:
+        stores = {"acquisitions": stash.acquisitions, "dispositions": stash.dispositions}
+    else:
+        strings = StringTable()
+        stores = {"acquisitions": TxStore(Acquisition, stash.asset, strings),
+                  "dispositions": TxStore(Disposition, stash.asset, strings)}
+        stores["acquisitions"].extend(stash.acquisitions)
+        stores["dispositions"].extend(stash.dispositions)
+    strings = stores["acquisitions"].strings
+
+    header: Dict[str, Any] = {"asset": stash.asset, "title": stash.title, "fixed_point": stash.fixed_point,
+                              "lot_policy": stash.lot_policy.to_json_dict(), "adjustment_rules": stash.adjustment_rules}
+    f.write(_PREFIX.pack(BINARY_MAGIC, BINARY_VERSION, 0, 0))
+    for key, store in stores.items():
+        header[key] = {"count": len(store),
+                       "columns": {name: _write_array(f, store.column(name).astype(_file_dtype(dtype), copy=False))
+                                   for name, dtype in TxStore.COLUMN_TYPES.items()}}
+    encoded = [strings[str_id].encode("utf-8") for str_id in range(len(strings))]
+    offsets = np.zeros(len(encoded) + 1, "<i8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    header["strings"] = {"count": len(encoded),
+                         "data": _write_array(f, np.frombuffer(b"".join(encoded), np.uint8)),
+                         "offsets": _write_array(f, offsets)}
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    header_offset = f.tell()
+    f.write(header_bytes)
+    f.seek(0)
+    f.write(_PREFIX.pack(BINARY_MAGIC, BINARY_VERSION, header_offset, len(header_bytes)))
+    f.seek(0, os.SEEK_END)
+
+def write_stash_binary_file(stash: Stash, filename: str) -> None:
+    """write_stash_binary() to a temporary file that then replaces filename.
+
+        Replacing rather than overwriting means a stash still mapped from
+        filename (see read_stash_binary()) keeps its data.
+        This should be called inside a try block
+    """
+    fd, tmp_filename = temp_file_beside(filename)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_stash_binary(stash, f)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
+
+def read_stash_binary(filename: str, columnar: bool = True) -> Stash:
+    """A stash written by write_stash_binary(), without parsing it.
+
+        The file is memory mapped copy-on-write, and the TxStore columns are
+        views of the mapping: pages are read as they are touched, and edits
+        stay in memory. Strings are decoded when first used.
+
+        If columnar is False the rows are copied out into lists of transactions.
+        This should be called inside a try block
+    """
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, header_offset, header_length = _PREFIX.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"{filename} is not a binary stash file")
+    if version > BINARY_VERSION:
+        raise ValueError(f"{filename} needs a newer version of this program (format {version})")
+    header = json.loads(data[header_offset:header_offset + header_length])
+
+    string_info = header["strings"]
+    offsets = np.frombuffer(data, "<i8", string_info["count"] + 1, string_info["offsets"]) + string_info["data"]
+    strings = MappedStringTable(data, offsets)
+
+    stash = Stash(header["asset"], header["title"], fixed_point=header.get("fixed_point", False),
+                  lot_policy=lot_policy_from_json_dict(header["lot_policy"]) if "lot_policy" in header else None,
+                  adjustment_rules=header.get("adjustment_rules", []))
+    for key, tx_type in (("acquisitions", Acquisition), ("dispositions", Disposition)):
+        store = TxStore(tx_type, stash.asset, strings)
+        count = header[key]["count"]
+        for name, dtype in TxStore.COLUMN_TYPES.items():
+            offset = header[key]["columns"].get(name)
+            # files from before a column was added don't have it
+            store._data[name] = np.frombuffer(data, _file_dtype(dtype), count, offset) if offset is not None \
+                                else np.zeros(count, dtype)
+        store._size = count
+        txs = Stash.sorted_by_timestamp(store)
+        setattr(stash, key, txs if columnar else _store_transactions(txs))
+    return stash
+
+def _store_transactions(store: TxStore) -> List[Any]:
+    """Plain Acquisitions or Dispositions with the rows of a store"""
+    strings = store.strings
+    return [store.tx_type.trusted(timestamp, store.asset, asset_amount, asset_price, fees,
+                                  strings[reference_id], strings[comment_id], disabled)
+            for timestamp, asset_amount, asset_price, fees, reference_id, comment_id, disabled in zip(
+                store.column("timestamp").tolist(), store.column("asset_amount").tolist(),
+                store.column("asset_price").tolist(), store.column("fees").tolist(),
+                store.column("reference_id").tolist(), store.column("comment_id").tolist(),
+                store.column("disabled").tolist())]
@@ -0,0 +1,293 @@
+import sys
+import os
+import json
+from typing import List, Dict, Any, Iterable, Tuple
+
+from models.transaction import Transaction
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.lot_policy import lot_policy_from_json_dict
+from models.stash_io import read_stash_file, write_stash_binary_file, write_stash_json_file, is_binary_stash, \
+    stash_compression, snapshot_stash, temp_file_beside
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_VERSION = 1
+
+class StashJournal:
+    """A stash file plus an append-only journal of the changes made to it since.
+
+       The journal (filename + JOURNAL_SUFFIX) is json lines: a header, then one
+       operation per line, each written and flushed as it is made:
+
+           {"op": "add", "kind": "acquisitions", "tx": {...}}
+           {"op": "edit", "kind": "acquisitions", "old": {...}, "tx": {...}}
+           {"op": "delete", "kind": "dispositions", "tx": {...}}
+           {"op": "toggle", "kind": "dispositions", "tx": {...}}
+           {"op": "settings", "settings": {...}}
+
+       so saving a change costs the size of the change. Transactions are
+       found by their identity (see Transaction.identity) on replay.
+       compact() writes the whole stash to the base file and starts an empty
+       journal. A compaction can also be done in three steps, so the base file
+       can be written on another thread while changes go on being saved:
+       begin_compaction() (takes a snapshot), write_base() (of the snapshot)
+       and end_compaction() (starts a journal of the changes made since the
+       snapshot).
+
+       The header holds the size and modification time of the base file the
+       journal goes with. A journal that doesn't match its base (compaction got
+       as far as writing the base) is stale and is ignored. A last line that
+       was cut short by a crash is dropped.
+
+       Just loading a stash doesn't write anything: the journal is only opened
+       (or started) by the first change saved. If it can't be written (say the
+       stash is in a read-only folder) changes are only kept until the stash
+       is compacted somewhere else, like any unsaved change.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename: str = filename
+        self.journal_filename: str = filename + JOURNAL_SUFFIX
+        self._file = None # the journal, open for appending from the first change after load_stash() or compact()
+        self._loaded: bool = False # load_stash() or compact() is done, so changes can be journaled
+        self._journal_current: bool = False # the journal on disk goes with the base file as it is now
+        self.journaling: bool = True # False once the journal turned out not to be writable
+        self.entry_count: int = 0 # operations in the journal
+        self._pending: List[Dict] = None # operations since begin_compaction()'s snapshot, while there is one
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "StashJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def _kind(tx: Transaction) -> str:
+        return "acquisitions" if isinstance(tx, Acquisition) else "dispositions"
+
+    def _base_header(self) -> Dict[str, Any]:
+        st = os.stat(self.filename)
+        return {"version": JOURNAL_VERSION, "base_size": st.st_size, "base_mtime_ns": st.st_mtime_ns}
+
+    # whole stash
+
+    def load_stash(self, progress=None) -> Stash:
+        """The base stash with the journal replayed onto it. Changes can be saved afterwards.
+
+           progress is as for stash_io.read_stash_file().
+           This should be called inside a try block
+        """
+        stash = read_stash_file(self.filename, progress=progress)
+        entries = self._read_entries()
+        self.close()
+        if entries is not None:
+            StashJournal.replay(stash, entries)
+        self.entry_count = len(entries) if entries is not None else 0
+        self._journal_current = entries is not None
+        self._loaded = True
+        return stash
+
+    def _read_entries(self) -> List[Dict]:
+        """The journal's operations, or None if there is no journal for the base file as it is now"""
+        if not os.path.exists(self.journal_filename):
+            return None
+        with open(self.journal_filename, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        try:
+            header = json.loads(lines[0])
+        except json.JSONDecodeError:
+            raise ValueError(f"{self.journal_filename} is damaged at line 1")
+        if header.get("version", 0) > JOURNAL_VERSION:
+            raise ValueError(f"{self.journal_filename} needs a newer version of this program (format {header['version']})")
+        if header != self._base_header():
+            return None
+        entries: List[Dict] = []
+        for line_idx, line in enumerate(lines[1:], 1):
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                if any(lines[line_idx + 1:]):
+                    raise ValueError(f"{self.journal_filename} is damaged at line {line_idx + 1}")
+                # else the write of the last operation was cut short, so it never happened
+        return entries
+
+    def _start_journal(self, entries: List[Dict] = []) -> None:
+        """Replace any journal with one for the base file as it is now, holding entries"""
+        self.close()
+        fd, tmp_filename = temp_file_beside(self.journal_filename)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps(self._base_header()) + "\n")
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_filename, self.journal_filename)
+        except BaseException:
+            os.unlink(tmp_filename)
+            raise
+        self.entry_count = len(entries)
+        self._file = open(self.journal_filename, "a", encoding="utf-8")
+        self._journal_current = True
+        self._loaded = True
+
+    def _open_journal(self) -> bool:
+        """Open the journal for appending, starting it if there is none for the base file yet. False if it can't be written"""
+        if not self._file and self.journaling:
+            try:
+                if self._journal_current:
+                    self._file = open(self.journal_filename, "a", encoding="utf-8")
+                else:
+                    self._start_journal()
+            except OSError as e:
+                print(f"Changes to {self.filename} won't be journaled: {e}")
+                self.journaling = False
+        return self._file is not None
+
+    def compact(self, stash: Stash, binary: bool = None, compression: str = None) -> None:
+        """Write all of stash to the base file and empty the journal.
+
+           See write_base() for binary and compression.
+           This should be called inside a try block
+        """
+        self.write_base(stash, binary, compression)
+        self._start_journal()
+
+    def begin_compaction(self, stash: Stash) -> Stash:
+        """A snapshot of stash (see stash_io.snapshot_stash()) for write_base(). Changes
+           saved from now on are also kept, for end_compaction().
+        """
+        if self._pending is not None:
+            raise ValueError(f"{self.filename} is already being saved")
+        snapshot = snapshot_stash(stash)
+        self._pending = []
+        return snapshot
+
+    def write_base(self, stash: Stash, binary: bool = None, compression: str = None) -> None:
+        """Write all of stash to the base file, leaving the journal alone. Safe to call from another thread.
+
+           The base is written binary, or json (compressed, if compression is
+           a name in stash_io.COMPRESSIONS), as asked. If binary is None it's
+           written in the format it's in now (binary if it's new).
+           This should be called inside a try block
+        """
+        if binary is None:
+            binary = not os.path.exists(self.filename) or is_binary_stash(self.filename)
+            if not binary:
+                compression = stash_compression(self.filename)
+        if not binary:
+            write_stash_json_file(stash, self.filename, compression)
+        else:
+            write_stash_binary_file(stash, self.filename)
+
+    def end_compaction(self) -> None:
+        """Start a journal, for the base file that write_base() wrote, of the changes saved since begin_compaction().
+
+           Until this is done, those changes are only in the old journal, which
+           no longer goes with the base file: a crash in between loses them.
+           This should be called inside a try block
+        """
+        entries, self._pending = self._pending, None
+        self._start_journal(entries)
+
+    def abort_compaction(self) -> None:
+        """After a failed write_base(): the base and journal are as they were"""
+        self._pending = None
+
+    @staticmethod
+    def replay(stash: Stash, entries: Iterable[Dict]) -> None:
+        """Apply journal operations to stash's transaction lists. Leaves them sorted, but doesn't update() the stash.
+
+           This should be called inside a try block
+        """
+        txs: Dict[str, List[Transaction]] = {"acquisitions": list(stash.acquisitions),
+                                              "dispositions": list(stash.dispositions)}
+        # identical transactions (say, imported twice) are separate rows, so an identity can have several
+        index: Dict[str, Dict[Tuple, List[int]]] = {"acquisitions": {}, "dispositions": {}}
+        for kind, kind_txs in txs.items():
+            for idx, tx in enumerate(kind_txs):
+                index[kind].setdefault(tx.identity, []).append(idx)
+        tx_types = {"acquisitions": Acquisition, "dispositions": Disposition}
+
+        def find(kind: str, jd: Dict) -> int:
+            """Take the row jd was. Of identical ones, one that also has its comment and disabled flag, if any does"""
+            idxs = index[kind].get(tx_types[kind].from_json_dict(jd, trusted=True).identity)
+            if not idxs:
+                raise ValueError(f"Journal {jd} not found in {kind}")
+            pos = next((pos for pos, idx in enumerate(idxs) if txs[kind][idx].to_json_dict() == jd), len(idxs) - 1)
+            return idxs.pop(pos)
+
+        for entry in entries:
+            op = entry["op"]
+            if op == "settings":
+                settings = entry["settings"]
+                stash.title = settings["title"]
+                stash.fixed_point = settings.get("fixed_point", False)
+                if "lot_policy" in settings:
+                    stash.lot_policy = lot_policy_from_json_dict(settings["lot_policy"])
+                stash.adjustment_rules = list(settings.get("adjustment_rules", []))
+                continue
+            kind = entry["kind"]
+            tx = tx_types[kind].from_json_dict(entry["tx"])
+            if op == "add":
+                index[kind].setdefault(tx.identity, []).append(len(txs[kind]))
+                txs[kind].append(tx)
+            elif op == "delete":
+                txs[kind][find(kind, entry["tx"])] = None
+            elif op in ("edit", "toggle"):
+                # a toggle's entry is the transaction after it, so before it, it had the other disabled flag
+                old_jd = entry["old"] if op == "edit" else {**entry["tx"], "disabled": not entry["tx"].get("disabled", False)}
+                idx = find(kind, old_jd)
+                txs[kind][idx] = tx
+                index[kind].setdefault(tx.identity, []).append(idx)
+            else:
+                raise ValueError(f"Unknown journal operation '{op}'")
+
+        stash.acquisitions = Stash.sorted_by_timestamp([tx for tx in txs["acquisitions"] if tx is not None])
+        stash.dispositions = Stash.sorted_by_timestamp([tx for tx in txs["dispositions"] if tx is not None])
+
+    # changes
+
+    def _append(self, entries: Iterable[Dict]) -> None:
+        if not self._loaded and self._pending is None:
+            raise ValueError(f"{self.journal_filename} isn't open: load or compact the stash first")
+        entries = list(entries)
+        if self._pending is not None:
+            self._pending.extend(entries)
+        if not self._loaded: # a new file's first compaction: the changes go in the journal end_compaction() starts
+            return
+        if not self._open_journal():
+            return
+        for entry in entries:
+            self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.entry_count += len(entries)
+
+    def on_transaction_changed(self, old_tx: Transaction, new_tx: Transaction) -> None:
+        """Save one change, as reported by TxTableModel.transaction_changed"""
+        if old_tx is None:
+            entry = {"op": "add", "kind": StashJournal._kind(new_tx), "tx": new_tx.to_json_dict()}
+        elif new_tx is None:
+            entry = {"op": "delete", "kind": StashJournal._kind(old_tx), "tx": old_tx.to_json_dict()}
+        elif old_tx is new_tx:
+            entry = {"op": "toggle", "kind": StashJournal._kind(new_tx), "tx": new_tx.to_json_dict()}
+        else:
+            entry = {"op": "edit", "kind": StashJournal._kind(new_tx), "old": old_tx.to_json_dict(), "tx": new_tx.to_json_dict()}
+        self._append([entry])
+
+    def add_many(self, txs: Iterable[Transaction]) -> None:
+        """Save added transactions (as from an import), with one flush"""
+        self._append({"op": "add", "kind": StashJournal._kind(tx), "tx": tx.to_json_dict()} for tx in txs)
+
+    def save_settings(self, stash: Stash) -> None:
+        """Save the stash's title and options (not its transactions)"""
+        self._append([{"op": "settings", "settings": {"title": stash.title, "fixed_point": stash.fixed_point,
+                                                      "lot_policy": stash.lot_policy.to_json_dict(),
+                                                      "adjustment_rules": stash.adjustment_rules}}])
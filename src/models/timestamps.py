@@ -0,0 +1,213 @@
+import sys
+import re
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from typing import List, Dict, Any, Sequence, Tuple
+
+import numpy as np
+import dateparser
+
+# Date/time strings, parsed to posix timestamps (float seconds).
+#
+# A TimestampParser works out a column's format from its first value, then parses
+# every value in that format with one compiled regex (or, for a batch, with numpy
+# arithmetic on the characters themselves). Only strings that don't match any
+# known format go to dateparser, which is slow (milliseconds a call) but takes anything.
+# Strings of a plain number (an exported posix timestamp, "1451316900.5") never get that far.
+#
+# Times without a timezone are UTC, which is how the tables display them.
+
+DATEPARSER_SETTINGS = {'RETURN_AS_TIMEZONE_AWARE': True, 'TIMEZONE': 'UTC'}
+
+_TIME = r"(?P<H>\d{1,2}):(?P<M>\d{2})(?::(?P<S>\d{2})(?:\.(?P<f>\d{1,9}))?)?"
+_TZ = r"(?:\s*(?P<tz>Z|UTC|GMT|[+-]\d{2}:?\d{2}))?"
+
+# tried in this order, so month-first wins for an ambiguous date like 03/12/2022
+FORMATS: Dict[str, re.Pattern] = {
+    "iso": re.compile(r"(?P<Y>\d{4})-(?P<m>\d{1,2})-(?P<d>\d{1,2})(?:[T ]" + _TIME + ")?" + _TZ),
+    "us": re.compile(r"(?P<m>\d{1,2})/(?P<d>\d{1,2})/(?P<Y>\d{4})(?:[T ,]\s*" + _TIME + ")?" + _TZ),
+    "day_first": re.compile(r"(?P<d>\d{1,2})[/.](?P<m>\d{1,2})[/.](?P<Y>\d{4})(?:[T ,]\s*" + _TIME + ")?" + _TZ),
+}
+
+_NUMBER_FIELDS = ("Y", "m", "d", "H", "M", "S", "f")
+
+# a timestamp already, in seconds
+EPOCH = re.compile(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)")
+
+def _tz_offset(tz: str) -> int:
+    """Seconds east of UTC for a matched tz group"""
+    if not tz or tz in ("Z", "UTC", "GMT"):
+        return 0
+    sign = -1 if tz[0] == "-" else 1
+    digits = tz[1:].replace(":", "")
+    return sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+
+def _days_from_civil(y, m, d):
+    """Days since 1970-01-01 of (proleptic Gregorian) dates, element-wise on numpy int arrays"""
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + np.where(m > 2, -3, 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+def _from_match(match: re.Match) -> float:
+    """The timestamp of a FORMATS match. datetime does the range checks."""
+    groups = match.groupdict()
+    fraction = groups["f"] or ""
+    dt = datetime(int(groups["Y"]), int(groups["m"]), int(groups["d"]), int(groups["H"] or 0),
+                  int(groups["M"] or 0), int(groups["S"] or 0), int(fraction.ljust(6, "0")[:6]),
+                  tzinfo=timezone(timedelta(seconds=_tz_offset(groups["tz"]))))
+    return dt.timestamp()
+
+def _match_date(pattern: re.Pattern, text: str) -> float:
+    """The timestamp of text if it is a valid date matching pattern, else None"""
+    match = pattern.fullmatch(text)
+    if match:
+        try:
+            return _from_match(match)
+        except ValueError: # laid out like a date, but isn't one (month 13, say)
+            pass
+    return None
+
+def detect_format(samples: Sequence[str]) -> str:
+    """The name of the first of FORMATS that all of samples are valid dates in, or None"""
+    for name, pattern in FORMATS.items():
+        if all(_match_date(pattern, s.strip()) is not None for s in samples):
+            return name
+    return None
+
+
+class TimestampParser:
+    """Parses the date strings of one column (or one edit field, value after value)
+
+       The format is detected from the first values parsed and then tried first.
+       A string in another known format is still parsed, and anything else goes
+       to dateparser. Numbers, and strings of a number, are taken to be
+       timestamps already.
+    """
+
+    DETECT_SAMPLES = 20 # how many values of a batch to detect the format from
+
+    def __init__(self, format_name: str = None) -> None:
+        self.format_name: str = format_name
+        self.fallback_count: int = 0 # strings that needed dateparser
+
+    def parse(self, value: str | float) -> float:
+        """One timestamp. Raises ValueError if value isn't a date"""
+        if not isinstance(value, str):
+            return float(value)
+        text = value.strip()
+        if self.format_name:
+            timestamp = _match_date(FORMATS[self.format_name], text)
+            if timestamp is not None:
+                return timestamp
+        if EPOCH.fullmatch(text):
+            return float(text)
+        format_name = detect_format([text])
+        if format_name:
+            if self.format_name is None:
+                self.format_name = format_name
+            return _from_match(FORMATS[format_name].fullmatch(text))
+        self.fallback_count += 1
+        dt = dateparser.parse(text, settings=DATEPARSER_SETTINGS)
+        if dt is None:
+            raise ValueError(f"Unrecognized date: '{value}'")
+        return dt.timestamp()
+
+    def parse_many(self, values: Sequence[str | float]) -> np.ndarray:
+        """Timestamps for a whole column, as float64
+
+           Strings laid out exactly like the first one (same length, same
+           separators, digits where it has digits) are parsed together, with
+           array arithmetic on their characters, and strings of a number are
+           converted together. The rest go through parse().
+        """
+        result = np.empty(len(values), np.float64)
+        str_rows = [row for row, value in enumerate(values) if isinstance(value, str)]
+        str_row_set = set(str_rows)
+        for row, value in enumerate(values):
+            if row not in str_row_set:
+                result[row] = value
+        if not str_rows:
+            return result
+        texts = [values[row].strip() for row in str_rows]
+        if self.format_name is None:
+            self.format_name = detect_format(texts[:TimestampParser.DETECT_SAMPLES])
+        done = np.zeros(len(texts), bool)
+        if self.format_name:
+            match = FORMATS[self.format_name].fullmatch(texts[0])
+            if match:
+                done = self._parse_like(match, texts, result, np.array(str_rows))
+        str_rows = np.array(str_rows)
+        rest = np.flatnonzero(~done)
+        numeric = np.array([EPOCH.fullmatch(texts[idx]) is not None for idx in rest], bool)
+        if numeric.any():
+            result[str_rows[rest[numeric]]] = np.array([texts[idx] for idx in rest[numeric]]).astype(np.float64)
+        for idx in rest[~numeric]:
+            result[str_rows[idx]] = self.parse(texts[idx])
+        return result
+
+    def _parse_like(self, sample: re.Match, texts: List[str], result: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Vectorized parse of the texts laid out like sample. Fills in result[rows] for those and returns which they were"""
+        width = len(sample.string)
+        lengths = np.fromiter(map(len, texts), np.int64, len(texts))
+        chars = np.array(texts, dtype=f"<U{width}").view(np.uint32).reshape(len(texts), width)
+
+        digit_positions: List[int] = []
+        spans: Dict[str, Tuple[int, int]] = {}
+        for name in _NUMBER_FIELDS:
+            if sample.group(name) is not None:
+                spans[name] = sample.span(name)
+                digit_positions.extend(range(*spans[name]))
+        digit_position_set = set(digit_positions)
+        literal_positions = [pos for pos in range(width) if pos not in digit_position_set]
+        sample_chars = np.array([ord(ch) for ch in sample.string], np.uint32)
+
+        digits = chars[:, digit_positions].astype(np.int64) - ord("0")
+        ok = ((lengths == width) & ((digits >= 0) & (digits <= 9)).all(axis=1)
+              & (chars[:, literal_positions] == sample_chars[literal_positions]).all(axis=1))
+
+        def field(name: str) -> np.ndarray:
+            if name not in spans:
+                return np.zeros(len(texts), np.int64)
+            value = np.zeros(len(texts), np.int64)
+            for pos in range(*spans[name]):
+                value = value * 10 + (chars[:, pos].astype(np.int64) - ord("0"))
+            return value
+
+        year, month, day = field("Y"), field("m"), field("d")
+        hour, minute, second = field("H"), field("M"), field("S")
+        leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+        month_days = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(month, 0, 12)] + (leap & (month == 2))
+        ok &= ((month >= 1) & (month <= 12) & (day >= 1) & (day <= month_days)
+               & (hour < 24) & (minute < 60) & (second < 60))
+
+        seconds = (_days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+                   - _tz_offset(sample.group("tz"))).astype(np.float64)
+        if "f" in spans:
+            seconds += field("f") / 10.0 ** (spans["f"][1] - spans["f"][0])
+        result[rows[ok]] = seconds[ok]
+        return ok
+
+
+@lru_cache(maxsize=4096)
+def _parse_edit(text: str) -> float:
+    return TimestampParser().parse(text)
+
+def parse_timestamp(text: str) -> float:
+    """A date string typed into a table, say. Remembers the last few thousand strings.
+
+       Each string is parsed on its own, so an ambiguous date is month-first
+       like dateparser has it, whatever was typed before. (Only a column being
+       imported has a format of its own.) Raises ValueError if text isn't a date
+    """
+    return _parse_edit(text)
+
+def parse_json_timestamps(jds: List[Dict]) -> None:
+    """Replace any string timestamps in a batch of json-serialized transactions with numbers, in place"""
+    rows = [row for row, jd in enumerate(jds) if isinstance(jd.get("timestamp"), str)]
+    if rows:
+        timestamps = TimestampParser().parse_many([jds[row]["timestamp"] for row in rows])
+        for row, timestamp in zip(rows, timestamps.tolist()):
+            jds[row]["timestamp"] = timestamp
@@ -1,9 +1,12 @@
 import sys
 import json
+from bisect import bisect_right
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
-from PySide6.QtCore import Qt, QAbstractTableModel
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, Signal
+
+from models.timestamps import parse_json_timestamps
 
 class Transaction():
     """Acquiring or disposing of some of a commodity
@@ -23,6 +26,9 @@ class Transaction():
 
     # DATETIME_FORMAT = "%m/%d/%Y %H:%M:%S %z" # "12/27/2016 14:14:00 +0000"
 
+    __slots__ = ("_timestamp", "_asset", "_asset_price", "_asset_amount", "_fees",
+                 "_reference", "_comment", "disabled", "_hash", "row_id")
+
     def __init__(self, timestamp: float, asset: str, asset_amount: float, asset_price: float,
                 fees: float, reference: str, comment: str, disabled: bool = False) -> None:
         self.timestamp = timestamp  # floating-point posix epoch
@@ -33,7 +39,54 @@ class Transaction():
         self.reference = reference
         self.comment = comment
         self.disabled = disabled # public attribute
-        self.update_hash()  # hash
+        self._hash = None  # computed on demand, see tx_hash
+        self.row_id: int = None # id of its row in a StashDatabase, if it's been saved in one
+
+    @classmethod
+    def trusted(cls, timestamp: float, asset: str, asset_amount: float, asset_price: float,
+                fees: float, reference: str, comment: str, disabled: bool = False) -> "Transaction":
+        """Construct WITHOUT validating anything.
+
+            Only for values that have already been checked (see validate_json_dicts())
+            or that are copied from an existing transaction.
+        """
+        tx = cls.__new__(cls)
+        tx._timestamp = timestamp
+        tx._asset = asset
+        tx._asset_price = asset_price
+        tx._asset_amount = asset_amount
+        tx._fees = fees
+        tx._reference = reference
+        tx._comment = comment
+        tx.disabled = disabled
+        tx._hash = None
+        tx.row_id = None
+        return tx
+
+    @staticmethod
+    def validate_json_dicts(jds: List[Dict]) -> None:
+        """Check a whole batch of json-serialized transactions in one pass.
+
+            Raises the same ValueErrors the property setters would. Afterwards
+            the dicts can be turned into transactions with from_json_dict(jd, trusted=True).
+            Date string timestamps (like "12/01/2015 14:19:00") are parsed to numbers, in place.
+        """
+        parse_json_timestamps(jds)
+        for jd in jds:
+            if jd["timestamp"] < 0:
+                raise ValueError("Invalid timestamp")
+            if not isinstance(jd["asset"], str) or not jd["asset"]:
+                raise ValueError("Invalid asset name")
+            if jd["asset_price"] < 0:
+                raise ValueError("Negative asset price")
+            if jd["asset_amount"] < 0:
+                raise ValueError("Negative asset amount")
+            if jd["fees"] < 0:
+                raise ValueError("Negative fees")
+            if not isinstance(jd["reference"], str):
+                raise ValueError("Reference must be a string")
+            if not isinstance(jd["comment"], str):
+                raise ValueError("Comment must be a string")
 
     @property
     def timestamp(self) -> float:
@@ -44,6 +97,7 @@ class Transaction():
         if value < 0:
             raise ValueError("Invalid timestamp")
         self._timestamp = value
+        self._hash = None
 
     @property
     def asset(self) -> str:
@@ -54,6 +108,7 @@ class Transaction():
         if not isinstance(value, str) or not value:
             raise ValueError("Invalid asset name")
         self._asset = value
+        self._hash = None
 
     @property
     def asset_price(self) -> float:
@@ -64,6 +119,7 @@ class Transaction():
         if value < 0:
             raise ValueError("Negative asset price")
         self._asset_price = value
+        self._hash = None
 
     @property
     def asset_amount(self) -> float:
@@ -74,6 +130,7 @@ class Transaction():
         if value < 0:
             raise ValueError("Negative asset amount")
         self._asset_amount = value
+        self._hash = None
 
     @property
     def fees(self) -> float:
@@ -84,6 +141,7 @@ class Transaction():
         if value < 0:
             raise ValueError("Negative fees")
         self._fees = value
+        self._hash = None
 
     @property
     def reference(self) -> str:
@@ -94,6 +152,7 @@ class Transaction():
         if not isinstance(value, str):
             raise ValueError("Reference must be a string")
         self._reference = value
+        self._hash = None
 
     @property
     def comment(self) -> str:
@@ -109,8 +168,29 @@ class Transaction():
     def asset_value(self) -> float:
         return self.asset_amount * self.asset_price
 
+    def detached(self) -> "Transaction":
+        """This transaction, as it is now, kept apart from the list it's in. See TxRowView.detached()"""
+        return self
+
+    @property
+    def identity(self) -> Tuple:
+        """What makes two transactions the same one (say, imported twice). Comments and disabled don't count."""
+        return (self.timestamp, self.asset, self.asset_amount, self.asset_price, self.fees, self.reference)
+
     def update_hash(self) -> None:
-        self._hash = hash((self.timestamp, self.asset, self.asset_amount, self.asset_price, self.fees))  # try make dups harder to have
+        self._hash = hash(self.identity)  # try make dups harder to have
+
+    @property
+    def tx_hash(self) -> int:
+        if self._hash is None:
+            self.update_hash()
+        return self._hash
+
+def insert_by_timestamp(txs: List[Transaction], tx: Transaction) -> int:
+    """Insert tx into timestamp-sorted txs, after any with the same timestamp. Returns its index."""
+    idx = bisect_right(txs, tx.timestamp, key=lambda t: t.timestamp)
+    txs.insert(idx, tx)
+    return idx
 
 # QT View models
 class TxTableModel(QAbstractTableModel):
@@ -118,6 +198,10 @@ class TxTableModel(QAbstractTableModel):
     Parent mode of both the Acqusition and Disposition table model
     """
 
+    # (old, new) for each single-transaction change: old is None for an add, new is None for a delete.
+    # For storage that saves row by row (see StashDatabase)
+    transaction_changed = Signal(object, object)
+
     def __init__(self, asset: str, transactions: List[Transaction] = []) -> None:
         super(TxTableModel, self).__init__()
         assert asset is not None
@@ -162,6 +246,8 @@ class TxTableModel(QAbstractTableModel):
 
     def toggle_disabled(self, row: int) -> None:
          self.transactionsList[row].disabled = not self.transactionsList[row].disabled
+         tx = self.transactionsList[row].detached()
+         self.transaction_changed.emit(tx, tx)
 
     def edit_row(self, row: int = -1) -> None:
         if self.row_under_edit == -1:
@@ -177,10 +263,36 @@ class TxTableModel(QAbstractTableModel):
         self.row_under_edit = -1
         self.edit_buff = None
 
+    def insert_transaction(self, tx: Transaction) -> int:
+        """Add tx where its timestamp puts it (the list is kept sorted) and return its row"""
+        row = bisect_right(self.transactionsList, tx.timestamp, key=lambda t: t.timestamp)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.transactionsList.insert(row, tx)
+        self.endInsertRows()
+        self.transaction_changed.emit(None, self.transactionsList[row]) # the row itself, for storage to set its row_id
+        return row
+
+    def delete_transaction(self, row: int) -> None:
+        self.beginRemoveRows(QModelIndex(), row, row)
+        tx = self.transactionsList[row].detached() # a TxStore row view would read the row that moves up
+        del self.transactionsList[row]
+        self.endRemoveRows()
+        self.transaction_changed.emit(tx, None)
+
     def accept_edit(self) -> None:
-        self.transactionsList[self.row_under_edit] = self.edit_buff.duplicate()
+        edited = self.edit_buff.duplicate()
+        original = self.transactionsList[self.row_under_edit].detached() # a TxStore row view would read the edit
+        if edited.timestamp == original.timestamp:
+            self.transactionsList[self.row_under_edit] = edited
+        else:
+            # moved in time: move it in the (sorted) list too
+            self.beginResetModel()
+            del self.transactionsList[self.row_under_edit]
+            insert_by_timestamp(self.transactionsList, edited)
+            self.endResetModel()
         self.row_under_edit = -1
         self.edit_buff = None
+        self.transaction_changed.emit(original, edited)
 
     # overrides
     def headerData(self, section: int, orientation: Qt.Orientation, role: int = ...):
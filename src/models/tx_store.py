@@ -0,0 +1,379 @@
+import sys
+from typing import List, Dict, Iterable, Iterator
+
+import numpy as np
+
+from models.transaction import Transaction
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.timestamps import parse_json_timestamps
+
+class StringTable:
+    """Interned strings (references, comments) referred to by integer id"""
+
+    def __init__(self) -> None:
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        str_id = self.ids.get(value)
+        if str_id is None:
+            str_id = len(self.strings)
+            self.strings.append(value)
+            self.ids[value] = str_id
+        return str_id
+
+    def __getitem__(self, str_id: int) -> str:
+        return self.strings[str_id]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+
+class MappedStringTable(StringTable):
+    """A StringTable read straight out of a buffer (see stash_io.read_stash_binary())
+
+       data holds the utf-8 strings back to back, string i being data[offsets[i]:offsets[i+1]].
+       Strings are decoded the first time they are asked for, and the lookup intern()
+       needs is only built on its first call.
+    """
+
+    def __init__(self, data: bytes, offsets: np.ndarray) -> None:
+        super().__init__()
+        self._data = data
+        self._offsets: List[int] = offsets.tolist()
+        self.strings = [None] * (len(self._offsets) - 1)
+        self._indexed: bool = False
+
+    def __getitem__(self, str_id: int) -> str:
+        value = self.strings[str_id]
+        if value is None:
+            value = self.strings[str_id] = str(self._data[self._offsets[str_id]:self._offsets[str_id + 1]], "utf-8")
+        return value
+
+    def intern(self, value: str) -> int:
+        if not self._indexed:
+            self.ids = {self[str_id]: str_id for str_id in reversed(range(len(self.strings)))}
+            self._indexed = True
+        return super().intern(value)
+
+
+class TxRowView:
+    """Mixin that makes a Transaction subclass read and write a row of a TxStore
+       instead of holding its own attributes.
+
+       A view is only good until rows are inserted, deleted or re-sorted in front
+       of it - it refers to the row by index.
+    """
+
+    __slots__ = () # the concrete view classes hold the slots, to keep a single layout
+
+    def __init__(self, store: "TxStore", row: int) -> None:
+        # Deliberately does not call Transaction.__init__(). The data lives in the store.
+        self._store = store
+        self._row = row
+        self._hash = None
+
+    def detached(self) -> Transaction:
+        """A plain copy of the row as it is now, that stays the same when rows move or are written"""
+        return self.duplicate()
+
+    @property
+    def timestamp(self) -> float:
+        return float(self._store._data["timestamp"][self._row])
+
+    @timestamp.setter
+    def timestamp(self, value: float) -> None:
+        if value < 0:
+            raise ValueError("Invalid timestamp")
+        self._store._data["timestamp"][self._row] = value
+        self._hash = None
+
+    @property
+    def asset(self) -> str:
+        return self._store.asset
+
+    @asset.setter
+    def asset(self, value: str) -> None:
+        if not isinstance(value, str) or not value:
+            raise ValueError("Invalid asset name")
+        if value != self._store.asset:
+            raise ValueError(f"Asset mismatch: found {value}. Should be {self._store.asset}")
+
+    @property
+    def asset_price(self) -> float:
+        return float(self._store._data["asset_price"][self._row])
+
+    @asset_price.setter
+    def asset_price(self, value: float) -> None:
+        if value < 0:
+            raise ValueError("Negative asset price")
+        self._store._data["asset_price"][self._row] = value
+        self._hash = None
+
+    @property
+    def asset_amount(self) -> float:
+        return float(self._store._data["asset_amount"][self._row])
+
+    @asset_amount.setter
+    def asset_amount(self, value: float) -> None:
+        if value < 0:
+            raise ValueError("Negative asset amount")
+        self._store._data["asset_amount"][self._row] = value
+        self._hash = None
+
+    @property
+    def fees(self) -> float:
+        return float(self._store._data["fees"][self._row])
+
+    @fees.setter
+    def fees(self, value: float) -> None:
+        if value < 0:
+            raise ValueError("Negative fees")
+        self._store._data["fees"][self._row] = value
+        self._hash = None
+
+    @property
+    def reference(self) -> str:
+        return self._store.strings[self._store._data["reference_id"][self._row]]
+
+    @reference.setter
+    def reference(self, value: str) -> None:
+        if not isinstance(value, str):
+            raise ValueError("Reference must be a string")
+        self._store._data["reference_id"][self._row] = self._store.strings.intern(value)
+        self._hash = None
+
+    @property
+    def comment(self) -> str:
+        return self._store.strings[self._store._data["comment_id"][self._row]]
+
+    @comment.setter
+    def comment(self, value: str) -> None:
+        if not isinstance(value, str):
+            raise ValueError("Comment must be a string")
+        self._store._data["comment_id"][self._row] = self._store.strings.intern(value)
+
+    @property
+    def disabled(self) -> bool:
+        return bool(self._store._data["disabled"][self._row])
+
+    @disabled.setter
+    def disabled(self, value: bool) -> None:
+        self._store._data["disabled"][self._row] = value
+
+    @property
+    def row_id(self) -> int:
+        return int(self._store._data["row_id"][self._row]) or None
+
+    @row_id.setter
+    def row_id(self, value: int) -> None:
+        self._store._data["row_id"][self._row] = value or 0
+
+
+class AcquisitionRow(TxRowView, Acquisition):
+    """An Acquisition whose data is a row in a TxStore"""
+
+    __slots__ = ("_store", "_row")
+
+    @property
+    def lot_number(self) -> int:
+        return int(self._store._data["lot_number"][self._row])
+
+    @lot_number.setter
+    def lot_number(self, value: int) -> None:
+        self._store._data["lot_number"][self._row] = value
+
+
+class DispositionRow(TxRowView, Disposition):
+    """A Disposition whose data is a row in a TxStore"""
+
+    __slots__ = ("_store", "_row")
+
+
+class TxStore:
+    """Columnar ("struct of arrays") storage for Acquisitions or Dispositions of one asset.
+
+       Stands in for the List[Acquisition] or List[Disposition] held by a Stash: indexing
+       returns a row view (an Acquisition or Disposition), assigning a Transaction to an
+       index copies its fields into that row. The columns themselves are numpy arrays,
+       available through column(), for sorting, filtering and aggregating without
+       touching a Transaction object.
+    """
+
+    COLUMN_TYPES = {
+        "timestamp": np.float64,
+        "asset_amount": np.float64,
+        "asset_price": np.float64,
+        "fees": np.float64,
+        "disabled": np.bool_,
+        "lot_number": np.int64,
+        "row_id": np.int64, # 0 for none, see Transaction.row_id
+        "reference_id": np.int32,
+        "comment_id": np.int32
+    }
+
+    def __init__(self, tx_type: type, asset: str, strings: StringTable = None) -> None:
+        assert issubclass(tx_type, (Acquisition, Disposition))
+        self.tx_type: type = tx_type
+        self.asset: str = asset
+        self.strings: StringTable = strings if strings is not None else StringTable()
+        self._row_type: type = AcquisitionRow if issubclass(tx_type, Acquisition) else DispositionRow
+        self._size: int = 0
+        self._data: Dict[str, np.ndarray] = {name: np.zeros(0, dtype) for name, dtype in TxStore.COLUMN_TYPES.items()}
+
+    def column(self, name: str) -> np.ndarray:
+        """The live array for a column. Writing to it writes to the store."""
+        return self._data[name][:self._size]
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._data["timestamp"])
+        if size > capacity:
+            capacity = max(size, 2 * capacity, 16)
+            for name, arr in self._data.items():
+                grown = np.zeros(capacity, arr.dtype)
+                grown[:self._size] = arr[:self._size]
+                self._data[name] = grown
+
+    def _write_row(self, row: int, tx: Transaction) -> None:
+        if tx.asset != self.asset:
+            raise ValueError(f"Asset mismatch: found {tx.asset}. Should be {self.asset}")
+        self._data["timestamp"][row] = tx.timestamp
+        self._data["asset_amount"][row] = tx.asset_amount
+        self._data["asset_price"][row] = tx.asset_price
+        self._data["fees"][row] = tx.fees
+        self._data["disabled"][row] = tx.disabled
+        self._data["lot_number"][row] = getattr(tx, "lot_number", 0)
+        self._data["row_id"][row] = tx.row_id or 0
+        self._data["reference_id"][row] = self.strings.intern(tx.reference)
+        self._data["comment_id"][row] = self.strings.intern(tx.comment)
+
+    # list-like interface
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, idx: int | slice) -> Transaction | List[Transaction]:
+        if isinstance(idx, slice):
+            return [self._row_type(self, row) for row in range(*idx.indices(self._size))]
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError("TxStore index out of range")
+        return self._row_type(self, idx)
+
+    def __iter__(self) -> Iterator[Transaction]:
+        for row in range(self._size):
+            yield self._row_type(self, row)
+
+    def __setitem__(self, idx: int, tx: Transaction) -> None:
+        self._write_row(self[idx]._row, tx)
+
+    def __delitem__(self, idx: int) -> None:
+        row = self[idx]._row
+        for arr in self._data.values():
+            arr[row:self._size - 1] = arr[row + 1:self._size]
+        self._size -= 1
+
+    def __iadd__(self, txs: Iterable[Transaction]) -> "TxStore":
+        self.extend(txs)
+        return self
+
+    def append(self, tx: Transaction) -> None:
+        self._reserve(self._size + 1)
+        self._size += 1
+        self._write_row(self._size - 1, tx)
+
+    def extend(self, txs: Iterable[Transaction]) -> None:
+        for tx in txs:
+            self.append(tx)
+
+    def insert(self, idx: int, tx: Transaction) -> None:
+        idx = max(0, min(idx if idx >= 0 else idx + self._size, self._size))
+        self._reserve(self._size + 1)
+        for arr in self._data.values():
+            arr[idx + 1:self._size + 1] = arr[idx:self._size]
+        self._size += 1
+        self._write_row(idx, tx)
+
+    # vectorized operations
+
+    def enabled_mask(self) -> np.ndarray:
+        return ~self.column("disabled")
+
+    def sort_by_timestamp(self) -> None:
+        """Stable in-place sort of all rows by timestamp"""
+        order = np.argsort(self.column("timestamp"), kind="stable")
+        for name, arr in self._data.items():
+            arr[:self._size] = arr[:self._size][order]
+
+    def select(self, rows: np.ndarray) -> "TxStore":
+        """A new store with just the rows picked by a boolean mask or index array.
+
+            The new store shares this one's string table.
+        """
+        dst = TxStore(self.tx_type, self.asset, self.strings)
+        for name in self._data:
+            dst._data[name] = self.column(name)[rows].copy()
+        dst._size = len(dst._data["timestamp"])
+        return dst
+
+    def time_range(self, start_timestamp: float, end_timestamp: float) -> slice:
+        """Rows with start_timestamp <= timestamp < end_timestamp. Store must be sorted."""
+        timestamps = self.column("timestamp")
+        return slice(int(np.searchsorted(timestamps, start_timestamp, side="left")),
+                     int(np.searchsorted(timestamps, end_timestamp, side="left")))
+
+    # conversion
+
+    @classmethod
+    def from_transactions(cls, tx_type: type, asset: str, txs: Iterable[Transaction]) -> "TxStore":
+        store = cls(tx_type, asset)
+        store.extend(txs)
+        return store
+
+    @classmethod
+    def from_json_dicts(cls, tx_type: type, asset: str, jds: List[Dict], strings: StringTable = None) -> "TxStore":
+        """Build a store from json-serialized Acquisitions/Dispositions (see Acquisition.from_json_dict)
+
+            Values are validated a column at a time. This should be called inside a try block.
+        """
+        store = cls(tx_type, asset, strings)
+        store.extend_json_dicts(jds)
+        return store
+
+    def extend_json_dicts(self, jds: List[Dict]) -> None:
+        """Append json-serialized transactions, a whole batch of rows at a time. See from_json_dicts()"""
+        parse_json_timestamps(jds)
+        count = len(jds)
+        if any(jd["asset"] != self.asset for jd in jds):
+            raise ValueError(f"Asset mismatch. Should be {self.asset}")
+        if not all(isinstance(jd["reference"], str) for jd in jds):
+            raise ValueError("Reference must be a string")
+        if not all(isinstance(jd["comment"], str) for jd in jds):
+            raise ValueError("Comment must be a string")
+        columns = {
+            "timestamp": np.array([jd["timestamp"] for jd in jds], np.float64),
+            "asset_amount": np.array([jd["asset_amount"] for jd in jds], np.float64),
+            "asset_price": np.array([jd["asset_price"] for jd in jds], np.float64),
+            "fees": np.array([jd["fees"] for jd in jds], np.float64),
+            "disabled": np.array([jd.get("disabled", False) for jd in jds], np.bool_),
+            "lot_number": np.zeros(count, np.int64),
+            "row_id": np.zeros(count, np.int64),
+            "reference_id": np.array([self.strings.intern(jd["reference"]) for jd in jds], np.int32),
+            "comment_id": np.array([self.strings.intern(jd["comment"]) for jd in jds], np.int32)
+        }
+        for name, message in (("timestamp", "Invalid timestamp"), ("asset_amount", "Negative asset amount"),
+                              ("asset_price", "Negative asset price"), ("fees", "Negative fees")):
+            if np.any(columns[name] < 0):
+                raise ValueError(message)
+        if self._size == 0:
+            self._data = columns
+        else:
+            self._reserve(self._size + count)
+            for name, column in columns.items():
+                self._data[name][self._size:self._size + count] = column
+        self._size += count
+
+    def to_json_dicts(self) -> List[Dict]:
+        return [tx.to_json_dict() for tx in self]
@@ -0,0 +1,81 @@
+import sys
+from typing import List, Sequence
+
+import numpy as np
+
+from models.stash import Stash, StashState, LotState
+
+class OpenLots:
+    """The open lots at one or more points in time, as flat arrays with one entry per (point, lot).
+
+       Entries are grouped by point, in the order the points were given.
+    """
+
+    def __init__(self, timestamps: Sequence[float], count: int = 0) -> None:
+        self.timestamps: np.ndarray = np.asarray(timestamps, np.float64) # the points in time
+        self.point_idx: np.ndarray = np.zeros(count, np.int64) # index into timestamps
+        self.lot_number: np.ndarray = np.zeros(count, np.int64)
+        self.amount: np.ndarray = np.zeros(count, np.float64) # lot balance at that point
+        self.date_acquired: np.ndarray = np.zeros(count, np.float64)
+        self.unit_basis: np.ndarray = np.zeros(count, np.float64) # acquisition price, as LotState.sale_basis uses
+
+    def __len__(self) -> int:
+        return len(self.lot_number)
+
+    @classmethod
+    def from_states(cls, timestamps: Sequence[float], states: Sequence[StashState]) -> "OpenLots":
+        """Open lots of states[i] (which may be None: no lots) as of timestamps[i]"""
+        lots: List[LotState] = []
+        counts: List[int] = []
+        for state in states:
+            open_lots = state.open_lots if state is not None else []
+            lots.extend(open_lots)
+            counts.append(len(open_lots))
+        dst = cls(timestamps)
+        dst.point_idx = np.repeat(np.arange(len(counts)), counts)
+        dst.lot_number = np.fromiter((l.lot_number for l in lots), np.int64, len(lots))
+        dst.amount = np.fromiter((l.balance for l in lots), np.float64, len(lots))
+        dst.date_acquired = np.fromiter((l.initial_timestamp for l in lots), np.float64, len(lots))
+        dst.unit_basis = np.fromiter((l.initial_price for l in lots), np.float64, len(lots))
+        return dst
+
+    @classmethod
+    def from_stash(cls, stash: Stash, timestamps: Sequence[float]) -> "OpenLots":
+        """Open lots of an (updated) stash as of each of timestamps. See Stash.as_of()"""
+        return cls.from_states(timestamps, [stash.as_of(ts) for ts in timestamps])
+
+
+class UnrealizedGains:
+    """What the open lots would gain (or lose) if sold at the market price.
+
+       Per-lot arrays line up with the OpenLots entries. Totals have one entry
+       per point in time. Like the realized figures, lots held more than a year
+       are long term.
+    """
+
+    def __init__(self, open_lots: OpenLots, prices: Sequence[float]) -> None:
+        prices = np.asarray(prices, np.float64)
+        if prices.shape != open_lots.timestamps.shape:
+            raise ValueError(f"Need one price per point in time: got {len(prices)} for {len(open_lots.timestamps)}")
+        points = len(open_lots.timestamps)
+        idx = open_lots.point_idx
+
+        self.open_lots: OpenLots = open_lots
+        self.value: np.ndarray = open_lots.amount * prices[idx]
+        self.basis: np.ndarray = open_lots.amount * open_lots.unit_basis
+        self.gains: np.ndarray = self.value - self.basis
+        self.is_long_term: np.ndarray = (open_lots.timestamps[idx] - open_lots.date_acquired) > LotState.ONE_YEAR_SECS
+
+        self.short_term: np.ndarray = np.bincount(idx, np.where(self.is_long_term, 0, self.gains), points)
+        self.long_term: np.ndarray = np.bincount(idx, np.where(self.is_long_term, self.gains, 0), points)
+        self.total_value: np.ndarray = np.bincount(idx, self.value, points)
+        self.total_basis: np.ndarray = np.bincount(idx, self.basis, points)
+
+    @property
+    def total(self) -> np.ndarray:
+        return self.short_term + self.long_term
+
+
+def unrealized_gains(stash: Stash, timestamps: Sequence[float], prices: Sequence[float]) -> UnrealizedGains:
+    """Unrealized gains of a stash's open lots at each timestamp, at the matching price"""
+    return UnrealizedGains(OpenLots.from_stash(stash, timestamps), prices)
@@ -71,3 +71,21 @@ def test_acquisition_negative_asset_amount():
         Acquisition(TIMESTAMP_A, ASSET_A, -1.0, ASSET_PRICE_A, FEES_A, REFERENCE_A, COMMENT_A)
 
 
+
+def test_acquisition_trusted():
+    a = Acquisition.from_json_dict(ACQ_JSON_B, trusted=True)
+    assert a.asset_amount == 23.48877188
+    assert a.disabled == True
+    assert a.lot_number == 0
+    assert not hasattr(a, "__dict__")
+
+    d = a.duplicate()
+    assert d.to_json_dict() == a.to_json_dict()
+    assert d.tx_hash == a.tx_hash
+
+def test_acquisition_validate_json_dicts():
+    Acquisition.validate_json_dicts([ACQ_JSON_A, ACQ_JSON_B])
+    with pytest.raises(ValueError, match="Negative asset amount"):
+        Acquisition.validate_json_dicts([ACQ_JSON_A, dict(ACQ_JSON_B, asset_amount=-1.0)])
+    with pytest.raises(ValueError, match="Reference must be a string"):
+        Acquisition.validate_json_dicts([dict(ACQ_JSON_A, reference=None)])
@@ -0,0 +1,75 @@
+import sys
+import pytest
+from typing import List, Dict, Any
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.form8949 import Form8949TableModel
+from models.adjustments import AdjustmentEngine, WashSaleRule, TimestampIndex
+from models.portfolio import Portfolio
+
+DAY = 24 * 60 * 60
+
+def _wash_sale_stash(replacement_amount: float = 1.0) -> Stash:
+    acqs = [Acquisition(0 * DAY, "BTC", 1.0, 100.0, 0.0, "a1", ""),
+            Acquisition(50 * DAY, "BTC", replacement_amount, 70.0, 0.0, "a2", ""), # within 30 days after the loss
+            Acquisition(200 * DAY, "BTC", 1.0, 10.0, 0.0, "a3", "")] # too late to count
+    disps = [Disposition(40 * DAY, "BTC", 1.0, 60.0, 0.0, "d1", ""), # loss of 40
+             Disposition(100 * DAY, "BTC", replacement_amount, 80.0, 0.0, "d2", "")]
+    s = Stash("BTC", "wash", acqs, disps, adjustment_rules=["wash_sale"])
+    s.update()
+    return s
+
+def test_timestamp_index():
+    index = TimestampIndex(_wash_sale_stash().acquisitions)
+    assert [a.reference for a in index.between(10 * DAY, 60 * DAY)] == ["a2"]
+    assert [a.reference for a in index.between(0, 200 * DAY)] == ["a1", "a2", "a3"]
+
+def test_wash_sale():
+    s = _wash_sale_stash()
+    entries = Form8949TableModel(s.states, AdjustmentEngine.from_names(s.adjustment_rules)).all_entries
+    loss, replacement = entries
+    assert loss.code == "W"
+    assert loss.adjustment == pytest.approx(40.0)
+    assert loss.gain_or_loss == pytest.approx(0.0)
+    # the disallowed loss went into the replacement lot's basis
+    assert replacement.code == ""
+    assert replacement.cost_basis == pytest.approx(70.0 + 40.0)
+    assert replacement.gain_or_loss == pytest.approx(80.0 - 110.0)
+
+    plain = Form8949TableModel(s.states).all_entries
+    assert [(e.adjustment, e.code) for e in plain] == [(0.0, ""), (0.0, "")]
+
+def test_partial_wash_sale():
+    entries = Form8949TableModel(_wash_sale_stash(0.25).states, AdjustmentEngine([WashSaleRule()])).all_entries
+    assert entries[0].adjustment == pytest.approx(10.0)
+    assert entries[1].cost_basis == pytest.approx(0.25 * 70.0 + 10.0)
+
+def test_wash_sale_needs_replacement_held():
+    acqs = [Acquisition(0 * DAY, "BTC", 1.0, 100.0, 0.0, "a1", ""),
+            Acquisition(10 * DAY, "BTC", 1.0, 100.0, 0.0, "a2", "")]
+    # both lots go in one sale, so nothing replaces either of them
+    s = Stash("BTC", "sold out", acqs, [Disposition(20 * DAY, "BTC", 2.0, 50.0, 0.0, "d1", "")])
+    s.update()
+    entries = Form8949TableModel(s.states, AdjustmentEngine([WashSaleRule()])).all_entries
+    assert [(e.adjustment, e.code) for e in entries] == [(0.0, ""), (0.0, "")]
+    assert sum(e.gain_or_loss for e in entries) == pytest.approx(-100.0)
+
+    # half of lot 2 is still held after the sale, which washes half of lot 1's loss
+    s = Stash("BTC", "half held", acqs, [Disposition(20 * DAY, "BTC", 1.5, 50.0, 0.0, "d1", ""),
+                                         Disposition(60 * DAY, "BTC", 0.5, 50.0, 0.0, "d2", "")])
+    s.update()
+    entries = Form8949TableModel(s.states, AdjustmentEngine([WashSaleRule()])).all_entries
+    assert [e.code for e in entries] == ["W", "", ""]
+    assert entries[0].adjustment == pytest.approx(25.0)
+    assert entries[2].cost_basis == pytest.approx(50.0 + 25.0)
+
+def test_unknown_rule():
+    with pytest.raises(ValueError):
+        AdjustmentEngine.from_names(["no_such_rule"])
+
+def test_portfolio_wash_sale():
+    entries = Portfolio("p", [_wash_sale_stash()]).form8949_entries()
+    assert [e.code for e in entries] == ["W", ""]
+    assert entries[1].cost_basis == pytest.approx(110.0)
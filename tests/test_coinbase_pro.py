@@ -0,0 +1,79 @@
+import sys
+import pytest
+from datetime import datetime, timezone
+from typing import List, Dict, Any
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.coinbase_pro import import_account_reports, read_report_orders, REFERENCE_PREFIX
+
+HEADER = "portfolio,type,time,amount,balance,amount/balance unit,transfer id,trade id,order id\n"
+
+REPORT_2020 = HEADER + """\
+default,deposit,2020-12-01T10:00:00.000Z,1000.0,1000.0,USD,t-1,,
+default,match,2020-12-02T10:00:00.000Z,0.05,0.05,BTC,,1,order-a
+default,match,2020-12-02T10:00:00.000Z,-500.0,500.0,USD,,1,order-a
+default,fee,2020-12-02T10:00:00.000Z,-2.5,497.5,USD,,1,order-a
+default,match,2020-12-02T10:00:05.000Z,0.05,0.1,BTC,,2,order-a
+default,match,2020-12-02T10:00:05.000Z,-500.0,-2.5,USD,,2,order-a
+default,match,2020-12-30T10:00:00.000Z,1.0,1.0,ETH,,3,order-b
+default,match,2020-12-30T10:00:00.000Z,-0.05,0.05,BTC,,3,order-b
+default,match,2020-12-31T23:59:59.000Z,-0.02,0.03,BTC,,4,order-c
+default,match,2020-12-31T23:59:59.000Z,580.0,577.5,USD,,4,order-c
+"""
+
+REPORT_2021 = HEADER + """\
+default,match,2021-01-01T00:00:10.000Z,-0.02,0.01,BTC,,5,order-c
+default,match,2021-01-01T00:00:10.000Z,620.0,1197.5,USD,,5,order-c
+default,fee,2021-01-01T00:00:10.000Z,-6.0,1191.5,USD,,5,order-c
+default,withdrawal,2021-01-02T00:00:00.000Z,-1191.5,0.0,USD,t-2,,
+"""
+
+def _ts(text: str) -> float:
+    return datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp()
+
+def _write_reports(tmp_path) -> List[str]:
+    filenames = [str(tmp_path / "cbpro-account-2020.csv"), str(tmp_path / "cbpro-account-2021.csv")]
+    for filename, text in zip(filenames, (REPORT_2020, REPORT_2021)):
+        with open(filename, "w") as f:
+            f.write(text)
+    return filenames
+
+@pytest.mark.parametrize("chunk_rows", [1, 3, 1000])
+def test_read_report_orders(tmp_path, chunk_rows):
+    orders = read_report_orders(_write_reports(tmp_path)[0], chunk_rows)
+    assert sorted(orders) == ["order-a", "order-b", "order-c"]
+    order = orders["order-a"]
+    assert order.amounts == {"BTC": pytest.approx(0.1), "USD": -1000.0}
+    assert order.fees == 2.5
+    assert order.timestamp == _ts("2020-12-02T10:00:05")
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_import_account_reports(tmp_path, max_workers):
+    by_asset = import_account_reports(_write_reports(tmp_path), chunk_rows=2, max_workers=max_workers)
+    assert sorted(by_asset) == ["BTC", "ETH"]
+
+    btc_acqs, btc_disps = by_asset["BTC"]
+    assert len(btc_acqs) == 1
+    assert btc_acqs[0].asset_amount == pytest.approx(0.1)
+    assert btc_acqs[0].asset_price == pytest.approx(10000.0)
+    assert btc_acqs[0].fees == 2.5
+    assert btc_acqs[0].reference == REFERENCE_PREFIX + "order-a"
+
+    # order-b is a trade of BTC for ETH, order-c a sale that was filled across both years
+    assert [d.reference for d in btc_disps] == [REFERENCE_PREFIX + "order-b", REFERENCE_PREFIX + "order-c"]
+    sale = btc_disps[1]
+    assert sale.asset_amount == pytest.approx(0.04)
+    assert sale.asset_price == pytest.approx(30000.0)
+    assert sale.fees == 6.0
+    assert sale.timestamp == _ts("2021-01-01T00:00:10")
+
+    eth_acqs, eth_disps = by_asset["ETH"]
+    assert eth_disps == []
+    assert eth_acqs[0].asset_amount == 1.0 and eth_acqs[0].asset_price == pytest.approx(0.05)
+
+def test_not_a_report(tmp_path):
+    filename = tmp_path / "other.csv"
+    filename.write_text("date,amount\n2020-01-01,1.0\n")
+    with pytest.raises(ValueError):
+        import_account_reports([str(filename)])
@@ -0,0 +1,72 @@
+import sys
+import io
+import pytest
+from datetime import datetime, timezone
+from typing import List, Dict, Any
+
+from models.csv_import import CsvMapping, CsvImporter, read_csv_stash
+
+EXPORT = """\
+Date,Type,Asset,Quantity,Spot Price,Fees,ID,Notes
+01/05/2021 10:00:00,Buy,BTC,"1,000,000",$30000.00,$1.50,tx-1,first
+01/06/2021 10:00:00,Receive,BTC,50000,31000,0,tx-2,
+01/07/2021 10:00:00,Buy,ETH,100000000,1000,0,tx-3,
+01/04/2021 09:00:00,Sell,BTC,250000,"$29,000.00",$0.75,tx-4,
+
+01/08/2021 10:00:00,Sell,BTC,100000,35000,0,tx-5,
+"""
+
+MAPPING = {"timestamp": "Date", "amount": "Quantity", "price": "Spot Price", "fees": "Fees", "reference": "ID",
+           "comment": "Notes", "side": "Type", "asset": "Asset", "amount_scale": 1e-8}
+
+def _ts(day: int, hour: int) -> float:
+    return datetime(2021, 1, day, hour, tzinfo=timezone.utc).timestamp()
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+def test_csv_importer(batch_size):
+    importer = CsvImporter(CsvMapping.from_json_dict(MAPPING), "BTC")
+    batches = list(importer.batches(io.StringIO(EXPORT), batch_size))
+    acqs = [acq for batch_acqs, _ in batches for acq in batch_acqs]
+    disps = [disp for _, batch_disps in batches for disp in batch_disps]
+    assert importer.skipped_count == 2 # the ETH row and the Receive
+    assert [(a.timestamp, a.asset_amount, a.asset_price, a.fees, a.reference, a.comment) for a in acqs] == [
+        (_ts(5, 10), 0.01, 30000.0, 1.5, "tx-1", "first")]
+    assert [(d.timestamp, d.asset_amount, d.asset_price, d.fees) for d in disps] == [
+        (_ts(4, 9), 0.0025, 29000.0, 0.75), (_ts(8, 10), 0.001, 35000.0, 0.0)]
+
+def test_csv_signed_amounts_and_totals():
+    text = "time;qty;usd\n1609459200;2;-60000\n1609545600;-1;32000\n"
+    mapping = CsvMapping("time", "qty", total="usd", delimiter=";")
+    importer = CsvImporter(mapping, "BTC")
+    acqs, disps = next(importer.batches(io.StringIO(text)))
+    assert [(a.timestamp, a.asset_amount, a.asset_price) for a in acqs] == [(1609459200.0, 2.0, 30000.0)]
+    assert [(d.timestamp, d.asset_amount, d.asset_price) for d in disps] == [(1609545600.0, 1.0, 32000.0)]
+    assert importer._timestamps.fallback_count == 0
+
+def test_csv_epoch_timestamps():
+    rows = [f"{1609459200 + 3600 * i}{'.5' if i % 3 else ''},0.1,30000" for i in range(500)]
+    importer = CsvImporter(CsvMapping("time", "qty", "price"), "BTC")
+    batches = importer.batches(io.StringIO("time,qty,price\n" + "\n".join(rows)), batch_size=64)
+    acqs = [a for batch, _ in batches for a in batch]
+    assert [a.timestamp for a in acqs] == [1609459200 + 3600 * i + (0.5 if i % 3 else 0) for i in range(500)]
+    assert importer._timestamps.fallback_count == 0 # no row went to dateparser
+
+def test_read_csv_stash(tmp_path):
+    filename = tmp_path / "export.csv"
+    filename.write_text(EXPORT)
+    calls = []
+    stash = read_csv_stash(str(filename), CsvMapping.from_json_dict(MAPPING), "BTC", batch_size=2,
+                           progress=lambda done, total: calls.append((done, total)))
+    assert stash.title == "export.csv"
+    assert [d.reference for d in stash.dispositions] == ["tx-4", "tx-5"] # sorted
+    assert calls[-1][0] == calls[-1][1] == len(EXPORT)
+    stash.update()
+    assert len(stash.states) == 3
+
+def test_csv_mapping_round_trip():
+    mapping = CsvMapping.from_json_dict(MAPPING)
+    assert CsvMapping.from_json_dict(mapping.to_json_dict()).to_json_dict() == mapping.to_json_dict()
+
+def test_csv_missing_column():
+    with pytest.raises(ValueError):
+        next(CsvImporter(CsvMapping("When", "Quantity"), "BTC").batches(io.StringIO(EXPORT)))
@@ -0,0 +1,54 @@
+import sys
+import pytest
+from typing import List, Dict, Any
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+import models.dedup
+from models.dedup import BloomFilter, unique_transactions, stream_unique_transactions, import_report
+
+def _acqs(count: int, start: int = 0) -> List[Acquisition]:
+    return [Acquisition(1000.0 + i, "BTC", 1.0, 100.0 + i, 0.5, f"order-{i}", "") for i in range(start, start + count)]
+
+def test_transaction_identity():
+    a1 = Acquisition(1000.0, "BTC", 1.0, 100.0, 0.5, "order-1", "a comment")
+    a2 = Acquisition(1000.0, "BTC", 1.0, 100.0, 0.5, "order-1", "another comment")
+    assert a1.identity == a2.identity
+    assert a1.tx_hash == a2.tx_hash
+    a2.reference = "order-2"
+    assert a1.identity != a2.identity
+    assert a1.tx_hash != a2.tx_hash # edits don't leave a stale hash
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add(hash(("in", i)))
+    assert all(hash(("in", i)) in bloom for i in range(1000))
+    false_positives = sum(hash(("out", i)) in bloom for i in range(10000))
+    assert false_positives < 300
+
+@pytest.mark.parametrize("merge", [unique_transactions, stream_unique_transactions])
+def test_unique_transactions(merge):
+    existing = _acqs(100)
+    incoming = _acqs(100, 50) + _acqs(5, 140) # overlaps, and repeats itself
+    report = merge(existing, iter(incoming))
+    assert [a.reference for a in report.added] == [f"order-{i}" for i in range(100, 150)]
+    assert len(report.skipped) == 55
+    assert str(report) == "50 added, 55 duplicates skipped"
+
+def test_stream_unique_transactions_sorted():
+    existing = _acqs(100)
+    # sorted, with each of the new ones twice in a row
+    incoming = sorted(_acqs(100, 50) + _acqs(50, 100), key=lambda a: a.timestamp)
+    report = stream_unique_transactions(existing, iter(incoming), len(incoming), incoming_sorted=True)
+    assert [a.reference for a in report.added] == [f"order-{i}" for i in range(100, 150)]
+    assert len(report.skipped) == 100
+
+@pytest.mark.parametrize("streaming_size", [0, 1000])
+def test_import_report(monkeypatch, streaming_size):
+    monkeypatch.setattr(models.dedup, "STREAMING_IMPORT_SIZE", streaming_size)
+    existing = _acqs(100)
+    incoming = sorted(_acqs(100, 50) + _acqs(5, 140), key=lambda a: a.timestamp)
+    report = import_report(existing, incoming)
+    assert [a.reference for a in report.added] == [f"order-{i}" for i in range(100, 150)]
+    assert len(report.skipped) == 55
@@ -0,0 +1,101 @@
+import sys
+import pytest
+import numpy as np
+from typing import List, Dict, Any
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.tx_store import TxStore
+from models.fifo_batch import match_fifo, _value_cents
+from models.fixed_point import AssetUnits
+from models.form8949 import Form8949TableModel, entries_from_matches
+
+from stash_test_data import STASH_JSON_DICT_1
+
+def _multi_lot_stash() -> Stash:
+    acqs = [Acquisition(1000.0, "BTC", 1.0, 100.0, 1.0, "a1", ""),
+            Acquisition(2000.0, "BTC", 2.0, 200.0, 0.0, "a2", ""),
+            Acquisition(3000.0, "BTC", 0.0, 300.0, 0.0, "a3", ""), # empty lot
+            Acquisition(4000.0, "BTC", 3.0, 400.0, 0.0, "a4", "")]
+    disps = [Disposition(2000.0, "BTC", 2.5, 250.0, 5.0, "d1", ""), # same time as lot 2
+             Disposition(2500.0, "BTC", 1.0, 260.0, 0.0, "d2", ""), # overdrawn by 0.5
+             Disposition(4000.0 + 2 * 365 * 24 * 3600, "BTC", 2.0, 500.0, 0.0, "d3", "")]
+    s = Stash("BTC", "multi", acqs, disps)
+    s.update()
+    return s
+
+def _assert_same_entries(stash: Stash, matches) -> None:
+    ref = Form8949TableModel(stash.states).all_entries
+    got = entries_from_matches(matches)
+    assert len(got) == len(ref)
+    for r, g in zip(ref, got):
+        assert g.description == r.description
+        assert g.date_acquired == r.date_acquired
+        assert g.date_sold == r.date_sold
+        assert g.proceeds == pytest.approx(r.proceeds)
+        assert g.cost_basis == pytest.approx(r.cost_basis)
+        assert g.is_long_term == r.is_long_term
+
+def test_match_fifo_stash_1():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+    matches = match_fifo(s.asset, s.acquisitions, s.dispositions)
+    assert list(matches.lot_number) == [1, 1]
+    _assert_same_entries(s, matches)
+
+def test_match_fifo_multi_lot():
+    s = _multi_lot_stash()
+    matches = match_fifo(s.asset, s.acquisitions, s.dispositions)
+    assert list(matches.disposition_idx) == [0, 0, 1, 2]
+    assert list(matches.lot_number) == [1, 2, 2, 4]
+    assert list(matches.amount) == pytest.approx([1.0, 1.5, 0.5, 2.0])
+    assert list(matches.overdrawn) == pytest.approx([0.0, 0.5, 0.0])
+    assert list(matches.is_long_term) == [False, False, False, True]
+    _assert_same_entries(s, matches)
+
+def test_match_fifo_tx_store():
+    s = _multi_lot_stash()
+    s.dispositions[1].disabled = True
+    s.update()
+    acqs = TxStore.from_transactions(Acquisition, "BTC", s.acquisitions)
+    disps = TxStore.from_transactions(Disposition, "BTC", s.dispositions)
+    _assert_same_entries(s, match_fifo(s.asset, acqs, disps))
+
+def test_match_fifo_fixed_point():
+    s = _multi_lot_stash()
+    s.fixed_point = True
+    s.update()
+    matches = match_fifo(s.asset, s.acquisitions, s.dispositions, AssetUnits(s.asset))
+    ref = Form8949TableModel(s.states).all_entries
+    assert [e.proceeds for e in entries_from_matches(matches)] == [e.proceeds for e in ref]
+    assert [e.cost_basis for e in entries_from_matches(matches)] == [e.cost_basis for e in ref]
+
+@pytest.mark.parametrize("seed", range(10))
+def test_match_fifo_random_ledger(seed):
+    """Same entries as the stash's own states, with no extra round-off matches carrying a whole fee"""
+    rng = np.random.default_rng(seed)
+    acqs, disps = [], []
+    timestamp = 0.0
+    for i in range(200):
+        timestamp += float(rng.integers(0, 86400)) # sometimes the same time as the one before
+        amount = round(float(rng.uniform(0.01, 2.0)), 8)
+        price = round(float(rng.uniform(100.0, 50000.0)), 2)
+        fees = round(float(rng.uniform(0.0, 5.0)), 2)
+        if rng.random() < 0.5:
+            acqs.append(Acquisition(timestamp, "BTC", amount, price, fees, f"a{i}", ""))
+        else:
+            disps.append(Disposition(timestamp, "BTC", amount, price, fees, f"d{i}", ""))
+    s = Stash("BTC", "random", acqs, disps)
+    s.update()
+    _assert_same_entries(s, match_fifo(s.asset, s.acquisitions, s.dispositions))
+
+def test_value_cents_exact():
+    """The split int64 arithmetic gives exactly what Python's big ints do, for big prices and amounts"""
+    rng = np.random.default_rng(7)
+    for asset in ("BTC", "ETH", "USDC"):
+        units = AssetUnits(asset)
+        prices = rng.integers(0, 10 ** 6 * units.price_scale, 1000) # up to $1M
+        amounts = rng.integers(0, 10 ** 5 * units.scale, 1000) # up to 100k of the asset
+        assert _value_cents(prices, amounts, units).tolist() == \
+               [units.value_cents(p, a) for p, a in zip(prices.tolist(), amounts.tolist())]
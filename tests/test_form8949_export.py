@@ -0,0 +1,89 @@
+import sys
+import io
+import csv
+import pytest
+from datetime import date
+from typing import List, Dict, Any
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.form8949 import Form8949TableModel
+from models.adjustments import AdjustmentEngine
+from models.form8949_export import stash_8949_entries, write_form8949_csv, write_form8949_txf
+
+from stash_test_data import STASH_JSON_DICT_1
+
+DAY = 24 * 60 * 60
+
+def _stash(adjustment_rules: List[str] = []) -> Stash:
+    acqs = [Acquisition(0 * DAY, "BTC", 1.0, 100.0, 0.0, "a1", ""),
+            Acquisition(50 * DAY, "BTC", 1.0, 70.0, 0.0, "a2", ""),
+            Acquisition(400 * DAY, "BTC", 2.0, 10.0, 0.0, "a3", "")]
+    disps = [Disposition(40 * DAY, "BTC", 1.0, 60.0, 0.0, "d1", ""), # short term loss, a wash sale with a2
+             Disposition(500 * DAY, "BTC", 2.0, 80.0, 1.0, "d2", ""), # long term from a2, short term from a3
+             Disposition(800 * DAY, "BTC", 0.5, 90.0, 0.0, "d3", "")] # long term from a3
+    s = Stash("BTC", "export", acqs, disps, adjustment_rules=adjustment_rules)
+    s.update()
+    return s
+
+def _table_model(s: Stash) -> Form8949TableModel:
+    return Form8949TableModel(s.states, AdjustmentEngine.from_names(s.adjustment_rules))
+
+@pytest.mark.parametrize("rules", [[], ["wash_sale"]])
+def test_stream_matches_table_model(rules):
+    s = _stash(rules)
+    streamed = [(e.description, e.date_sold, e.proceeds, e.cost_basis, e.adjustment, e.code)
+                for e in stash_8949_entries(s)]
+    assert streamed == [(e.description, e.date_sold, e.proceeds, e.cost_basis, e.adjustment, e.code)
+                        for e in _table_model(s).all_entries]
+
+@pytest.mark.parametrize("rules", [[], ["wash_sale"]])
+def test_csv_export(rules):
+    s = _stash(rules)
+    f = io.StringIO(newline="")
+    totals = write_form8949_csv(stash_8949_entries(s), f)
+    model = _table_model(s)
+    for is_long_term in (False, True):
+        assert totals.proceeds[is_long_term] == pytest.approx(model.displayed_proceeds_sum(is_long_term))
+        assert totals.cost_basis[is_long_term] == pytest.approx(model.displayed_cost_basis_sum(is_long_term))
+        assert totals.adjustments[is_long_term] == pytest.approx(model.displayed_adjustments_sum(is_long_term))
+        assert totals.gain[is_long_term] == pytest.approx(model.displayed_gain_sum(is_long_term))
+
+    rows = list(csv.reader(io.StringIO(f.getvalue())))
+    part2 = rows.index(["Part II - Long-Term"])
+    short_rows, long_rows = rows[2:part2 - 2], rows[part2 + 2:-1]
+    assert rows[0] == ["Part I - Short-Term"]
+    assert len(short_rows) == totals.count[False] == 2
+    assert len(long_rows) == totals.count[True] == 2
+    assert rows[part2 - 2][0] == "Part I Totals"
+    assert rows[part2 - 2][3] == f"{totals.proceeds[False]:.2f}"
+    assert rows[-1][0] == "Part II Totals"
+    assert rows[-1][7] == f"{totals.gain[True]:.2f}"
+    if rules:
+        assert short_rows[0][5] == "W"
+
+def test_csv_export_years():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+    model = _table_model(s)
+    year = model.all_years[0]
+    model.filter_model_by_year([year])
+    totals = write_form8949_csv(stash_8949_entries(s), io.StringIO(), [year])
+    assert totals.count[False] + totals.count[True] == len(model.display_entries)
+    assert totals.gain[False] == pytest.approx(model.displayed_gain_sum(False))
+
+def test_txf_export():
+    s = _stash(["wash_sale"])
+    f = io.StringIO()
+    totals = write_form8949_txf(stash_8949_entries(s), f, export_date=date(2024, 2, 1))
+    records = f.getvalue().split("^\n")
+    assert records[0] == "V042\nAfifo-tool\nD02/01/2024\n"
+    assert records[-1] == ""
+    records = records[1:-1]
+    assert len(records) == totals.count[False] + totals.count[True]
+    assert [r.split("\n")[1] for r in records] == ["N713"] * totals.count[False] + ["N716"] * totals.count[True]
+    wash = records[0].split("\n")
+    assert wash[4] == "P1.00000000 BTC"
+    assert wash[5:7] == ["D01/01/1970", "D02/10/1970"]
+    assert wash[7:10] == ["$100.00", "$60.00", "$40.00"] # cost, proceeds, disallowed loss
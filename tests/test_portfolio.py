@@ -0,0 +1,105 @@
+import sys
+import pytest
+from typing import List, Dict, Any
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.portfolio import Portfolio, _without_states
+from models.lot_policy import HifoPolicy
+from models.form8949 import Form8949TableModel
+from models.adjustments import AdjustmentEngine
+
+from stash_test_data import STASH_JSON_DICT_1
+
+def _eth_stash() -> Stash:
+    acqs = [Acquisition(1500.0, "ETH", 10.0, 10.0, 0.0, "e1", ""),
+            Acquisition(2500.0, "ETH", 5.0, 20.0, 0.0, "e2", "")]
+    disps = [Disposition(3000.0, "ETH", 12.0, 30.0, 1.0, "ed1", "")]
+    return Stash("ETH", "eth", acqs, disps)
+
+def _portfolio() -> Portfolio:
+    return Portfolio("everything", [Stash.from_json_dict(STASH_JSON_DICT_1), _eth_stash()])
+
+def test_portfolio_json_round_trip():
+    p = _portfolio()
+    p2 = Portfolio.from_json_dict(p.to_json_dict())
+    assert p2.title == "everything"
+    assert p2.assets == p.assets
+    assert p2.to_json_dict() == p.to_json_dict()
+
+def test_portfolio_from_stash_json():
+    p = Portfolio.from_json_dict(STASH_JSON_DICT_1)
+    assert p.assets == [STASH_JSON_DICT_1["asset"]]
+
+def test_portfolio_duplicate_asset():
+    with pytest.raises(ValueError):
+        Portfolio("dup", [_eth_stash(), _eth_stash()])
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_portfolio_update(max_workers):
+    p = _portfolio()
+    p.update(max_workers)
+    for asset, stash in p.stashes.items():
+        ref = Stash.from_json_dict(STASH_JSON_DICT_1) if asset != "ETH" else _eth_stash()
+        ref.update()
+        assert len(stash.states) == len(ref.states)
+        assert stash.states[-1].balance == pytest.approx(ref.states[-1].balance)
+    states = p.states
+    assert len(states) == sum(len(s.states) for s in p.stashes.values())
+    assert all(a.timestamp <= b.timestamp for a, b in zip(states, states[1:]))
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_portfolio_form8949_entries(max_workers):
+    p = _portfolio()
+    entries = p.form8949_entries(max_workers)
+    p.update(1)
+    ref = [e for s in p.stashes.values() for e in Form8949TableModel(s.states).all_entries]
+    assert len(entries) == len(ref)
+    assert all(a.date_sold <= b.date_sold for a, b in zip(entries, entries[1:]))
+    assert sum(e.proceeds for e in entries) == pytest.approx(sum(e.proceeds for e in ref))
+    assert sum(e.cost_basis for e in entries) == pytest.approx(sum(e.cost_basis for e in ref))
+
+def test_portfolio_workers_get_no_states():
+    p = _portfolio()
+    p.update(1)
+    for stash in p.stashes.values():
+        job = _without_states(stash)
+        assert job.states == []
+        assert job.to_json_dict() == stash.to_json_dict()
+
+def test_portfolio_form8949_entries_in_workers():
+    """Stashes that need states build them in the workers, and only their entries come back"""
+    p = _portfolio()
+    for stash in p.stashes.values():
+        stash.lot_policy = HifoPolicy()
+    entries = p.form8949_entries(2)
+    assert all(not stash.states for stash in p.stashes.values())
+    serial = p.form8949_entries(1)
+    assert [(e.description, e.date_sold, e.proceeds, e.cost_basis, e.lot_number) for e in entries] == \
+        [(e.description, e.date_sold, e.proceeds, e.cost_basis, e.lot_number) for e in serial]
+
+def test_portfolio_as_of():
+    p = _portfolio()
+    p.update(1)
+    assert p.as_of(1000.0) == {}
+    holdings = p.as_of(2600.0)
+    assert holdings["ETH"].balance == pytest.approx(15.0)
+
+def test_portfolio_form8949_wash_sale_from_json():
+    """Wash sale adjustments go to the right lots for a portfolio loaded from json (lots not numbered yet)"""
+    day = 24 * 60 * 60
+    acqs = [Acquisition(0 * day, "BTC", 1.0, 100.0, 0.0, "a1", ""),
+            Acquisition(20 * day, "BTC", 1.0, 50.0, 0.0, "a2", ""),
+            Acquisition(50 * day, "BTC", 1.0, 70.0, 0.0, "a3", "")]
+    disps = [Disposition(40 * day, "BTC", 1.0, 60.0, 0.0, "d1", ""), # a loss on a1, washed by a2
+             Disposition(300 * day, "BTC", 2.0, 80.0, 0.0, "d2", "")]
+    stash = Stash("BTC", "wash", acqs, disps, adjustment_rules=["wash_sale"])
+    p = Portfolio.from_json_dict({"title": "json", "stashes": [stash.to_json_dict()]})
+    entries = p.form8949_entries(1)
+
+    stash.update()
+    ref = Form8949TableModel(stash.states, AdjustmentEngine.from_names(stash.adjustment_rules)).all_entries
+    assert [(e.cost_basis, e.adjustment, e.code) for e in entries] == \
+           [(pytest.approx(e.cost_basis), pytest.approx(e.adjustment), e.code) for e in ref]
+    assert entries[1].cost_basis == pytest.approx(50.0 + 40.0) # a2 carries the disallowed loss
@@ -8,6 +8,7 @@ from typing import List, Dict, Any
 from models.acquisition import Acquisition
 from models.disposition import Disposition
 from models.stash import Stash
+from models.lot_policy import LifoPolicy, HifoPolicy, SpecificIdPolicy
 
 from stash_test_data import TEST_ACQ_1, TEST_ACQ_2, TEST_DISP_1, TEST_DISP_2, STASH_JSON_DICT_1
 
@@ -46,3 +47,255 @@ def test_stash_from_json_dict(mocker):
 
 
 
+def test_stash_generate_states():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+
+    assert len(s.states) == 4
+    assert [len(st.lots) for st in s.states] == [1, 1, 2, 2]
+    assert s.states[1].balance == pytest.approx(TEST_ACQ_1["asset_amount"] - TEST_DISP_1["asset_amount"])
+    assert s.states[-1].balance == pytest.approx(TEST_ACQ_1["asset_amount"] + TEST_ACQ_2["asset_amount"]
+                                                 - TEST_DISP_1["asset_amount"] - TEST_DISP_2["asset_amount"])
+    # earlier states are not changed by later activities
+    assert s.states[0].balance == pytest.approx(TEST_ACQ_1["asset_amount"])
+    assert [l.lot_number for l in s.states[1].lots_affected] == [1]
+    assert [l.lot_number for l in s.states[3].lots_affected] == [1]
+    # untouched lots carry only their balance
+    assert s.states[3].lots[1].update_amount_delta == 0
+    assert s.states[3].lots[1].balance == pytest.approx(TEST_ACQ_2["asset_amount"])
+
+def test_stash_state_branch():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+
+    # applying to an older state must not disturb the existing chain
+    branch = s.states[0].apply_activity(1, s.dispositions[1])
+    assert branch.balance == pytest.approx(TEST_ACQ_1["asset_amount"] - TEST_DISP_2["asset_amount"])
+    assert s.states[1].balance == pytest.approx(TEST_ACQ_1["asset_amount"] - TEST_DISP_1["asset_amount"])
+    assert s.states[0].balance == pytest.approx(TEST_ACQ_1["asset_amount"])
+
+def test_stash_update_from_changed_timestamp():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+    first_state = s.states[0]
+
+    # disable the last disposition, only the last state gets rebuilt
+    s.dispositions[1].disabled = True
+    s.update(s.dispositions[1].timestamp)
+    assert len(s.states) == 3
+    assert s.states[0] is first_state
+    assert s.states[-1].balance == pytest.approx(TEST_ACQ_1["asset_amount"] + TEST_ACQ_2["asset_amount"]
+                                                 - TEST_DISP_1["asset_amount"])
+
+    # earlier change renumbers lots from that point on
+    s.acquisitions[0].disabled = True
+    s.update(s.acquisitions[0].timestamp)
+    assert s.acquisitions[1].lot_number == 1
+    assert [st.balance for st in s.states] == pytest.approx([0.0, TEST_ACQ_2["asset_amount"]])
+
+def test_stash_state_current_lot():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+    assert s.states[0].current_lot_idx() == 0
+    assert s.states[-1].current_lot().lot_number == 1
+
+    # use up lot #1 entirely, current lot moves on to lot #2
+    lot_1 = s.states[-1].current_lot()
+    state = s.states[-1].apply_activity(4, Disposition(1469778600.0, "BTC", lot_1.balance, 600.0, 0.0, "", ""))
+    assert state.current_lot_idx() == 1
+    assert state.current_lot().lot_number == 2
+    assert s.states[-1].current_lot_idx() == 0
+
+def test_stash_state_running_totals():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+
+    disp_1 = s.states[1]
+    lot_1 = disp_1.lots_affected[0]
+    assert disp_1.cap_gains_2 == [(False, 1, pytest.approx(lot_1.cap_gains))]
+    assert disp_1.cap_gains == {"S": pytest.approx(lot_1.cap_gains)}
+    assert disp_1.realized_short_term_gains == pytest.approx(lot_1.cap_gains)
+    assert disp_1.open_cost_basis == pytest.approx(disp_1.balance * TEST_ACQ_1["asset_price"])
+
+    last = s.states[-1]
+    assert last.realized_gains == pytest.approx(sum(cg[2] for st in s.states[1::2] for cg in st.cap_gains_2))
+    assert last.balance == pytest.approx(sum(l.balance for l in last.lots))
+    assert last.open_cost_basis == pytest.approx(sum(l.balance * l.initial_price for l in last.lots))
+
+def test_stash_fixed_point():
+    acqs = [Acquisition(1000.0, "BTC", 0.3, 100.0, 0.0, "a1", ""),
+            Acquisition(2000.0, "BTC", 1.0, 200.0, 0.0, "a2", "")]
+    disps = [Disposition(3000.0, "BTC", 0.1, 300.0, 0.0, "d1", ""),
+             Disposition(4000.0, "BTC", 0.2, 300.0, 0.0, "d2", "")]
+
+    # float math leaves some dust, which then gets taken out of lot #2
+    s = Stash("BTC", "floats", acqs, disps)
+    s.update()
+    assert [l.lot_number for l in s.states[-1].lots_affected] == [1, 2]
+
+    s = Stash("BTC", "exact", acqs, disps, fixed_point=True)
+    s.update()
+    last = s.states[-1]
+    assert [l.lot_number for l in last.lots_affected] == [1]
+    assert last.lots[0].balance == 0
+    assert last.balance == 1.0
+    assert last.current_lot().lot_number == 2
+    assert last.realized_short_term_gains == 60.0
+    assert last.open_cost_basis == 200.0
+    assert s.to_json_dict()["fixed_point"] == True
+
+def test_stash_fixed_point_matches_floats():
+    """Prices aren't rounded to cents before they're multiplied by amounts: each lot's
+       proceeds and basis agree with floats to the nearest cent, so totals are off by
+       at most a cent per lot sold
+    """
+    floats = Stash.from_json_dict(STASH_JSON_DICT_1)
+    floats.update()
+    exact = Stash.from_json_dict(STASH_JSON_DICT_1)
+    exact.fixed_point = True
+    exact.update()
+    lots_sold = 0
+    for f, e in zip(floats.states, exact.states):
+        if isinstance(f.activity, Disposition):
+            lots_sold += len(f.lots_affected)
+        tolerance = 0.01 * max(lots_sold, 1)
+        assert e.realized_short_term_gains == pytest.approx(f.realized_short_term_gains, abs=tolerance)
+        assert e.realized_long_term_gains == pytest.approx(f.realized_long_term_gains, abs=tolerance)
+        assert e.open_cost_basis == pytest.approx(f.open_cost_basis, abs=tolerance)
+        for fl, el in zip(f.lots_affected, e.lots_affected):
+            if isinstance(f.activity, Disposition):
+                assert el.sale_proceeds == pytest.approx(fl.sale_proceeds, abs=0.005)
+                assert el.sale_basis == pytest.approx(fl.sale_basis, abs=0.005)
+
+def _policy_stash(policy) -> Stash:
+    acqs = [Acquisition(1000.0, "BTC", 1.0, 100.0, 0.0, "a1", ""),
+            Acquisition(2000.0, "BTC", 1.0, 300.0, 0.0, "a2", ""),
+            Acquisition(3000.0, "BTC", 1.0, 200.0, 0.0, "a3", "")]
+    disps = [Disposition(4000.0, "BTC", 1.5, 400.0, 0.0, "d1", ""),
+             Disposition(5000.0, "BTC", 1.0, 400.0, 0.0, "d2", "")]
+    s = Stash("BTC", "policies", acqs, disps, lot_policy=policy)
+    s.update()
+    return s
+
+def _lots_used(s: Stash) -> List[List[int]]:
+    return [[l.lot_number for l in st.lots_affected] for st in s.states if isinstance(st.activity, Disposition)]
+
+def test_stash_lot_policies():
+    assert _lots_used(_policy_stash(None)) == [[1, 2], [2, 3]]
+    assert _lots_used(_policy_stash(LifoPolicy())) == [[3, 2], [2, 1]]
+    assert _lots_used(_policy_stash(HifoPolicy())) == [[2, 3], [3, 1]]
+    # d2 asks for lot 1, d1 for lot 3 then whatever is left FIFO
+    s = _policy_stash(SpecificIdPolicy({"d1": [3], "d2": [1]}))
+    assert _lots_used(s) == [[3, 1], [1, 2]]
+    assert s.states[-1].balance == pytest.approx(0.5)
+
+    s2 = Stash.from_json_dict(s.to_json_dict())
+    assert s2.lot_policy.name == "SpecificID"
+    assert s2.lot_policy.selections == {"d1": [3], "d2": [1]}
+
+def test_stash_lot_policy_incremental_update():
+    s = _policy_stash(HifoPolicy())
+    s.acquisitions.append(Acquisition(3500.0, "BTC", 1.0, 500.0, 0.0, "a4", ""))
+    s.update(3500.0)
+    assert _lots_used(s) == [[4, 2], [2, 3]]
+    # a branch off an earlier state rebuilds its own index
+    branch = s.states[2].apply_activity(3, Disposition(3600.0, "BTC", 2.0, 400.0, 0.0, "d3", ""))
+    assert [l.lot_number for l in branch.lots_affected] == [2, 3]
+    assert _lots_used(s) == [[4, 2], [2, 3]]
+
+def test_stash_lazy_states():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+    lazy = Stash.from_json_dict(STASH_JSON_DICT_1)
+    lazy.checkpoint_interval = 2
+    lazy.update()
+    assert len(lazy.states) == len(s.states)
+    for idx in reversed(range(len(s.states))): # out of order, so states come from checkpoints
+        assert lazy.states[idx].timestamp == s.states[idx].timestamp
+        assert lazy.states[idx].balance == pytest.approx(s.states[idx].balance)
+        assert [l.balance for l in lazy.states[idx].lots] == pytest.approx([l.balance for l in s.states[idx].lots])
+        assert lazy.states[idx].cap_gains_2 == s.states[idx].cap_gains_2
+    assert lazy.states[-1].realized_gains == pytest.approx(s.states[-1].realized_gains)
+
+    # edits only replay from the checkpoint in front of them
+    changed = s.states[3].timestamp
+    for stash in (s, lazy):
+        stash.dispositions = [d for d in stash.dispositions if d.timestamp != changed]
+        stash.acquisitions = [a for a in stash.acquisitions if a.timestamp != changed]
+        stash.update(changed)
+    assert len(lazy.states._checkpoints) == (len(s.states) + 1) // 2
+    assert [st.balance for st in lazy.states] == pytest.approx([st.balance for st in s.states])
+
+def _closing_stash(pairs: int, policy=None) -> Stash:
+    # every lot but the last two is sold off by the disposition right after it
+    acqs = [Acquisition(1000.0 + 10 * i, "BTC", 1.0, 100.0 + i, 0.0, f"a{i}", "") for i in range(pairs)]
+    disps = [Disposition(1005.0 + 10 * i, "BTC", 1.0, 200.0, 0.0, f"d{i}", "") for i in range(pairs)]
+    acqs += [Acquisition(9000.0, "BTC", 1.0, 100.0, 0.0, "x1", ""),
+             Acquisition(9010.0, "BTC", 1.0, 300.0, 0.0, "x2", "")]
+    disps.append(Disposition(9020.0, "BTC", 0.5, 400.0, 0.0, "x3", ""))
+    return Stash("BTC", "", acqs, disps, lot_policy=policy)
+
+def test_stash_lazy_states_restore_open_lots():
+    for policy in (None, HifoPolicy()):
+        restored = []
+        for pairs in (10, 200):
+            s = _closing_stash(pairs, policy and policy.copy())
+            s.update()
+            lazy = _closing_stash(pairs, policy and policy.copy())
+            lazy.checkpoint_interval = 4
+            lazy.update()
+            last = lazy.states[-1]
+            assert [l.balance for l in last.lots] == pytest.approx([l.balance for l in s.states[-1].lots])
+            assert last.realized_gains == pytest.approx(s.states[-1].realized_gains)
+            assert last.lots_affected[0].lot_number == s.states[-1].lots_affected[0].lot_number
+
+            # a restored ledger only holds lots that were open at its checkpoint
+            checkpoint = lazy.states._checkpoints[-1]
+            ledger = lazy.states._restore(len(lazy.states._checkpoints) - 1)._ledger
+            assert ledger.lot_count == checkpoint.lot_count
+            restored.append((len(ledger.versions), len(ledger._log), len(ledger.policy._heap) if policy else 0))
+        assert restored[0] == restored[1]
+
+def test_stash_as_of():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+    assert s.as_of(s.states[0].timestamp - 1) is None
+    for idx, state in enumerate(s.states):
+        assert s.as_of(state.timestamp) is state
+        assert s.as_of(state.timestamp + 0.5) is state
+        assert sum(l.balance for l in state.open_lots) == pytest.approx(state.balance)
+        assert all(l.balance > 0 for l in state.open_lots)
+
+    t0, t1 = s.states[1].timestamp, s.states[3].timestamp
+    assert s.states_between(t0, t1) == s.states[1:3]
+    short_term, long_term = s.realized_gains_between(t0, t1)
+    gains = [cg for st in s.states[1:3] if isinstance(st.activity, Disposition) for cg in st.cap_gains_2]
+    assert short_term == pytest.approx(sum(g for lt, _, g in gains if not lt))
+    assert long_term == pytest.approx(sum(g for lt, _, g in gains if lt))
+    assert s.realized_gains_between(0, s.states[-1].timestamp + 1) == (
+        pytest.approx(s.states[-1].realized_short_term_gains), pytest.approx(s.states[-1].realized_long_term_gains))
+
+    lazy = Stash.from_json_dict(STASH_JSON_DICT_1)
+    lazy.checkpoint_interval = 2
+    lazy.update()
+    assert lazy.as_of(t1).balance == pytest.approx(s.as_of(t1).balance)
+    assert lazy.realized_gains_between(t0, t1) == (pytest.approx(short_term), pytest.approx(long_term))
+
+def test_stash_keeps_transactions_sorted():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    s.update()
+    acqs = s.acquisitions
+    s.update()
+    assert s.acquisitions is acqs # already in order, so not re-sorted
+
+    first, last = s.acquisitions[0], s.acquisitions[-1]
+    new_acqs = [Acquisition(last.timestamp + 10, "BTC", 1.0, 1.0, 0.0, "new-2", ""),
+                Acquisition(first.timestamp - 10, "BTC", 1.0, 1.0, 0.0, "new-1", "")]
+    s.acquisitions = Stash.merged_by_timestamp(s.acquisitions, new_acqs)
+    assert [a.reference for a in s.acquisitions] == ["new-1", *[a.reference for a in acqs], "new-2"]
+
+    s.update(first.timestamp - 10)
+    full = Stash.from_json_dict(s.to_json_dict())
+    full.update()
+    assert [st.timestamp for st in s.states] == [st.timestamp for st in full.states]
+    assert [st.balance for st in s.states] == pytest.approx([st.balance for st in full.states])
@@ -0,0 +1,106 @@
+import sys
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.tx_store import TxStore
+from models.stash_db import StashDatabase, is_stash_database
+from models.stash_io import read_stash_file
+
+from stash_test_data import STASH_JSON_DICT_1
+
+def _db_with_stash(tmp_path) -> StashDatabase:
+    db = StashDatabase(str(tmp_path / "stash.sqlite"))
+    db.save_stash(Stash.from_json_dict(STASH_JSON_DICT_1))
+    return db
+
+def _count_acquisitions(filename: str) -> int:
+    with StashDatabase(filename, read_only=True) as db:
+        return len(db.load_stash().acquisitions)
+
+def test_stash_db_round_trip(tmp_path):
+    with _db_with_stash(tmp_path) as db:
+        assert is_stash_database(db.filename)
+        assert db.load_stash().to_json_dict() == Stash.from_json_dict(STASH_JSON_DICT_1).to_json_dict()
+        assert isinstance(db.load_stash(columnar=True).acquisitions, TxStore)
+        assert read_stash_file(db.filename).to_json_dict() == Stash.from_json_dict(STASH_JSON_DICT_1).to_json_dict()
+
+def test_stash_db_row_changes(tmp_path):
+    with _db_with_stash(tmp_path) as db:
+        stash = db.load_stash()
+        added = Acquisition(stash.acquisitions[0].timestamp + 60, "BTC", 1.0, 500.0, 0.0, "added", "")
+        db.on_transaction_changed(None, added)
+        assert added.row_id is not None
+
+        edited = added.duplicate()
+        edited.asset_amount = 2.0
+        edited.comment = "edited"
+        db.on_transaction_changed(added, edited)
+        acqs = db.with_reference("added")
+        assert len(acqs) == 1 and acqs[0].asset_amount == 2.0 and acqs[0].comment == "edited"
+
+        edited.disabled = True
+        db.on_transaction_changed(edited, edited)
+        assert db.with_reference("added")[0].disabled
+
+        db.on_transaction_changed(edited, None)
+        assert db.with_reference("added") == []
+        assert db.load_stash().to_json_dict() == Stash.from_json_dict(STASH_JSON_DICT_1).to_json_dict()
+
+def test_stash_db_identical_transactions(tmp_path):
+    """Identical transactions are separate rows: none are merged on save, edit or delete"""
+    stash = Stash.from_json_dict(STASH_JSON_DICT_1)
+    twin = stash.acquisitions[0].duplicate()
+    stash.acquisitions.insert(1, twin)
+    with StashDatabase(str(tmp_path / "stash.sqlite")) as db:
+        db.save_stash(stash)
+        loaded = db.load_stash()
+        assert loaded.to_json_dict() == stash.to_json_dict()
+        assert len({acq.row_id for acq in loaded.acquisitions}) == len(loaded.acquisitions)
+
+        # editing the other row into a copy of the first leaves both
+        other = loaded.acquisitions[2]
+        edited = loaded.acquisitions[0].duplicate()
+        edited.row_id = other.row_id
+        db.on_transaction_changed(other, edited)
+        assert len(db.load_stash().acquisitions) == len(stash.acquisitions)
+
+        db.on_transaction_changed(loaded.acquisitions[1], None)
+        db.on_transaction_changed(loaded.acquisitions[0], None)
+        acqs = db.load_stash().acquisitions
+        assert len(acqs) == len(stash.acquisitions) - 2
+        assert acqs[0].identity == edited.identity
+
+def test_stash_db_newer_version(tmp_path):
+    filename = str(tmp_path / "newer.sqlite")
+    StashDatabase(filename).close()
+    with StashDatabase(filename) as db:
+        db.connection.execute(f"PRAGMA user_version = {StashDatabase.VERSION + 1}")
+    with pytest.raises(ValueError):
+        StashDatabase(filename)
+
+def test_stash_db_queries(tmp_path):
+    with _db_with_stash(tmp_path) as db:
+        stash = Stash.from_json_dict(STASH_JSON_DICT_1)
+        t0, t1 = stash.dispositions[0].timestamp, stash.dispositions[-1].timestamp
+        assert [d.identity for d in db.between(Disposition, t0, t1)] == [d.identity for d in stash.dispositions[:-1]]
+        assert [a.identity for a in db.between(Acquisition, 0, float("inf"))] == [a.identity for a in stash.acquisitions]
+        reference = stash.dispositions[0].reference
+        assert [d.identity for d in db.with_reference(reference)] == [stash.dispositions[0].identity]
+        plan = " ".join(str(row) for row in db.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM transactions WHERE reference = ?", (reference,)))
+        assert "transactions_reference" in plan
+
+def test_stash_db_concurrent_readers(tmp_path):
+    with _db_with_stash(tmp_path) as db:
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            counts = list(executor.map(_count_acquisitions, [db.filename] * 4))
+        assert counts == [len(STASH_JSON_DICT_1["acquisitions"])] * 4
+
+def test_stash_db_not_a_stash(tmp_path):
+    with StashDatabase(str(tmp_path / "empty.sqlite")) as db:
+        with pytest.raises(ValueError):
+            db.load_stash()
@@ -0,0 +1,113 @@
+import sys
+import os
+import io
+import json
+import pytest
+from typing import List, Dict, Any
+
+from models.stash import Stash
+from models.tx_store import TxStore
+from models.stash_io import read_stash, read_stash_file, read_stash_binary, write_stash_binary_file, is_binary_stash, \
+    write_stash_json_file, stash_compression, snapshot_stash, UMASK
+
+from stash_test_data import STASH_JSON_DICT_1
+
+def _as_file(jd: Dict, indent: int = 2) -> io.BytesIO:
+    return io.BytesIO(json.dumps(jd, indent=indent).encode("utf-8"))
+
+@pytest.mark.parametrize("chunk_size", [3, 64, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_read_stash(indent, chunk_size):
+    s = read_stash(_as_file(STASH_JSON_DICT_1, indent), batch_size=1, chunk_size=chunk_size)
+    assert s.to_json_dict() == Stash.from_json_dict(STASH_JSON_DICT_1).to_json_dict()
+
+def test_read_stash_columnar():
+    s = read_stash(_as_file(STASH_JSON_DICT_1, None), columnar=True, batch_size=2, chunk_size=5)
+    assert isinstance(s.acquisitions, TxStore)
+    assert s.to_json_dict() == Stash.from_json_dict(STASH_JSON_DICT_1).to_json_dict()
+
+def test_read_stash_empty():
+    jd = {"asset": "ETH", "title": "empty", "acquisitions": [], "dispositions": []}
+    s = read_stash(_as_file(jd))
+    assert s.acquisitions == [] and s.dispositions == []
+    s.update()
+    assert s.states == []
+
+def test_read_stash_progress():
+    calls = []
+    f = _as_file(STASH_JSON_DICT_1)
+    total = len(f.getvalue())
+    read_stash(f, batch_size=1, chunk_size=16, progress=lambda done, total_bytes: calls.append((done, total_bytes)), total_bytes=total)
+    assert len(calls) >= 2
+    assert calls[-1] == (total, total)
+
+@pytest.mark.parametrize("text", ['{"asset": "BTC", "title": "x", "acquisitions": [{}', '{"asset": "BTC" "title": "x"}', '[]'])
+def test_read_stash_bad_json(text):
+    with pytest.raises(ValueError):
+        read_stash(io.BytesIO(text.encode("utf-8")), chunk_size=4)
+
+@pytest.mark.parametrize("columnar", [True, False])
+def test_binary_round_trip(tmp_path, columnar):
+    filename = str(tmp_path / "test.stash")
+    write_stash_binary_file(Stash.from_json_dict(STASH_JSON_DICT_1), filename)
+    assert is_binary_stash(filename)
+    s = read_stash_binary(filename, columnar)
+    assert isinstance(s.acquisitions, TxStore) == columnar
+    assert s.to_json_dict() == Stash.from_json_dict(STASH_JSON_DICT_1).to_json_dict()
+    assert read_stash_file(filename).to_json_dict() == s.to_json_dict()
+
+def test_binary_edit_and_save_over(tmp_path):
+    filename = str(tmp_path / "test.stash")
+    write_stash_binary_file(Stash.from_json_dict(STASH_JSON_DICT_1, columnar=True), filename)
+    s = read_stash_binary(filename)
+    s.acquisitions[0].comment = "bought on a café's wifi"
+    s.dispositions[1].asset_amount = 0.5
+    write_stash_binary_file(s, filename) # while s is still mapped from it
+    s2 = read_stash_binary(filename)
+    assert s2.acquisitions[0].comment == "bought on a café's wifi"
+    assert s2.to_json_dict() == s.to_json_dict()
+    s2.update()
+
+def test_binary_empty(tmp_path):
+    filename = str(tmp_path / "test.stash")
+    write_stash_binary_file(Stash("ETH", "empty"), filename)
+    s = read_stash_binary(filename)
+    assert len(s.acquisitions) == 0 and len(s.dispositions) == 0
+    assert s.asset == "ETH"
+
+def test_binary_not_binary(tmp_path):
+    filename = tmp_path / "test.json"
+    filename.write_text(json.dumps(STASH_JSON_DICT_1))
+    assert not is_binary_stash(str(filename))
+    with pytest.raises(ValueError):
+        read_stash_binary(str(filename))
+
+@pytest.mark.parametrize("compression", [None, "gzip", "lzma"])
+@pytest.mark.parametrize("columnar", [True, False])
+def test_json_file_round_trip(tmp_path, compression, columnar):
+    filename = str(tmp_path / "test.json")
+    write_stash_json_file(Stash.from_json_dict(STASH_JSON_DICT_1, columnar=columnar), filename, compression)
+    assert stash_compression(filename) == compression
+    calls = []
+    s = read_stash_file(filename, progress=lambda done, total: calls.append((done, total)))
+    assert s.to_json_dict() == Stash.from_json_dict(STASH_JSON_DICT_1).to_json_dict()
+    assert calls[-1][1] == os.path.getsize(filename)
+    assert 0 < calls[-1][0] <= calls[-1][1]
+    assert [name for name in os.listdir(tmp_path)] == ["test.json"] # no temporary file left over
+
+@pytest.mark.parametrize("write", [write_stash_binary_file, write_stash_json_file])
+def test_save_keeps_file_mode(tmp_path, write):
+    filename = str(tmp_path / "test.stash")
+    write(Stash.from_json_dict(STASH_JSON_DICT_1), filename)
+    assert os.stat(filename).st_mode & 0o777 == 0o666 & ~UMASK # a new file gets the usual mode, not mkstemp's 0600
+    os.chmod(filename, 0o640)
+    write(Stash.from_json_dict(STASH_JSON_DICT_1), filename)
+    assert os.stat(filename).st_mode & 0o777 == 0o640
+
+def test_snapshot_stash():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1)
+    snapshot = snapshot_stash(s)
+    s.acquisitions[0].disabled = True
+    s.dispositions.pop()
+    s.adjustment_rules.append("wash_sale")
+    assert snapshot.to_json_dict() == Stash.from_json_dict(STASH_JSON_DICT_1).to_json_dict()
@@ -0,0 +1,189 @@
+import sys
+import os
+import json
+import threading
+import pytest
+from typing import List, Dict, Any
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.stash_io import read_stash_file, is_binary_stash, stash_compression
+from models.stash_journal import StashJournal
+
+from stash_test_data import STASH_JSON_DICT_1
+
+def _journal_with_stash(tmp_path, binary: bool = True) -> StashJournal:
+    journal = StashJournal(str(tmp_path / ("test.stash" if binary else "test.json")))
+    journal.compact(Stash.from_json_dict(STASH_JSON_DICT_1), binary)
+    return journal
+
+def _make_changes(journal: StashJournal, stash: Stash) -> None:
+    """Add, edit, toggle and delete, as TxTableModel reports them, and change a setting"""
+    added = Acquisition(stash.acquisitions[0].timestamp + 60, "BTC", 1.0, 500.0, 0.0, "added", "")
+    journal.on_transaction_changed(None, added)
+    stash.acquisitions.insert(1, added)
+
+    edited = added.duplicate()
+    edited.asset_amount = 2.0
+    edited.comment = "edited"
+    journal.on_transaction_changed(added, edited)
+    stash.acquisitions[1] = edited
+
+    disp = stash.dispositions[0]
+    disp.disabled = True
+    journal.on_transaction_changed(disp, disp)
+
+    journal.on_transaction_changed(stash.dispositions[1], None)
+    del stash.dispositions[1]
+
+    stash.title = "Renamed"
+    journal.save_settings(stash)
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_journal_replay(tmp_path, binary):
+    with _journal_with_stash(tmp_path, binary) as journal:
+        stash = journal.load_stash()
+        base_size = os.path.getsize(journal.filename)
+        _make_changes(journal, stash)
+        assert os.path.getsize(journal.filename) == base_size # only the journal was written
+        assert journal.entry_count == 5
+    assert is_binary_stash(journal.filename) == binary
+
+    with StashJournal(journal.filename) as reopened:
+        replayed = reopened.load_stash()
+        assert replayed.to_json_dict() == stash.to_json_dict()
+        assert replayed.dispositions[0].disabled
+        replayed.update()
+
+def test_journal_started_by_first_change(tmp_path):
+    filename = str(tmp_path / "test.stash")
+    _journal_with_stash(tmp_path).close()
+    os.unlink(filename + ".journal")
+    with StashJournal(filename) as journal:
+        stash = journal.load_stash()
+        assert not os.path.exists(journal.journal_filename) # opening a stash writes nothing
+        _make_changes(journal, stash)
+        assert journal.entry_count == 5
+    with StashJournal(filename) as reopened:
+        assert reopened.load_stash().to_json_dict() == stash.to_json_dict()
+
+def test_journal_not_writable(tmp_path, monkeypatch):
+    journal = _journal_with_stash(tmp_path)
+    journal.close()
+    os.unlink(journal.journal_filename)
+    def no_write(*args, **kwargs):
+        raise PermissionError("read-only")
+    monkeypatch.setattr("tempfile.mkstemp", no_write)
+    with StashJournal(journal.filename) as readonly:
+        stash = readonly.load_stash()
+        _make_changes(readonly, stash) # edits go on, just unjournaled
+        assert not readonly.journaling
+        assert readonly.entry_count == 0
+    assert not os.path.exists(journal.journal_filename)
+
+def test_journal_compact(tmp_path):
+    with _journal_with_stash(tmp_path) as journal:
+        stash = journal.load_stash()
+        _make_changes(journal, stash)
+        journal.compact(stash)
+        assert journal.entry_count == 0
+        assert read_stash_file(journal.filename).to_json_dict() == stash.to_json_dict()
+    with StashJournal(journal.filename) as reopened:
+        assert reopened.load_stash().to_json_dict() == stash.to_json_dict()
+
+def test_journal_stale_after_compaction(tmp_path):
+    with _journal_with_stash(tmp_path) as journal:
+        stash = journal.load_stash()
+        _make_changes(journal, stash)
+    with open(journal.journal_filename) as f:
+        old_journal = f.read()
+    with StashJournal(journal.filename) as reopened:
+        reopened.compact(reopened.load_stash())
+    # as if compaction wrote the base and then crashed before starting the new journal
+    with open(journal.journal_filename, "w") as f:
+        f.write(old_journal)
+    with StashJournal(journal.filename) as reopened:
+        assert reopened.load_stash().to_json_dict() == stash.to_json_dict()
+        assert reopened.entry_count == 0
+
+def test_journal_torn_last_line(tmp_path):
+    with _journal_with_stash(tmp_path) as journal:
+        stash = journal.load_stash()
+        _make_changes(journal, stash)
+        journal.add_many([Disposition(stash.dispositions[-1].timestamp + 60, "BTC", 0.1, 900.0, 0.0, "lost", "")])
+    with open(journal.journal_filename, "r+") as f:
+        f.truncate(os.path.getsize(journal.journal_filename) - 20) # crashed partway through the last write
+    with StashJournal(journal.filename) as reopened:
+        assert reopened.load_stash().to_json_dict() == stash.to_json_dict()
+
+def test_journal_damaged(tmp_path):
+    with _journal_with_stash(tmp_path) as journal:
+        stash = journal.load_stash()
+        _make_changes(journal, stash)
+    with open(journal.journal_filename) as f:
+        lines = f.read().split("\n")
+    lines[2] = lines[2][:10]
+    with open(journal.journal_filename, "w") as f:
+        f.write("\n".join(lines))
+    with pytest.raises(ValueError):
+        StashJournal(journal.filename).load_stash()
+
+def test_journal_not_in_base(tmp_path):
+    with _journal_with_stash(tmp_path) as journal:
+        stash = journal.load_stash()
+        missing = Acquisition(1.0, "BTC", 1.0, 1.0, 0.0, "never added", "")
+        journal.on_transaction_changed(missing, None)
+    with pytest.raises(ValueError):
+        StashJournal(journal.filename).load_stash()
+
+def test_journal_identical_transactions(tmp_path):
+    """Transactions imported twice are separate rows: each op takes one of them"""
+    with _journal_with_stash(tmp_path) as journal:
+        stash = journal.load_stash()
+        twin = Acquisition(stash.acquisitions[0].timestamp + 60, "BTC", 1.0, 500.0, 0.0, "twin", "")
+        twins = [twin, twin.duplicate(), twin.duplicate()]
+        journal.add_many(twins)
+        stash.acquisitions[1:1] = twins
+        journal.compact(stash) # the twins are in the base file now
+
+    with StashJournal(journal.filename) as journal:
+        stash = journal.load_stash()
+        assert sum(acq.reference == "twin" for acq in stash.acquisitions) == 3
+        for _ in range(2):
+            idx = next(idx for idx, acq in enumerate(stash.acquisitions) if acq.reference == "twin")
+            journal.on_transaction_changed(stash.acquisitions[idx], None)
+            del stash.acquisitions[idx]
+        last = next(acq for acq in stash.acquisitions if acq.reference == "twin")
+        last.disabled = True
+        journal.on_transaction_changed(last, last)
+
+    with StashJournal(journal.filename) as reopened:
+        replayed = reopened.load_stash()
+        assert [acq.disabled for acq in replayed.acquisitions if acq.reference == "twin"] == [True]
+        assert replayed.to_json_dict() == stash.to_json_dict()
+
+@pytest.mark.parametrize("new_file", [False, True])
+def test_journal_background_compaction(tmp_path, new_file):
+    if new_file:
+        journal = StashJournal(str(tmp_path / "new.json.gz"))
+        stash = Stash.from_json_dict(STASH_JSON_DICT_1)
+    else:
+        journal = _journal_with_stash(tmp_path)
+        stash = journal.load_stash()
+    with journal:
+        snapshot = journal.begin_compaction(stash)
+        with pytest.raises(ValueError):
+            journal.begin_compaction(stash)
+        writer = threading.Thread(target=journal.write_base, args=(snapshot, False, "gzip"))
+        writer.start()
+        _make_changes(journal, stash) # while the base is being written
+        writer.join()
+        journal.end_compaction()
+        assert journal.entry_count == 5
+        assert stash_compression(journal.filename) == "gzip"
+        assert read_stash_file(journal.filename).to_json_dict() == snapshot.to_json_dict()
+    with StashJournal(journal.filename) as reopened:
+        assert reopened.load_stash().to_json_dict() == stash.to_json_dict()
+        reopened.compact(stash) # keeps the format
+        assert stash_compression(journal.filename) == "gzip"
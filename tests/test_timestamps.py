@@ -0,0 +1,72 @@
+import sys
+import copy
+import pytest
+from datetime import datetime, timezone
+from typing import List, Dict, Any
+
+import dateparser
+import numpy as np
+
+from models.stash import Stash
+from models.timestamps import TimestampParser, DATEPARSER_SETTINGS, detect_format, parse_timestamp
+
+from stash_test_data import STASH_JSON_DICT_2
+
+@pytest.mark.parametrize("text", ["12/01/2015 14:19:00", "2016-12-27 14:14:00 UTC", "03/12/2022 12:34:56+0000",
+                                  "2021-03-04T05:06:07.123Z", "2021-03-04T05:06:07-05:00", "25/12/2020 10:00", "2020-02-29"])
+def test_parse_matches_dateparser(text):
+    expected = dateparser.parse(text, settings=DATEPARSER_SETTINGS).timestamp()
+    parser = TimestampParser()
+    assert parser.parse(text) == pytest.approx(expected)
+    assert parser.fallback_count == 0
+    assert parse_timestamp(text) == pytest.approx(expected)
+
+def test_parse_fallback():
+    parser = TimestampParser("us")
+    assert parser.parse("December 1, 2015 2:19 PM") == datetime(2015, 12, 1, 14, 19, tzinfo=timezone.utc).timestamp()
+    assert parser.fallback_count == 1
+    with pytest.raises(ValueError):
+        parser.parse("not a date")
+
+def test_parse_timestamp_independent():
+    # an edit doesn't pick up the format of one typed earlier
+    assert parse_timestamp("25/12/2020") == datetime(2020, 12, 25, tzinfo=timezone.utc).timestamp()
+    assert parse_timestamp("03/11/2022") == datetime(2022, 3, 11, tzinfo=timezone.utc).timestamp()
+    assert parse_timestamp("03/11/2022") == dateparser.parse("03/11/2022", settings=DATEPARSER_SETTINGS).timestamp()
+
+def test_detect_format():
+    assert detect_format(["12/01/2015 14:19:00", "13/01/2015 14:19:00"]) == "day_first"
+    assert detect_format(["12/01/2015 14:19:00"]) == "us"
+    assert detect_format(["2015-12-01"]) == "iso"
+    assert detect_format(["whenever"]) is None
+
+def test_parse_many():
+    values = ["12/01/2015 14:19:00", "02/29/2016 00:00:01", 1451316900.0, "2/3/2020 1:02:03",
+              "02/30/2016 00:00:00", "2016-12-27 14:14:00 UTC", "12/31/1969 23:59:59"]
+    parser = TimestampParser()
+    with pytest.raises(ValueError): # Feb 30th, which the vectorized path must not let through either
+        parser.parse_many(values)
+    del values[4]
+    expected = [v if not isinstance(v, str) else TimestampParser().parse(v) for v in values]
+    assert TimestampParser().parse_many(values).tolist() == expected
+
+def test_parse_many_fractions_and_offsets():
+    values = ["2021-03-04T05:06:07.125+01:00", "2021-03-04T05:06:08.500+01:00"]
+    assert TimestampParser().parse_many(values).tolist() == [TimestampParser().parse(v) for v in values]
+
+def test_parse_epoch_strings():
+    values = [str(1451316900 + 60 * i) for i in range(2000)] + ["1451316900.25", " -86400 ", "12/01/2015 14:19:00"]
+    parser = TimestampParser()
+    timestamps = parser.parse_many(values)
+    assert timestamps[:2000].tolist() == [1451316900.0 + 60 * i for i in range(2000)]
+    assert timestamps[2000:].tolist() == [1451316900.25, -86400.0, TimestampParser().parse("12/01/2015 14:19:00")]
+    assert parser.fallback_count == 0
+    assert parser.parse("1451316900") == 1451316900.0
+    assert parser.fallback_count == 0
+
+def test_stash_with_string_timestamps():
+    jd = copy.deepcopy(STASH_JSON_DICT_2)
+    stash = Stash.from_json_dict(jd)
+    assert stash.acquisitions[0].timestamp == datetime(2015, 12, 1, 14, 19, tzinfo=timezone.utc).timestamp()
+    columnar = Stash.from_json_dict(copy.deepcopy(STASH_JSON_DICT_2), columnar=True)
+    assert columnar.to_json_dict() == stash.to_json_dict()
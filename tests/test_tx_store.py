@@ -0,0 +1,55 @@
+import sys
+import pytest
+from typing import List, Dict, Any
+
+import numpy as np
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash
+from models.tx_store import TxStore
+
+from stash_test_data import TEST_ACQ_1, TEST_ACQ_2, TEST_DISP_1, TEST_DISP_2, STASH_JSON_DICT_1
+
+
+def test_tx_store_from_json_dicts():
+    store = TxStore.from_json_dicts(Acquisition, "BTC", [TEST_ACQ_2, TEST_ACQ_1])
+    assert len(store) == 2
+    a = store[0]
+    assert isinstance(a, Acquisition)
+    assert a.timestamp == TEST_ACQ_2["timestamp"]
+    assert a.asset_amount == TEST_ACQ_2["asset_amount"]
+    assert a.reference == TEST_ACQ_2["reference"]
+    assert a.disabled == False
+
+    store.sort_by_timestamp()
+    assert [tx.reference for tx in store] == [TEST_ACQ_1["reference"], TEST_ACQ_2["reference"]]
+    assert store.column("asset_amount").sum() == pytest.approx(TEST_ACQ_1["asset_amount"] + TEST_ACQ_2["asset_amount"])
+
+def test_tx_store_invalid_values():
+    with pytest.raises(ValueError, match="Negative asset amount"):
+        TxStore.from_json_dicts(Acquisition, "BTC", [TEST_ACQ_1, dict(TEST_ACQ_2, asset_amount=-1.0)])
+    store = TxStore.from_json_dicts(Disposition, "BTC", [TEST_DISP_1])
+    with pytest.raises(ValueError, match="Negative fees"):
+        store[0].fees = -1.0
+
+def test_tx_store_list_ops():
+    store = TxStore.from_json_dicts(Disposition, "BTC", [TEST_DISP_1])
+    store.append(Disposition.from_json_dict(TEST_DISP_2))
+    assert len(store) == 2
+    store[0] = Disposition.from_json_dict(dict(TEST_DISP_1, comment="edited"))
+    assert store[0].comment == "edited"
+    store[1].disabled = True
+    assert list(store.enabled_mask()) == [True, False]
+    del store[0]
+    assert len(store) == 1
+    assert store[0].reference == TEST_DISP_2["reference"]
+
+def test_tx_store_stash():
+    s = Stash.from_json_dict(STASH_JSON_DICT_1, columnar=True)
+    s.update()
+    ref = Stash.from_json_dict(STASH_JSON_DICT_1)
+    ref.update()
+    assert [a.lot_number for a in s.acquisitions] == [1, 2]
+    assert [st.balance for st in s.states] == pytest.approx([st.balance for st in ref.states])
+    assert s.to_json_dict() == ref.to_json_dict()
@@ -11,6 +11,8 @@ from typing import List, Dict
 from PySide6.QtCore import Qt, QAbstractTableModel
 
 from src.models.transaction import Transaction, TxTableModel
+from src.models.acquisition import Acquisition
+from models.tx_store import TxStore, Acquisition as StoreAcquisition # the class TxStore checks rows against
 
 from dateparser import parse
 
@@ -119,3 +121,54 @@ def test_model_toggle_disabled(test_table_model):
     pass
 
 
+
+def test_model_insert_transaction(test_table_model):
+    between = Transaction(TIMESTAMP_A + 60, ASSET_A, 0.5, 3100.0, 0.0, "TX3", "In between")
+    assert test_table_model.insert_transaction(between) == 1
+    last = Transaction(TIMESTAMP_B, ASSET_A, 0.5, 3100.0, 0.0, "TX4", "Same time as B")
+    assert test_table_model.insert_transaction(last) == 3
+    assert [tx.reference for tx in test_table_model.transactionsList] == [REFERENCE_A, "TX3", REFERENCE_B, "TX4"]
+
+def test_model_transaction_changed():
+    # edits go through duplicate(), which plain Transactions don't have
+    test_table_model = TestTxTableModel(ASSET_A, [
+        Acquisition(TIMESTAMP_A, ASSET_A, ASSET_AMOUNT_A, ASSET_PRICE_A, FEES_A, REFERENCE_A, COMMENT_A),
+        Acquisition(TIMESTAMP_B, ASSET_B, ASSET_AMOUNT_B, ASSET_PRICE_B, FEES_B, REFERENCE_B, COMMENT_B)
+    ])
+    changes = []
+    test_table_model.transaction_changed.connect(lambda old, new: changes.append((old, new)))
+    added = Acquisition(TIMESTAMP_A + 60, ASSET_A, 0.5, 3100.0, 0.0, "TX3", "In between")
+    test_table_model.insert_transaction(added)
+    test_table_model.edit_row(1)
+    test_table_model.edit_buff.comment = "edited"
+    test_table_model.accept_edit()
+    test_table_model.toggle_disabled(0)
+    deleted = test_table_model.transactionsList[2]
+    test_table_model.delete_transaction(2)
+    assert changes[0] == (None, added)
+    assert changes[1][0] is added and changes[1][1].comment == "edited"
+    assert changes[2][0] is changes[2][1] and changes[2][1].disabled
+    assert changes[3] == (deleted, None)
+    assert test_table_model.rowCount() == 2
+
+def test_model_transaction_changed_tx_store():
+    """The old transaction of a change is the row as it was, not a view of whatever is in its place now"""
+    store = TxStore.from_transactions(StoreAcquisition, ASSET_A, [
+        StoreAcquisition(TIMESTAMP_A, ASSET_A, ASSET_AMOUNT_A, ASSET_PRICE_A, FEES_A, REFERENCE_A, COMMENT_A),
+        StoreAcquisition(TIMESTAMP_B, ASSET_B, ASSET_AMOUNT_B, ASSET_PRICE_B, FEES_B, REFERENCE_B, COMMENT_B)
+    ])
+    test_table_model = TestTxTableModel(ASSET_A, store)
+    changes = []
+    test_table_model.transaction_changed.connect(lambda old, new: changes.append((old.to_json_dict(), old, new)))
+
+    test_table_model.edit_row(1)
+    test_table_model.edit_buff.comment = "edited"
+    test_table_model.accept_edit()
+    test_table_model.toggle_disabled(1)
+    test_table_model.delete_transaction(0)
+
+    (edit_jd, edit_old, edit_new), (toggle_jd, toggle_old, toggle_new), (delete_jd, delete_old, _) = changes
+    assert edit_jd["comment"] == edit_old.comment == COMMENT_B and edit_new.comment == "edited"
+    assert toggle_old is toggle_new and toggle_old.disabled and toggle_old.comment == "edited"
+    assert delete_jd["reference"] == delete_old.reference == REFERENCE_A
+    assert [tx.reference for tx in store] == [REFERENCE_B]
@@ -0,0 +1,43 @@
+import sys
+import pytest
+from typing import List, Dict, Any
+
+import numpy as np
+
+from models.acquisition import Acquisition
+from models.disposition import Disposition
+from models.stash import Stash, LotState
+from models.valuation import OpenLots, UnrealizedGains, unrealized_gains
+
+def _stash() -> Stash:
+    acqs = [Acquisition(1000.0, "BTC", 1.0, 100.0, 0.0, "a1", ""),
+            Acquisition(2000.0, "BTC", 2.0, 200.0, 0.0, "a2", "")]
+    disps = [Disposition(3000.0, "BTC", 1.5, 250.0, 0.0, "d1", "")]
+    s = Stash("BTC", "valuation", acqs, disps)
+    s.update()
+    return s
+
+def test_open_lots_from_stash():
+    s = _stash()
+    lots = OpenLots.from_stash(s, [500.0, 1500.0, 2500.0, 3500.0])
+    assert lots.point_idx.tolist() == [1, 2, 2, 3]
+    assert lots.lot_number.tolist() == [1, 1, 2, 2]
+    assert lots.amount.tolist() == pytest.approx([1.0, 1.0, 2.0, 1.5])
+
+def test_unrealized_gains():
+    s = _stash()
+    year = LotState.ONE_YEAR_SECS
+    timestamps = [500.0, 2500.0, 3500.0, 2000.0 + 2 * year]
+    prices = [50.0, 300.0, 400.0, 150.0]
+    ug = unrealized_gains(s, timestamps, prices)
+    assert ug.gains.tolist() == pytest.approx([200.0, 200.0, 300.0, -75.0])
+    assert ug.short_term.tolist() == pytest.approx([0.0, 400.0, 300.0, 0.0])
+    assert ug.long_term.tolist() == pytest.approx([0.0, 0.0, 0.0, -75.0])
+    assert ug.total.tolist() == pytest.approx([0.0, 400.0, 300.0, -75.0])
+    assert ug.total_value.tolist() == pytest.approx([0.0, 900.0, 600.0, 225.0])
+    assert ug.total_value - ug.total_basis == pytest.approx(ug.total)
+    assert s.as_of(3500.0).open_cost_basis == pytest.approx(ug.total_basis[2])
+
+def test_unrealized_gains_price_mismatch():
+    with pytest.raises(ValueError):
+        UnrealizedGains(OpenLots.from_stash(_stash(), [1500.0, 2500.0]), [1.0])